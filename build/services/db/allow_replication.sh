@@ -0,0 +1,3 @@
+#!/bin/bash
+# Lets the local replica (docker compose --profile replica) stream from us
+echo "host replication all all trust" >> "$PGDATA/pg_hba.conf"
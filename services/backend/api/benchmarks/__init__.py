@@ -0,0 +1,3 @@
+"""
+Load benchmarks for the API's hot paths, see ``python -m benchmarks --help``.
+"""
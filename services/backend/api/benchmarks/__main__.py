@@ -0,0 +1,179 @@
+"""
+Benchmarks for the API's hot paths.
+
+    python -m benchmarks run --output results.json --baseline baseline.json
+    python -m benchmarks compare baseline.json results.json
+
+Run from the service directory against a Postgres the settings point at,
+see README.md.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+# Rate limits would turn most logins into 429s
+os.environ.setdefault("LOGIN_RATE_LIMIT_IP_PER_MINUTE", "0")
+os.environ.setdefault("LOGIN_RATE_LIMIT_EMAIL_PER_MINUTE", "0")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def run(args: argparse.Namespace) -> dict:
+    import httpx
+    import psutil
+
+    from piccolo.table import create_db_tables
+
+    from shared.app import app, lifespan
+    from shared.lib.routes.fast import API_PREFIX
+    from shared.tables.sessions import Session
+    from shared.tables.task import Task
+    from shared.tables.users import User
+
+    from benchmarks.harness import ResourceSampler, Server, run_load
+    from benchmarks.scenarios import SCENARIOS, Context, prepare
+
+    names = args.scenarios.split(",") if args.scenarios else None
+    selected = [s for s in SCENARIOS if names is None or s.name in names]
+    unknown = set(names or []) - {s.name for s in selected}
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "small_rows": args.small_rows,
+            "large_rows": args.large_rows,
+        },
+        "scenarios": {},
+    }
+
+    server = Server(args.port, args.workers, args.server_log)
+    async with lifespan(app):
+        await create_db_tables(Task, User, Session, if_not_exists=True)
+        if any(scenario.http for scenario in selected):
+            await server.start(f"{API_PREFIX}/status")
+
+        try:
+            async with httpx.AsyncClient(
+                base_url=server.base_url,
+                limits=httpx.Limits(max_connections=args.concurrency),
+                timeout=30,
+            ) as client:
+                ctx = Context(client, args.small_rows, args.large_rows)
+                for scenario in selected:
+                    print(f"{scenario.name}: preparing", file=sys.stderr)
+                    call = await prepare(ctx, scenario)
+                    sampler = ResourceSampler(
+                        server.processes
+                        if scenario.http
+                        else lambda: [psutil.Process()]
+                    )
+                    result = await run_load(
+                        call, args.concurrency, args.duration, args.warmup, sampler
+                    )
+                    if scenario.writes:
+                        ctx.task_rows = None
+
+                    results["scenarios"][scenario.name] = result
+                    latency = result["latency_ms"]
+                    print(
+                        f"{scenario.name}: {result['throughput_rps']} req/s, "
+                        f"p50 {latency['p50']}ms, p95 {latency['p95']}ms, "
+                        f"p99 {latency['p99']}ms, {result['errors']} errors",
+                        file=sys.stderr,
+                    )
+        finally:
+            server.stop()
+
+    return results
+
+
+def report_regressions(results: dict, baseline_path: str, tolerance: float) -> int:
+    from benchmarks.harness import compare
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    if not regressions:
+        print(f"No regressions against {baseline_path}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the scenarios")
+    run_parser.add_argument(
+        "--scenarios", help="Comma separated scenario names, all by default"
+    )
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds measured"
+    )
+    run_parser.add_argument(
+        "--warmup", type=float, default=2.0, help="Seconds before measuring"
+    )
+    run_parser.add_argument("--small-rows", type=int, default=10_000)
+    run_parser.add_argument("--large-rows", type=int, default=1_000_000)
+    run_parser.add_argument("--port", type=int, default=9100)
+    run_parser.add_argument("--output", default="benchmark-results.json")
+    run_parser.add_argument("--server-log", default="benchmark-server.log")
+    run_parser.add_argument("--baseline", help="Results to compare against")
+    run_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed slowdown as a fraction, 0.1 being 10%%",
+    )
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare results against a baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.results) as f:
+            results = json.load(f)
+        return report_regressions(results, args.baseline, args.tolerance)
+
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        return report_regressions(results, args.baseline, args.tolerance)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Load generation, resource sampling and baseline comparison.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import typing as t
+
+import httpx
+import psutil
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A request, raising on failure
+Call = t.Callable[[int], t.Awaitable[None]]
+
+
+def percentile(sorted_values: t.Sequence[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class ResourceSampler(object):
+    """
+    CPU and peak RSS of a set of processes while a scenario runs.
+
+    CPU is the share of one core used over the whole run, so a busy worker
+    reads close to 100.
+    """
+
+    def __init__(self, processes: t.Callable[[], t.List[psutil.Process]]):
+        self.processes = processes
+        self._start: t.Dict[int, float] = {}
+        self._peak_rss: t.Dict[int, int] = {}
+        self._started_at = 0.0
+        self._task: t.Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _cpu(process: psutil.Process) -> float:
+        times = process.cpu_times()
+        return times.user + times.system
+
+    async def __aenter__(self) -> "ResourceSampler":
+        self._started_at = time.monotonic()
+        for process in self.processes():
+            self._start[process.pid] = self._cpu(process)
+        self._task = asyncio.create_task(self._sample_rss())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        elapsed = time.monotonic() - self._started_at
+
+        self.workers = []
+        for process in self.processes():
+            if process.pid not in self._start:
+                continue
+            try:
+                cpu = self._cpu(process) - self._start[process.pid]
+                rss = process.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+            self.workers.append(
+                {
+                    "pid": process.pid,
+                    "cpu_percent": round(100 * cpu / elapsed, 1),
+                    "rss_mb": round(
+                        max(rss, self._peak_rss.get(process.pid, 0)) / 2**20, 1
+                    ),
+                }
+            )
+
+    async def _sample_rss(self) -> None:
+        while True:
+            for process in self.processes():
+                try:
+                    rss = process.memory_info().rss
+                except psutil.NoSuchProcess:
+                    continue
+                self._peak_rss[process.pid] = max(
+                    self._peak_rss.get(process.pid, 0), rss
+                )
+            await asyncio.sleep(0.25)
+
+
+async def run_load(
+    call: Call,
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    sampler: ResourceSampler,
+) -> dict:
+    """
+    Run ``call`` from ``concurrency`` loops, warming up first, and measure
+    for ``duration`` seconds
+    """
+    counter = iter(range(sys.maxsize))
+    latencies: t.List[float] = []
+    errors = 0
+    measuring = False
+    deadline = time.monotonic() + warmup
+
+    async def loop() -> None:
+        nonlocal errors
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                await call(next(counter))
+                failed = False
+            except Exception:
+                failed = True
+            if measuring:
+                latencies.append(time.perf_counter() - start)
+                errors += failed
+
+    if warmup > 0:
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+
+    measuring = True
+    async with sampler:
+        started = time.monotonic()
+        deadline = started + duration
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            name: round(percentile(latencies, fraction) * 1000, 2)
+            for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+        },
+        "workers": sampler.workers,
+    }
+
+
+def expect_ok(response: httpx.Response) -> None:
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.url} -> {response.status_code}")
+
+
+class Server(object):
+    """
+    ``shared.app:app`` under uvicorn in a subprocess
+    """
+
+    def __init__(self, port: int, workers: int, log_path: str):
+        self.port = port
+        self.workers = workers
+        self.log_path = log_path
+        self.process: t.Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def processes(self) -> t.List[psutil.Process]:
+        """
+        The processes serving requests: the workers, or the server itself
+        when it runs a single worker in process
+        """
+        try:
+            parent = psutil.Process(self.process.pid)
+            children = parent.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        workers = [
+            child
+            for child in children
+            if "resource_tracker" not in " ".join(child.cmdline())
+        ]
+        return workers or [parent]
+
+    async def start(self, status_path: str, timeout: float = 60.0) -> None:
+        command = [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "shared.app:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(self.port),
+            "--workers",
+            str(self.workers),
+            "--no-access-log",
+            "--log-level",
+            "warning",
+        ]
+        self.log_file = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            command,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stdout=self.log_file,
+            stderr=subprocess.STDOUT,
+        )
+
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.base_url) as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"The server exited, see {self.log_path}")
+                try:
+                    if (await client.get(status_path)).status_code == 200:
+                        # Give the other workers a moment to come up too
+                        await asyncio.sleep(1)
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.25)
+        raise RuntimeError(f"The server didn't start in {timeout}s")
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.log_file.close()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> t.List[str]:
+    """
+    The scenarios that regressed by more than ``tolerance``, a fraction, in
+    throughput or p95/p99 latency
+    """
+    regressions = []
+    for name, before in baseline["scenarios"].items():
+        after = results["scenarios"].get(name)
+        if after is None:
+            continue
+
+        if after["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {before['throughput_rps']} -> "
+                f"{after['throughput_rps']} req/s"
+            )
+        for key in ("p95", "p99"):
+            was, now = before["latency_ms"][key], after["latency_ms"][key]
+            if now > was * (1 + tolerance):
+                regressions.append(f"{name}: {key} {was} -> {now} ms")
+        error_rate = after["errors"] / max(1, after["requests"])
+        if error_rate > before["errors"] / max(1, before["requests"]) + 0.001:
+            regressions.append(
+                f"{name}: errors {before['errors']} -> {after['errors']}"
+            )
+    return regressions
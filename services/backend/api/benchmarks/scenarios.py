@@ -0,0 +1,201 @@
+"""
+Seeding and the scripted scenarios.
+
+HTTP scenarios go through the server.  Login and session lookups have no
+route of their own, so they call ``User.login`` and ``Session.get_user_id``
+in the benchmark process, which runs the app's lifespan so pools, caches
+and background tasks are set up as they are in a worker.
+"""
+
+import random
+import typing as t
+
+import httpx
+
+from shared.lib.routes.fast import API_PREFIX
+from shared.lib.routes.pagination import encode_cursor
+from shared.tables.sessions import Session
+from shared.tables.task import Task
+from shared.tables.users import User
+
+from benchmarks.harness import Call, expect_ok
+
+TASKS_PATH = f"{API_PREFIX}/tasks"
+BENCH_EMAIL = "bench-{}@example.com"
+BENCH_PASSWORD = "bench-password"
+
+
+class Context(object):
+    def __init__(self, client: httpx.AsyncClient, small_rows: int, large_rows: int):
+        self.client = client
+        self.small_rows = small_rows
+        self.large_rows = large_rows
+        self.random = random.Random(42)
+        # Rows the task table was last seeded with, None once written to
+        # by a scenario
+        self.task_rows: t.Optional[int] = None
+        self.emails: t.List[str] = []
+        self.tokens: t.List[str] = []
+
+
+class Scenario(t.NamedTuple):
+    name: str
+    #: Rows to seed the task table with, "small" or "large", or None
+    task_rows: t.Optional[str]
+    #: Whether it runs against the server, rather than in process
+    http: bool
+    #: Whether it changes the task table
+    writes: bool
+    build: t.Callable[[Context], t.Awaitable[Call]]
+
+
+###############################################################################
+# Seeding
+
+
+async def seed_tasks(rows: int) -> None:
+    tablename = Task._meta.tablename
+    await Task.raw(f"TRUNCATE {tablename} RESTART IDENTITY").run()
+    await Task.raw(
+        f"INSERT INTO {tablename} (name, completed) "
+        "SELECT 'task ' || n, n % 2 = 0 FROM generate_series(1, {}) AS n",
+        rows,
+    ).run()
+    await Task.raw(f"ANALYZE {tablename}").run()
+
+
+async def seed_users(ctx: Context, count: int) -> None:
+    if ctx.emails:
+        return
+
+    ctx.emails = [BENCH_EMAIL.format(n) for n in range(count)]
+    await User.delete().where(User.email.is_in(ctx.emails)).run()
+    # One hash shared by every user, hashing each would take minutes
+    password = await User.hash_password_async(BENCH_PASSWORD)
+    await User.insert(
+        *[User(email=email, password=password) for email in ctx.emails]
+    ).run()
+
+
+async def seed_sessions(ctx: Context, count: int) -> None:
+    if ctx.tokens:
+        return
+
+    await seed_users(ctx, 100)
+    rows = await User.select(User.id).where(User.email.is_in(ctx.emails))
+    user_ids = [row["id"] for row in rows]
+    for n in range(count):
+        session = await Session.create_session(user_ids[n % len(user_ids)])
+        ctx.tokens.append(str(session.id))
+
+
+###############################################################################
+# Scenarios
+
+
+async def index(ctx: Context) -> Call:
+    rows = ctx.task_rows
+
+    async def call(_: int) -> None:
+        after = encode_cursor(ctx.random.randint(1, rows))
+        expect_ok(
+            await ctx.client.get(TASKS_PATH, params={"limit": 50, "after": after})
+        )
+
+    return call
+
+
+async def get_by_pk(ctx: Context) -> Call:
+    rows = ctx.task_rows
+
+    async def call(_: int) -> None:
+        pk = ctx.random.randint(1, rows)
+        expect_ok(await ctx.client.get(f"{TASKS_PATH}/{pk}"))
+
+    return call
+
+
+async def put_by_pk(ctx: Context) -> Call:
+    rows = ctx.task_rows
+
+    async def call(n: int) -> None:
+        pk = ctx.random.randint(1, rows)
+        expect_ok(
+            await ctx.client.put(
+                f"{TASKS_PATH}/{pk}",
+                json={"name": f"task {n}", "completed": n % 2 == 0},
+            )
+        )
+
+    return call
+
+
+async def post(ctx: Context) -> Call:
+    async def call(n: int) -> None:
+        expect_ok(
+            await ctx.client.post(
+                TASKS_PATH, json={"name": f"task {n}", "completed": False}
+            )
+        )
+
+    return call
+
+
+async def delete_by_pk(ctx: Context) -> Call:
+    # Every call deletes a different row, newest first
+    rows = ctx.task_rows
+
+    async def call(n: int) -> None:
+        expect_ok(await ctx.client.delete(f"{TASKS_PATH}/{rows - n}"))
+
+    return call
+
+
+async def user_login(ctx: Context) -> Call:
+    await seed_users(ctx, 100)
+
+    async def call(n: int) -> None:
+        email = ctx.emails[n % len(ctx.emails)]
+        if await User.login(email, BENCH_PASSWORD, ip="127.0.0.1") is None:
+            raise RuntimeError(f"Login failed for {email}")
+
+    return call
+
+
+async def session_get_user_id(ctx: Context) -> Call:
+    await seed_sessions(ctx, 1000)
+
+    async def call(_: int) -> None:
+        token = ctx.random.choice(ctx.tokens)
+        if await Session.get_user_id(token) is None:
+            raise RuntimeError("Session lookup failed")
+
+    return call
+
+
+SCENARIOS = [
+    Scenario("index_small", "small", http=True, writes=False, build=index),
+    Scenario("index_large", "large", http=True, writes=False, build=index),
+    Scenario("get_by_pk", "large", http=True, writes=False, build=get_by_pk),
+    Scenario("put_by_pk", "large", http=True, writes=True, build=put_by_pk),
+    Scenario("post", "large", http=True, writes=True, build=post),
+    Scenario("delete_by_pk", "large", http=True, writes=True, build=delete_by_pk),
+    Scenario("user_login", None, http=False, writes=False, build=user_login),
+    Scenario(
+        "session_get_user_id",
+        None,
+        http=False,
+        writes=False,
+        build=session_get_user_id,
+    ),
+]
+
+
+async def prepare(ctx: Context, scenario: Scenario) -> Call:
+    if scenario.task_rows is not None:
+        rows = ctx.small_rows if scenario.task_rows == "small" else ctx.large_rows
+        if ctx.task_rows != rows:
+            await seed_tasks(rows)
+            ctx.task_rows = rows
+
+    return await scenario.build(ctx)
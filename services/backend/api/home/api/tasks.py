@@ -1,8 +1,31 @@
-
 from shared.lib.routes.crud import CrudRoutes
 from shared.tables.task import Task
 
+# Managed by the job queue, see shared.lib.jobs
+JOB_COLUMNS = (
+    "payload",
+    "status",
+    "priority",
+    "attempts",
+    "max_attempts",
+    "run_at",
+    "lease_expires_at",
+    "last_error",
+)
+
 
 class TaskRoutes(CrudRoutes):
     PATH = "/tasks"
-    DB_MODEL = Task
\ No newline at end of file
+    DB_MODEL = Task
+    METHODS = CrudRoutes.METHODS + ["CHANGES"]
+    # Workers update these constantly, which isn't news to clients
+    CHANGES_IGNORE_FIELDS = JOB_COLUMNS
+
+    @classmethod
+    async def _before_write(cls, values: dict) -> dict:
+        # Omitted job columns keep their defaults, or current values on PUT
+        return {
+            key: value
+            for key, value in values.items()
+            if value is not None or key not in JOB_COLUMNS
+        }
@@ -1,8 +1,15 @@
-
 from shared.lib.routes.crud import CrudRoutes
 from shared.tables.users import User
 
 
 class UserRoutes(CrudRoutes):
     PATH = "/users"
-    DB_MODEL = User
\ No newline at end of file
+    DB_MODEL = User
+
+    @classmethod
+    async def _before_write(cls, values: dict) -> dict:
+        # Hash on the pool so User.__init__/__setattr__ don't block the loop
+        password = values.get("password")
+        if password and not password.startswith("pbkdf2_sha256"):
+            values["password"] = await User.hash_password_async(password)
+        return values
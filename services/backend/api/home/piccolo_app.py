@@ -5,18 +5,56 @@ the APP_CONFIG.
 
 import os
 
-from piccolo.conf.apps import AppConfig, table_finder
-
+from piccolo.conf.apps import AppConfig, Command, table_finder
 
 CURRENT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 
 
+async def create_partitioned_sessions():
+    """
+    Create the sessions table partitioned by month, for a new database
+    """
+    from shared.tables.sessions import Session
+
+    await Session.create_partitioned_table()
+
+
+async def install_change_triggers():
+    """
+    Create the change log, and the triggers feeding it for every CrudRoutes
+    serving changes
+    """
+    from shared.lib.routes.crud import CrudRoutes
+    from shared.lib.routes.manifest import discover_route_classes
+    from shared.tables.changes import Change
+
+    await Change.create_table(if_not_exists=True)
+    await Change.install_function()
+    for route_class in discover_route_classes():
+        if issubclass(route_class, CrudRoutes) and "CHANGES" in route_class.METHODS:
+            await Change.watch(
+                route_class.DB_MODEL, ignore=route_class.CHANGES_IGNORE_FIELDS
+            )
+            print(f"Watching {route_class.DB_MODEL._meta.tablename}")
+
+
+async def create_job_indexes():
+    """
+    Create the partial indexes job workers poll the tasks table with
+    """
+    from shared.tables.task import Task
+
+    await Task.create_job_indexes()
+
+
 APP_CONFIG = AppConfig(
     app_name="home",
-    migrations_folder_path=os.path.join(
-        CURRENT_DIRECTORY, "piccolo_migrations"
-    ),
+    migrations_folder_path=os.path.join(CURRENT_DIRECTORY, "piccolo_migrations"),
     table_classes=table_finder(modules=["shared.tables"], exclude_imported=True),
     migration_dependencies=[],
-    commands=[],
+    commands=[
+        Command(create_partitioned_sessions),
+        Command(install_change_triggers),
+        Command(create_job_indexes),
+    ],
 )
@@ -1,16 +1,19 @@
-
 from home.settings import settings
 
 # Need this here so uvicorn can import it on reload
 from shared.app import app  # noqa
 import uvicorn
 
-
 if __name__ == "__main__":
-    uvicorn.run(
-        "shared.app:app",
-        host=settings.host,
-        port=settings.app_port,
-        reload=True,
-        log_level="debug",
-    )
+    if settings.server_mode == "production":
+        from shared.lib.server import run_production
+
+        run_production("shared.app:app")
+    else:
+        uvicorn.run(
+            "shared.app:app",
+            host=settings.host,
+            port=settings.app_port,
+            reload=True,
+            log_level="debug",
+        )
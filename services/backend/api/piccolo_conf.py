@@ -1,17 +1,15 @@
-from piccolo.engine.postgres import PostgresEngine
 from piccolo.conf.apps import AppRegistry
 from home.settings import settings
+from shared.lib.db import InstrumentedPostgresEngine, replica_nodes
 
-DB = PostgresEngine(
-    config={
-        "database": settings.db_name,
-        "user": settings.db_user,
-        "password": settings.db_password,
-        "host": settings.db_host,
-        "port": settings.db_port,
-    }
-)
+DB_CONFIG = {
+    "database": settings.db_name,
+    "user": settings.db_user,
+    "password": settings.db_password,
+    "host": settings.db_host,
+    "port": settings.db_port,
+}
 
-APP_REGISTRY = AppRegistry(
-    apps=["home.piccolo_app", "piccolo_admin.piccolo_app"]
-)
+DB = InstrumentedPostgresEngine(config=DB_CONFIG, extra_nodes=replica_nodes(DB_CONFIG))
+
+APP_REGISTRY = AppRegistry(apps=["home.piccolo_app", "piccolo_admin.piccolo_app"])
@@ -1,7 +1,6 @@
 from piccolo_conf import *  # noqa
 
-
-DB = PostgresEngine(
+DB = InstrumentedPostgresEngine(
     config={
         "database": "piccolo_project_test",
         "user": "postgres",
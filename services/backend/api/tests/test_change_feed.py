@@ -0,0 +1,135 @@
+import json
+from unittest import IsolatedAsyncioTestCase
+
+from home.api.tasks import JOB_COLUMNS
+from shared.lib.change_feed import ChangeEvent, ChangeFeed, format_event
+from shared.lib.exceptions import ServiceUnavailableException
+from shared.tables.changes import Change
+from shared.tables.task import Task
+
+
+def event(id: int, table: str = "task") -> ChangeEvent:
+    return ChangeEvent(id, table, "UPDATE", str(id))
+
+
+class TestChangeFeed(IsolatedAsyncioTestCase):
+    def setUp(self):
+        async def trim(retention):
+            return 0
+
+        self.feed = ChangeFeed(queue_size=2, max_subscribers=3, retention=60, trim=trim)
+        self.feed.connected = True
+
+    async def test_publish_to_table_subscribers(self):
+        tasks = self.feed.subscribe("task")
+        users = self.feed.subscribe("users")
+        self.feed.publish(event(1))
+        self.assertEqual(tasks.queue.get_nowait(), event(1))
+        self.assertTrue(users.queue.empty())
+
+    async def test_drops_slow_subscriber(self):
+        slow = self.feed.subscribe("task")
+        fast = self.feed.subscribe("task")
+        for id in (1, 2):
+            self.feed.publish(event(id))
+            fast.queue.get_nowait()
+        self.feed.publish(event(3))
+
+        self.assertTrue(slow.dropped)
+        self.assertFalse(fast.dropped)
+        self.assertEqual(fast.queue.get_nowait(), event(3))
+        self.assertEqual(self.feed.stats()["dropped"], 1)
+        self.assertEqual(self.feed.subscriber_count, 1)
+
+        # The dropped subscriber no longer gets events
+        self.feed.publish(event(4))
+        self.assertEqual(
+            [slow.queue.get_nowait() for _ in range(slow.queue.qsize())],
+            [event(1), event(2)],
+        )
+
+    async def test_listener_errors_dont_stop_delivery(self):
+        seen = []
+
+        def failing(event):
+            raise RuntimeError()
+
+        self.feed.add_listener(failing)
+        self.feed.add_listener(seen.append)
+        subscriber = self.feed.subscribe("task")
+        self.feed.publish(event(1))
+        self.assertEqual(seen, [event(1)])
+        self.assertEqual(subscriber.queue.qsize(), 1)
+
+    async def test_subscribe_limits(self):
+        for _ in range(3):
+            self.feed.subscribe("task")
+        with self.assertRaises(ServiceUnavailableException):
+            self.feed.subscribe("task")
+
+        self.feed.connected = False
+        with self.assertRaises(ServiceUnavailableException):
+            self.feed.subscribe("users")
+
+    async def test_notifications(self):
+        subscriber = self.feed.subscribe("task")
+        self.feed._on_notify(None, 0, "changes", "not json")
+        self.feed._on_notify(None, 0, "changes", json.dumps({"id": 1}))
+        self.feed._on_notify(
+            None,
+            0,
+            "changes",
+            json.dumps({"id": 2, "table": "task", "op": "DELETE", "pk": 5}),
+        )
+        self.assertEqual(
+            subscriber.queue.get_nowait(), ChangeEvent(2, "task", "DELETE", "5")
+        )
+        self.assertTrue(subscriber.queue.empty())
+
+    def test_format_event(self):
+        self.assertEqual(
+            format_event(event(7)),
+            b'id: 7\nevent: change\ndata: {"op": "UPDATE", "pk": "7", "table": "task"}\n\n',
+        )
+
+
+class TestChangeTriggers(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await Change.create_table(if_not_exists=True)
+        await Task.create_table(if_not_exists=True)
+        await Change.install_function()
+        await Change.watch(Task, ignore=JOB_COLUMNS)
+
+    async def asyncTearDown(self):
+        await Task.alter().drop_table(if_exists=True)
+        await Change.alter().drop_table(if_exists=True)
+
+    async def ops(self) -> list:
+        rows = await Change.select(Change.op).order_by(Change.id)
+        return [row["op"] for row in rows]
+
+    async def test_job_state_updates_skipped(self):
+        task_id = await Task.enqueue("work")
+        await Task.dequeue(["work"], 10, 60)
+        await Task.retry(task_id, 0, "boom")
+        self.assertEqual(await self.ops(), ["INSERT"])
+
+        await Task.update({Task.name: "renamed"}).where(Task.id == task_id)
+        # Marking it done changes ``completed`` too
+        await Task.complete([task_id])
+        await Task.delete().where(Task.id == task_id)
+        self.assertEqual(await self.ops(), ["INSERT", "UPDATE", "UPDATE", "DELETE"])
+
+    async def test_resume_after_everything_trimmed(self):
+        self.assertEqual(await Change.since("task", 0, 10), [])
+
+        task_id = await Task.enqueue("work")
+        await Task.delete().where(Task.id == task_id)
+        events = await Change.since("task", 0, 10)
+        self.assertEqual([event.op for event in events], ["INSERT", "DELETE"])
+
+        await Change.trim(retention=-60)
+        self.assertEqual(await Change.count(), 0)
+        # Changes after the client's id were trimmed, so it has to reload
+        self.assertIsNone(await Change.since("task", events[0].id, 10))
+        self.assertEqual(await Change.since("task", events[-1].id, 10), [])
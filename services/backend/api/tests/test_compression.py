@@ -0,0 +1,148 @@
+import asyncio
+import gzip
+import typing as t
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from starlette.datastructures import Headers
+from starlette.types import Message
+
+from shared.lib.compression import CompressionMiddleware, negotiate
+
+BODY = b'{"name": "task"}' * 200
+
+
+def make_app(
+    chunks: t.List[bytes],
+    status: int = 200,
+    headers: t.Optional[t.List[t.Tuple[bytes, bytes]]] = None,
+):
+    async def app(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": headers or [(b"content-type", b"application/json")],
+            }
+        )
+        for index, chunk in enumerate(chunks):
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": index < len(chunks) - 1,
+                }
+            )
+
+    return app
+
+
+class TestNegotiate(TestCase):
+    def test_highest_q_value(self):
+        self.assertEqual(negotiate("gzip;q=0.5, br", ["gzip", "br"]), "br")
+        self.assertEqual(negotiate("gzip, br;q=0.2", ["br", "gzip"]), "gzip")
+
+    def test_ties_go_to_server_preference(self):
+        self.assertEqual(negotiate("gzip, br", ["br", "gzip"]), "br")
+        self.assertEqual(negotiate("GZIP, br", ["gzip", "br"]), "gzip")
+
+    def test_wildcard(self):
+        self.assertEqual(negotiate("*", ["zstd", "gzip"]), "zstd")
+        self.assertEqual(negotiate("zstd;q=0, *", ["zstd", "gzip"]), "gzip")
+
+    def test_nothing_acceptable(self):
+        self.assertIsNone(negotiate("", ["gzip"]))
+        self.assertIsNone(negotiate("identity", ["gzip"]))
+        self.assertIsNone(negotiate("gzip;q=0", ["gzip"]))
+        self.assertIsNone(negotiate("gzip;q=high", ["gzip"]))
+
+
+class TestCompressionMiddleware(IsolatedAsyncioTestCase):
+    async def request(
+        self, app, accept_encoding: str = "gzip", minimum_size: int = 1024
+    ) -> t.Tuple[Headers, t.List[Message]]:
+        middleware = CompressionMiddleware(
+            app, minimum_size=minimum_size, encodings=["gzip"], levels={"gzip": 5}
+        )
+        messages = []
+
+        async def receive():
+            await asyncio.Future()
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [(b"accept-encoding", accept_encoding.encode())],
+        }
+        await middleware(scope, receive, send)
+        return Headers(raw=messages[0]["headers"]), messages[1:]
+
+    async def test_compresses_large_body(self):
+        headers, messages = await self.request(make_app([BODY]))
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertEqual(headers["vary"], "Accept-Encoding")
+        self.assertEqual(int(headers["content-length"]), len(messages[0]["body"]))
+        self.assertEqual(gzip.decompress(messages[0]["body"]), BODY)
+
+    async def test_small_body_sent_as_is(self):
+        headers, messages = await self.request(make_app([b"{}"]))
+        self.assertNotIn("content-encoding", headers)
+        self.assertEqual(headers["vary"], "Accept-Encoding")
+        self.assertEqual(messages[0]["body"], b"{}")
+
+    async def test_not_accepted(self):
+        headers, messages = await self.request(make_app([BODY]), accept_encoding="")
+        self.assertNotIn("content-encoding", headers)
+        self.assertEqual(headers["vary"], "Accept-Encoding")
+        self.assertEqual(messages[0]["body"], BODY)
+
+    async def test_streams_chunk_by_chunk(self):
+        chunks = [BODY[:10], BODY[10:2000], BODY[2000:], b""]
+        headers, messages = await self.request(make_app(chunks))
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertNotIn("content-length", headers)
+        # The first two chunks are held back until there is enough to
+        # compress, then each is flushed as it arrives
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(all(message["body"] for message in messages[:2]))
+        self.assertFalse(messages[-1]["more_body"])
+        body = b"".join(message["body"] for message in messages)
+        self.assertEqual(gzip.decompress(body), BODY)
+
+    async def test_short_stream_sent_as_is(self):
+        headers, messages = await self.request(make_app([b"[", b"]"]))
+        self.assertNotIn("content-encoding", headers)
+        self.assertEqual(
+            messages,
+            [{"type": "http.response.body", "body": b"[]", "more_body": False}],
+        )
+
+    async def test_weakens_etag(self):
+        headers, _ = await self.request(
+            make_app(
+                [BODY],
+                headers=[
+                    (b"content-type", b"application/json"),
+                    (b"etag", b'"1"'),
+                ],
+            )
+        )
+        self.assertEqual(headers["etag"], 'W/"1"')
+
+    async def test_passthrough(self):
+        for status, response_headers in (
+            (200, [(b"content-type", b"image/png")]),
+            (200, [(b"content-type", b"text/event-stream")]),
+            (200, [(b"content-encoding", b"br")]),
+            (200, [(b"cache-control", b"no-transform")]),
+            (304, [(b"etag", b'"1"')]),
+        ):
+            with self.subTest(status=status, headers=response_headers):
+                headers, messages = await self.request(
+                    make_app([BODY], status=status, headers=response_headers)
+                )
+                self.assertEqual(headers.raw, response_headers)
+                self.assertEqual(messages[0]["body"], BODY)
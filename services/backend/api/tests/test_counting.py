@@ -0,0 +1,43 @@
+from piccolo.testing.test_case import AsyncTableTest
+
+from shared.lib.db import track_request_queries
+from shared.lib.routes.caching import response_cache
+from shared.lib.routes.counting import RowCount, RowCounter
+from shared.tables.task import Task
+
+
+class TestRowCounter(AsyncTableTest):
+    tables = [Task]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        await Task.insert(*[Task(name=f"task {i % 2}") for i in range(20)])
+        await Task.raw("ANALYZE task")
+
+    async def test_exact_below_threshold(self):
+        counter = RowCounter(exact_threshold=100, ttl=0, max_entries=10)
+        self.assertEqual(await counter.count(Task), RowCount(20, estimated=False))
+        self.assertEqual(
+            await counter.count(Task, Task.name == "task 1"),
+            RowCount(10, estimated=False),
+        )
+
+    async def test_estimate_above_threshold(self):
+        counter = RowCounter(exact_threshold=5, ttl=0, max_entries=10)
+        self.assertEqual(await counter.count(Task), RowCount(20, estimated=True))
+
+        queries = track_request_queries("request")
+        result = await counter.count(Task, Task.name == "task 1")
+        self.assertTrue(result.estimated)
+        self.assertGreater(result.count, 5)
+        # EXPLAIN is a read, so doesn't pin the request to the primary
+        self.assertFalse(queries.wrote)
+
+    async def test_cached_until_written(self):
+        counter = RowCounter(exact_threshold=100, ttl=60, max_entries=10)
+        await counter.count(Task)
+        await Task.insert(Task(name="another"))
+        self.assertEqual((await counter.count(Task)).count, 20)
+
+        response_cache.invalidate(Task)
+        self.assertEqual((await counter.count(Task)).count, 21)
@@ -0,0 +1,196 @@
+from unittest import TestCase
+
+import httpx
+from fastapi import APIRouter, FastAPI
+from piccolo.testing.test_case import AsyncTableTest
+
+from home.api.tasks import TaskRoutes
+from shared.lib.routes.caching import etag_matches
+from shared.lib.routes.fast import API_PREFIX
+from shared.tables.task import Task
+
+
+def make_client() -> httpx.AsyncClient:
+    router = APIRouter()
+    TaskRoutes.register(router)
+    app = FastAPI()
+    app.include_router(router)
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    )
+
+
+class TestBulk(AsyncTableTest):
+    tables = [Task]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.ids = [
+            row["id"]
+            for row in await Task.insert(
+                *[Task(name=f"task {i}") for i in range(3)]
+            ).returning(Task.id)
+        ]
+        self.client = make_client()
+        self.path = f"{API_PREFIX}/tasks/bulk"
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await super().asyncTearDown()
+
+    async def test_delete_coerces_pks(self):
+        response = await self.client.request(
+            "DELETE", self.path, json=[str(self.ids[0]), self.ids[1]]
+        )
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(await Task.count(), 1)
+
+    async def test_delete_reports_bad_pks(self):
+        response = await self.client.request(
+            "DELETE", self.path, json=[self.ids[0], "abc", None]
+        )
+        self.assertEqual(response.status_code, 422, response.text)
+        self.assertEqual([item["index"] for item in response.json()["items"]], [1, 2])
+        self.assertEqual(await Task.count(), 3)
+
+    async def test_put_reports_bad_pks(self):
+        response = await self.client.put(
+            self.path,
+            json=[
+                {"id": self.ids[0], "name": "a", "completed": True},
+                {"id": "abc", "name": "b", "completed": True},
+                {"name": "c", "completed": True},
+            ],
+        )
+        self.assertEqual(response.status_code, 422, response.text)
+        self.assertEqual([item["index"] for item in response.json()["items"]], [1, 2])
+
+    async def test_put_coerces_pks(self):
+        response = await self.client.put(
+            self.path,
+            json=[{"id": str(self.ids[0]), "name": "renamed", "completed": True}],
+        )
+        self.assertEqual(response.status_code, 200, response.text)
+        row = await Task.select(Task.name).where(Task.id == self.ids[0]).first()
+        self.assertEqual(row["name"], "renamed")
+
+    async def test_put_mixed_job_columns(self):
+        # TaskRoutes drops job columns an item leaves out, so the items
+        # write different sets of columns
+        for first, second in ((0, 1), (1, 0)):
+            with self.subTest(first=first):
+                await Task.update({Task.status: "queued"}, force=True)
+                items = [
+                    {"id": self.ids[0], "name": "a", "completed": True},
+                    {
+                        "id": self.ids[1],
+                        "name": "b",
+                        "completed": True,
+                        "status": "done",
+                    },
+                ]
+                response = await self.client.put(
+                    self.path, json=[items[first], items[second]]
+                )
+                self.assertEqual(response.status_code, 200, response.text)
+                self.assertEqual(len(response.json()), 2)
+                rows = await Task.select(Task.id, Task.name, Task.status).where(
+                    Task.id.is_in(self.ids[:2])
+                )
+                self.assertEqual(
+                    {row["id"]: (row["name"], row["status"]) for row in rows},
+                    {self.ids[0]: ("a", "queued"), self.ids[1]: ("b", "done")},
+                )
+
+    async def test_delete_nothing(self):
+        response = await self.client.request("DELETE", self.path, json=[])
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.json(), [])
+
+
+class TestEtagMatches(TestCase):
+    def test_matches(self):
+        self.assertTrue(etag_matches('"a"', '"a"'))
+        self.assertTrue(etag_matches('"b", W/"a"', '"a"'))
+        self.assertTrue(etag_matches("*", '"a"'))
+
+    def test_no_match(self):
+        self.assertFalse(etag_matches(None, '"a"'))
+        self.assertFalse(etag_matches("", '"a"'))
+        self.assertFalse(etag_matches('"b"', '"a"'))
+
+
+class TestConditionalRequests(AsyncTableTest):
+    tables = [Task]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        rows = await Task.insert(Task(name="task")).returning(Task.id)
+        self.client = make_client()
+        self.path = f"{API_PREFIX}/tasks"
+        self.item_path = f"{self.path}/{rows[0]['id']}"
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await super().asyncTearDown()
+
+    async def test_get(self):
+        response = await self.client.get(self.item_path)
+        etag = response.headers["etag"]
+
+        response = await self.client.get(
+            self.item_path, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], etag)
+
+        await Task.update({Task.completed: True}, force=True)
+        response = await self.client.get(
+            self.item_path, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["etag"], etag)
+        self.assertTrue(response.json()["completed"])
+        self.assertNotIn("xmin", response.json())
+
+    async def test_get_missing(self):
+        response = await self.client.get(
+            f"{self.path}/0", headers={"If-None-Match": '"1"'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    async def test_index(self):
+        response = await self.client.get(self.path)
+        etag = response.headers["etag"]
+
+        response = await self.client.get(self.path, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        await Task.insert(Task(name="another"))
+        response = await self.client.get(self.path, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertNotIn("xmin", response.json()[0])
+
+    async def test_if_match(self):
+        etag = (await self.client.get(self.item_path)).headers["etag"]
+        body = {"name": "renamed", "completed": False}
+
+        response = await self.client.put(
+            self.item_path, json=body, headers={"If-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200, response.text)
+        new_etag = response.headers["etag"]
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(
+            (await self.client.get(self.item_path)).headers["etag"], new_etag
+        )
+
+        response = await self.client.put(
+            self.item_path, json=body, headers={"If-Match": etag}
+        )
+        self.assertEqual(response.status_code, 412)
+
+        response = await self.client.delete(self.item_path, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(await Task.count(), 1)
@@ -0,0 +1,109 @@
+from unittest import TestCase, mock
+
+from piccolo.engine import engine_finder
+from piccolo.querystring import QueryString
+from piccolo.testing.test_case import AsyncTableTest
+
+from shared.lib.db import (
+    SlowQueryLog,
+    _operation,
+    _writes,
+    slow_query_log,
+    track_request_queries,
+)
+from shared.lib.exceptions import ServiceUnavailableException
+from shared.tables.task import Task
+
+
+class TestSlowQueryLog(TestCase):
+    def test_keeps_most_recent(self):
+        log = SlowQueryLog(threshold_ms=0, size=2, max_param_length=5)
+        for index in range(3):
+            log.record(f"SELECT {index}", ["abcdefgh"], 1.0, "request")
+
+        entries = log.recent()
+        self.assertEqual(
+            [entry["query"] for entry in entries], ["SELECT 2", "SELECT 1"]
+        )
+        self.assertEqual(entries[0]["params"], ["'abcd"])
+
+    def test_operation(self):
+        self.assertEqual(_operation(QueryString("  select 1")), "SELECT")
+        self.assertEqual(_operation(QueryString("(SELECT 1)")), "OTHER")
+
+    def test_writes(self):
+        for sql, writes in (
+            ("INSERT INTO task VALUES (1)", True),
+            ("update task SET name = 'a'", True),
+            ("DELETE FROM task", True),
+            ("COPY task FROM STDIN", True),
+            ("SELECT * FROM task", False),
+            ("EXPLAIN (FORMAT JSON) {}", False),
+            ("SHOW statement_timeout", False),
+            ("WITH t AS (SELECT 1) SELECT * FROM t", False),
+            ("WITH d AS (DELETE FROM task RETURNING id) SELECT count(*) FROM d", True),
+        ):
+            querystring = QueryString(sql)
+            self.assertEqual(_writes(_operation(querystring), querystring), writes, sql)
+
+
+class TestRequestQueries(AsyncTableTest):
+    tables = [Task]
+
+    async def test_counts_queries(self):
+        queries = track_request_queries("request")
+        await Task.insert(Task(name="task"))
+        await Task.select()
+        self.assertEqual(queries.count, 2)
+        self.assertGreater(queries.total_ns, 0)
+
+    async def test_marks_writes(self):
+        queries = track_request_queries("request")
+        await Task.select()
+        await Task.count()
+        self.assertFalse(queries.wrote)
+        await Task.update({Task.completed: True}, force=True)
+        self.assertTrue(queries.wrote)
+
+    async def test_records_slow_queries(self):
+        threshold_ms = slow_query_log.threshold_ms
+        slow_query_log.threshold_ms = 0
+        try:
+            track_request_queries("slow request")
+            await Task.select().where(Task.name == "task")
+        finally:
+            slow_query_log.threshold_ms = threshold_ms
+
+        entry = slow_query_log.recent()[0]
+        self.assertEqual(entry["request_id"], "slow request")
+        self.assertEqual(entry["params"], ["'task'"])
+
+
+class TestPool(AsyncTableTest):
+    tables = [Task]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.engine = engine_finder()
+        await self.engine.start_connection_pool(min_size=1, max_size=1)
+
+    async def asyncTearDown(self):
+        await self.engine.close_connection_pool()
+        await super().asyncTearDown()
+
+    async def test_stats(self):
+        await self.engine.warm_up()
+        await Task.select()
+        stats = self.engine.pool_stats()
+        self.assertTrue(stats["running"])
+        self.assertEqual((stats["size"], stats["in_use"], stats["waiters"]), (1, 0, 0))
+
+    async def test_acquire_timeout(self):
+        connection = await self.engine.acquire()
+        try:
+            with mock.patch("shared.lib.db.settings.db_pool_acquire_timeout", 0.01):
+                with self.assertRaises(ServiceUnavailableException):
+                    await self.engine.acquire()
+            self.assertEqual(self.engine.pool_waiters, 0)
+        finally:
+            await self.engine.release(connection)
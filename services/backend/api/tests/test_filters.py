@@ -0,0 +1,107 @@
+from unittest import TestCase
+
+from piccolo.testing.test_case import AsyncTableTest
+
+from shared.lib.exceptions import ValidationException
+from shared.lib.routes.filters import (
+    cursor_value,
+    filterable_columns,
+    keyset_where,
+    parse_sort,
+    sortable_columns,
+)
+from shared.tables.task import Task
+from shared.tables.users import User
+
+
+def names(columns):
+    return [column._meta.name for column in columns]
+
+
+class TestColumns(TestCase):
+    def test_filter_defaults_to_indexed(self):
+        self.assertEqual(
+            names(filterable_columns(User._meta.columns, None)), ["id", "email"]
+        )
+        self.assertEqual(
+            names(filterable_columns(Task._meta.columns, None)), ["id", "name"]
+        )
+
+    def test_filter_opt_in(self):
+        columns = filterable_columns(
+            User._meta.columns, ["email", "active", "password"]
+        )
+        self.assertEqual(names(columns), ["email", "active"])
+        with self.assertRaises(ValueError):
+            filterable_columns(User._meta.columns, ["nope"])
+
+    def test_sort_defaults_to_indexed(self):
+        self.assertEqual(names(sortable_columns(User._meta.columns, None)), ["email"])
+        self.assertEqual(names(sortable_columns(Task._meta.columns, None)), ["name"])
+
+    def test_sort_opt_in(self):
+        self.assertEqual(
+            names(sortable_columns(User._meta.columns, ["created_at"])), ["created_at"]
+        )
+        with self.assertRaises(ValueError):
+            sortable_columns(User._meta.columns, ["last_login"])
+
+
+class TestParseSort(TestCase):
+    columns = [Task.id, Task.name]
+
+    def test_default(self):
+        self.assertEqual(parse_sort(None, self.columns, Task.id), (Task.id, True))
+
+    def test_descending(self):
+        column, ascending = parse_sort("-name", self.columns, Task.id)
+        self.assertIs(column, Task.name)
+        self.assertFalse(ascending)
+
+    def test_unknown(self):
+        with self.assertRaises(ValidationException):
+            parse_sort("priority", self.columns, Task.id)
+
+
+class TestKeysetWhere(AsyncTableTest):
+    tables = [Task]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        # Duplicate names, so the primary key has to break ties
+        await Task.insert(*[Task(name=f"task {i % 3}") for i in range(10)])
+
+    async def paginate(self, sort_column, ascending):
+        ordering = [Task.id] if sort_column is Task.id else [sort_column, Task.id]
+        seen, cursor = [], None
+        while True:
+            query = Task.select(Task.id, Task.name).order_by(
+                *ordering, ascending=ascending
+            )
+            if cursor is not None:
+                query = query.where(
+                    keyset_where(sort_column, ascending, Task.id, cursor)
+                )
+            rows = await query.limit(3)
+            if not rows:
+                return seen
+            seen += rows
+            cursor = cursor_value(rows[-1], sort_column, Task.id)
+
+    async def test_pages_match_full_sort(self):
+        for sort_column in (Task.id, Task.name):
+            for ascending in (True, False):
+                ordering = (
+                    [Task.id] if sort_column is Task.id else [sort_column, Task.id]
+                )
+                expected = await Task.select(Task.id, Task.name).order_by(
+                    *ordering, ascending=ascending
+                )
+                self.assertEqual(await self.paginate(sort_column, ascending), expected)
+
+    async def test_invalid_cursor(self):
+        for cursor in ("abc", ["task 1"], "not a list"):
+            with self.assertRaises(ValidationException):
+                keyset_where(Task.name, True, Task.id, cursor)
+        with self.assertRaises(ValidationException):
+            keyset_where(Task.id, True, Task.id, "abc")
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+from unittest import IsolatedAsyncioTestCase
+
+from shared.lib.exceptions import ServiceUnavailableException
+from shared.lib.hashing import HashingPool
+from shared.tables.users import User
+
+
+class TestHashingPool(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.pool = HashingPool(max_workers=2, max_queue=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    async def test_runs_off_the_event_loop(self):
+        thread = await self.pool.run(lambda: threading.current_thread().name)
+        self.assertTrue(thread.startswith("hashing"))
+        self.assertEqual(self.pool.stats()["completed"], 1)
+
+    async def test_matches_hash_password(self):
+        salt = "salt"
+        self.assertEqual(
+            await self.pool.run(User.hash_password, "password", salt, 1000),
+            User.hash_password("password", salt, 1000),
+        )
+
+    async def test_caps_concurrency(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def work():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        # Two run, two wait
+        await asyncio.gather(*(self.pool.run(work) for _ in range(4)))
+        self.assertEqual(max(peak), 2)
+
+    async def test_sheds_past_max_queue(self):
+        release = threading.Event()
+        calls = [asyncio.create_task(self.pool.run(release.wait)) for _ in range(4)]
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.pool.stats()["queue_depth"], 2)
+
+        with self.assertRaises(ServiceUnavailableException):
+            await self.pool.run(release.wait)
+        self.assertEqual(self.pool.stats()["shed"], 1)
+
+        release.set()
+        await asyncio.gather(*calls)
+        self.assertEqual(self.pool.stats()["in_flight"], 0)
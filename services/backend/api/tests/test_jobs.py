@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import typing as t
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from shared.lib.jobs import Job, JobQueue
+
+RUN_AT = datetime.datetime(2024, 1, 1)
+
+
+def job(id: int, name: str = "work", attempts: int = 1) -> Job:
+    return Job(id, name, {"id": id}, attempts, 3, RUN_AT)
+
+
+class FakeStore(object):
+    def __init__(self, jobs: t.List[Job]):
+        self.queued = list(jobs)
+        self.claims: t.List[int] = []
+        self.completed: t.List[t.Any] = []
+        self.retried: t.List[t.Tuple[t.Any, str]] = []
+        self.failed: t.List[t.Tuple[t.Any, str]] = []
+
+    async def dequeue(self, names, batch_size, lease):
+        self.claims.append(batch_size)
+        claimed = [job for job in self.queued if job.name in names][:batch_size]
+        for claimed_job in claimed:
+            self.queued.remove(claimed_job)
+        return claimed
+
+    async def complete(self, ids):
+        self.completed.extend(ids)
+
+    async def retry(self, job_id, delay, error):
+        self.retried.append((job_id, error))
+
+    async def fail(self, job_id, error):
+        self.failed.append((job_id, error))
+
+    async def requeue_expired(self):
+        return 0
+
+    async def queue_stats(self, names):
+        return len(self.queued), 0.0
+
+
+def make_queue(store, concurrency: int = 2, batch_size: int = 10) -> JobQueue:
+    return JobQueue(
+        store=store,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        poll_interval=0.01,
+        lease=60,
+        backoff_base=5,
+        backoff_max=60,
+        stats_interval=60,
+    )
+
+
+class TestBackoff(TestCase):
+    def test_doubles_with_jitter(self):
+        queue = make_queue(FakeStore([]))
+        with patch("shared.lib.jobs.random.uniform", lambda low, high: (low, high)):
+            self.assertEqual(queue.backoff(1), (2.5, 5))
+            self.assertEqual(queue.backoff(3), (10, 20))
+            # Capped at backoff_max
+            self.assertEqual(queue.backoff(10), (30, 60))
+
+    def test_within_bounds(self):
+        queue = make_queue(FakeStore([]))
+        for _ in range(100):
+            self.assertTrue(5 <= queue.backoff(2) <= 10)
+
+
+class TestJobQueue(IsolatedAsyncioTestCase):
+    async def test_claims_as_slots_free_up(self):
+        store = FakeStore([job(1), job(2), job(3)])
+        queue = make_queue(store)
+        release = {id: asyncio.Event() for id in (1, 2, 3)}
+
+        @queue.handler("work")
+        async def work(payload):
+            await release[payload["id"]].wait()
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+        # Only as many as can run at once
+        self.assertEqual(store.claims, [2])
+        self.assertEqual(queue.in_flight, 2)
+
+        # Finishing one marks it done and claims another, while the other
+        # is still running
+        release[1].set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(store.completed, [1])
+        self.assertEqual(store.claims[:2], [2, 1])
+        self.assertEqual(store.queued, [])
+
+        release[3].set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(store.completed, [1, 3])
+
+        # Stopping waits for the running job
+        release[2].set()
+        await queue.stop()
+        self.assertEqual(store.completed, [1, 3, 2])
+        self.assertEqual(queue.in_flight, 0)
+
+    async def test_retries_then_fails(self):
+        store = FakeStore([job(1, attempts=1), job(2, attempts=3)])
+        queue = make_queue(store)
+
+        @queue.handler("work")
+        async def work(payload):
+            raise RuntimeError("boom")
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+        self.assertEqual(store.completed, [])
+        self.assertEqual(store.retried, [(1, "RuntimeError: boom")])
+        self.assertEqual(store.failed, [(2, "RuntimeError: boom")])
+
+    async def test_only_claims_handled_jobs(self):
+        store = FakeStore([job(1, name="other"), job(2)])
+        queue = make_queue(store)
+
+        @queue.handler("work")
+        async def work(payload):
+            pass
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+        self.assertEqual(store.completed, [2])
+        self.assertEqual(store.queued, [job(1, name="other")])
+
+    async def test_completion_errors_dont_stop_the_worker(self):
+        store = FakeStore([job(1), job(2)])
+        queue = make_queue(store, concurrency=1)
+        completed = []
+
+        async def complete(ids):
+            if ids == [1]:
+                raise RuntimeError()
+            completed.extend(ids)
+
+        store.complete = complete
+
+        @queue.handler("work")
+        async def work(payload):
+            pass
+
+        await queue.start()
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        self.assertEqual(completed, [2])
+
+    def test_duplicate_handler(self):
+        queue = make_queue(FakeStore([]))
+        queue.handler("work")(lambda payload: None)
+        with self.assertRaises(ValueError):
+            queue.handler("work")(lambda payload: None)
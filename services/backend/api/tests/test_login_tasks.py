@@ -0,0 +1,103 @@
+import asyncio
+import datetime
+from unittest import IsolatedAsyncioTestCase, mock
+
+from piccolo.testing.test_case import AsyncTableTest
+
+from shared.lib.login_tasks import LoginTasks
+from shared.tables.users import User
+
+
+class TestLoginTasks(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.flushed = []
+        self.rehashed = []
+        self.fail_flush = False
+
+        async def flush(logins):
+            if self.fail_flush:
+                raise ConnectionError()
+            self.flushed.append(logins)
+
+        async def rehash(user_id, password):
+            self.rehashed.append((user_id, password))
+
+        self.tasks = LoginTasks(
+            flush_interval=60, max_rehash_queue=1, flush=flush, rehash=rehash
+        )
+
+    async def test_batches_logins(self):
+        first = datetime.datetime(2024, 1, 1)
+        second = datetime.datetime(2024, 1, 2)
+        self.tasks.record_login(1, first)
+        self.tasks.record_login(2, first)
+        self.tasks.record_login(1, second)
+        await self.tasks.flush_pending()
+        self.assertEqual(self.flushed, [{1: second, 2: first}])
+
+    async def test_failed_flush_keeps_newer_logins(self):
+        first = datetime.datetime(2024, 1, 1)
+        second = datetime.datetime(2024, 1, 2)
+        self.tasks.record_login(1, first)
+        self.fail_flush = True
+        await self.tasks.flush_pending()
+        self.tasks.record_login(1, second)
+        self.fail_flush = False
+        await self.tasks.flush_pending()
+        self.assertEqual(self.flushed, [{1: second}])
+
+    async def test_rehash_in_background(self):
+        await self.tasks.start()
+        self.tasks.schedule_rehash(1, "password")
+        # The queue holds one, the worker hasn't taken it yet
+        self.tasks.schedule_rehash(2, "password")
+        await asyncio.sleep(0.01)
+        await self.tasks.stop()
+
+        self.assertEqual(self.rehashed, [(1, "password")])
+        self.assertEqual(self.tasks.stats()["rehash_dropped"], 1)
+
+
+class TestLogin(AsyncTableTest):
+    tables = [User]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.user = await User.create_user("a@example.com", "password")
+        self.tasks = LoginTasks(
+            flush_interval=60,
+            max_rehash_queue=10,
+            flush=User.flush_last_logins,
+            rehash=User.update_password,
+        )
+        patcher = mock.patch("shared.tables.users.login_tasks", self.tasks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_last_login_written_on_flush(self):
+        self.assertEqual(
+            await User.login("a@example.com", "password", "1.1.1.1"), self.user.id
+        )
+        row = await User.select(User.last_login).first()
+        self.assertIsNone(row["last_login"])
+
+        await self.tasks.flush_pending()
+        row = await User.select(User.last_login).first()
+        self.assertIsNotNone(row["last_login"])
+
+    async def test_outdated_hash_rehashed(self):
+        await User.update(
+            {User.password: User.hash_password("password", iterations=1000)}, force=True
+        )
+        await self.tasks.start()
+        await User.login("a@example.com", "password", "1.1.1.1")
+        for _ in range(100):
+            if self.tasks.rehashed:
+                break
+            await asyncio.sleep(0.05)
+        await self.tasks.stop()
+
+        stored = (await User.select(User.password).first())["password"]
+        self.assertEqual(
+            int(User.split_stored_password(stored)[1]), User._pbkdf2_iteration_count
+        )
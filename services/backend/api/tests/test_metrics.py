@@ -0,0 +1,96 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+import httpx
+from fastapi import APIRouter, FastAPI
+from piccolo.testing.test_case import AsyncTableTest
+
+from home.api.tasks import TaskRoutes
+from shared.lib.metrics import REQUESTS_IN_FLIGHT, Registry
+from shared.lib.routes.fast import API_PREFIX, FastRoute
+from shared.tables.task import Task
+
+
+class TestRegistry(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_histogram(self):
+        histogram = self.registry.histogram(
+            "latency", "Latency.", ("route",), buckets=(0.1, 1)
+        )
+        for value in (0.05, 0.5, 5):
+            histogram.observe("/a", value=value)
+
+        lines = self.registry.render().splitlines()
+        self.assertEqual(
+            lines[:2], ["# HELP latency Latency.", "# TYPE latency histogram"]
+        )
+        self.assertIn('latency_bucket{route="/a",le="0.1"} 1', lines)
+        self.assertIn('latency_bucket{route="/a",le="1"} 2', lines)
+        self.assertIn('latency_bucket{route="/a",le="+Inf"} 3', lines)
+        self.assertIn('latency_count{route="/a"} 3', lines)
+        self.assertIn('latency_sum{route="/a"} 5.55', lines)
+
+    def test_label_escaping(self):
+        counter = self.registry.counter("errors", "Errors.", ("route",))
+        counter.inc('say "hi"\\')
+        self.assertIn('errors{route="say \\"hi\\"\\\\"} 1.0', self.registry.render())
+
+    def test_gauge_and_callback(self):
+        gauge = self.registry.gauge("in_flight", "In flight.")
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.registry.callback("pool", "Pool.", ("stat",), lambda: {("idle",): 3})
+
+        output = self.registry.render()
+        self.assertIn("in_flight 1.0", output)
+        self.assertIn('pool{stat="idle"} 3', output)
+
+    def test_stats(self):
+        self.registry.stats(
+            "cache",
+            "Cache size.",
+            lambda: {"size": 2, "hits": 5, "misses": 1},
+            counters=("hits", "misses"),
+            counter_documentation="Cache lookups.",
+        )
+
+        lines = self.registry.render().splitlines()
+        self.assertIn("# TYPE cache gauge", lines)
+        self.assertIn('cache{stat="size"} 2', lines)
+        self.assertIn("# TYPE cache_total counter", lines)
+        self.assertIn('cache_total{stat="hits"} 5', lines)
+        self.assertIn('cache_total{stat="misses"} 1', lines)
+        self.assertNotIn('cache{stat="hits"} 5', lines)
+
+    def test_duplicate_name(self):
+        self.registry.counter("errors", "Errors.")
+        with self.assertRaises(ValueError):
+            self.registry.gauge("errors", "Errors.")
+
+
+class TestRequestMetrics(AsyncTableTest):
+    tables = [Task]
+
+    async def test_in_flight_after_failed_logging(self):
+        path = f"{API_PREFIX}/tasks"
+        before = REQUESTS_IN_FLIGHT._values[(path, "GET")]
+
+        async def fail(self, request, response):
+            raise RuntimeError()
+
+        router = APIRouter()
+        TaskRoutes.register(router)
+        app = FastAPI()
+        app.include_router(router)
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://test"
+        )
+        with patch.object(FastRoute, "_after_request", fail):
+            with self.assertRaises(RuntimeError):
+                await client.get(path)
+        await client.aclose()
+
+        self.assertEqual(REQUESTS_IN_FLIGHT._values[(path, "GET")], before)
@@ -0,0 +1,105 @@
+import asyncio
+from unittest import TestCase
+
+from piccolo.engine import engine_finder
+from piccolo.testing.test_case import AsyncTableTest
+
+from shared.lib.exceptions import ServiceUnavailableException, ValidationException
+from shared.lib.routes.pagination import (
+    decode_cursor,
+    encode_cursor,
+    stream_rows,
+    stream_slots,
+)
+from shared.tables.task import Task
+
+
+async def read_body(response) -> bytes:
+    chunks = []
+
+    async def receive():
+        # The client stays connected
+        await asyncio.Future()
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+    return b"".join(chunks)
+
+
+class TestCursor(TestCase):
+    def test_round_trip(self):
+        for value in (1, "abc", [3, "x"], None):
+            self.assertEqual(decode_cursor(encode_cursor(value)), value)
+
+    def test_garbage(self):
+        with self.assertRaises(ValidationException):
+            decode_cursor("not a cursor!")
+
+
+class TestStreamRows(AsyncTableTest):
+    tables = [Task]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        await Task.insert(*[Task(name=f"task {i}") for i in range(5)])
+        self.engine = engine_finder()
+        await self.engine.start_connection_pool(min_size=1, max_size=2)
+
+    async def asyncTearDown(self):
+        await self.engine.close_connection_pool()
+        await super().asyncTearDown()
+
+    async def test_ndjson(self):
+        query = Task.select(Task.id, Task.name).order_by(Task.id)
+        body = await read_body(stream_rows(query, "ndjson", batch_size=2))
+        self.assertEqual(len(body.splitlines()), 5)
+
+    async def test_json(self):
+        query = Task.select(Task.id).order_by(Task.id)
+        body = await read_body(stream_rows(query, "json", batch_size=2))
+        self.assertEqual(body.count(b'"id"'), 5)
+        self.assertTrue(body.startswith(b"[") and body.endswith(b"]"))
+
+    async def test_connection_returned_to_pool(self):
+        for _ in range(3):
+            await read_body(stream_rows(Task.select(), "ndjson", batch_size=2))
+        self.assertEqual(self.engine.pool.get_idle_size(), self.engine.pool.get_size())
+        self.assertEqual(stream_slots.in_use, 0)
+
+    async def test_connection_returned_when_query_fails(self):
+        query = Task.select().where(Task.raw("1 / 0 = 1"))
+        with self.assertRaises(Exception):
+            await read_body(stream_rows(query, "ndjson", batch_size=2))
+        self.assertEqual(self.engine.pool.get_idle_size(), self.engine.pool.get_size())
+        self.assertEqual(stream_slots.in_use, 0)
+
+    async def test_unstarted_response_releases_slot(self):
+        # The client went away before the body was started
+        response = stream_rows(Task.select(), "ndjson", batch_size=2)
+        self.assertEqual(stream_slots.in_use, 1)
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            raise OSError("Gone")
+
+        with self.assertRaises(Exception):
+            await response(
+                {"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send
+            )
+        self.assertEqual(stream_slots.in_use, 0)
+
+    async def test_too_many_streams(self):
+        responses = [
+            stream_rows(Task.select(), "ndjson", batch_size=2)
+            for _ in range(stream_slots.limit)
+        ]
+        with self.assertRaises(ServiceUnavailableException):
+            stream_rows(Task.select(), "ndjson", batch_size=2)
+        for response in responses:
+            await read_body(response)
+        self.assertEqual(stream_slots.in_use, 0)
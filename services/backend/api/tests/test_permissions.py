@@ -0,0 +1,150 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+import httpx
+from fastapi import Depends, FastAPI
+from piccolo.testing.test_case import AsyncTableTest
+
+from shared.lib.permissions import ScopeIndex, ScopeResolver
+from shared.lib.routes.auth import require_scopes
+from shared.tables.role_scopes import RoleScope
+from shared.tables.roles import Role, scope_resolver
+from shared.tables.sessions import Session
+from shared.tables.user_group_roles import UserGroupRole
+from shared.tables.user_groups import UserGroup, UserGroupMember
+from shared.tables.users import User
+
+
+class TestScopeIndex(TestCase):
+    def test_bits(self):
+        index = ScopeIndex()
+        self.assertEqual(index.bit("a"), 1)
+        self.assertEqual(index.bit("b"), 2)
+        self.assertEqual(index.bit("a"), 1)
+        self.assertEqual(index.mask(["a", "b", "c"]), 7)
+        self.assertEqual(index.scopes(5), ["a", "c"])
+        self.assertEqual(index.mask([]), 0)
+
+
+class TestScopeResolver(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.scopes = {1: ["a", "b"], 2: ["b"]}
+        self.loads = []
+
+        async def load(user_id):
+            self.loads.append(user_id)
+            await asyncio.sleep(0.01)
+            return self.scopes.get(user_id, [])
+
+        self.resolver = ScopeResolver(ttl=60, max_size=2, load=load)
+
+    async def test_cached(self):
+        mask = self.resolver.index.mask(["a"])
+        self.assertTrue(await self.resolver.has_scopes(1, mask))
+        self.assertFalse(await self.resolver.has_scopes(2, mask))
+        self.assertTrue(await self.resolver.has_scopes(1, mask))
+        self.assertEqual(self.loads, [1, 2])
+
+    async def test_concurrent_misses_share_a_load(self):
+        masks = await asyncio.gather(*(self.resolver.resolve(1) for _ in range(5)))
+        self.assertEqual(len(set(masks)), 1)
+        self.assertEqual(self.loads, [1])
+
+    async def test_invalidate_user(self):
+        await self.resolver.resolve(1)
+        await self.resolver.resolve(2)
+        self.scopes[1] = []
+        self.resolver.invalidate(1)
+        self.assertEqual(await self.resolver.resolve(1), 0)
+        await self.resolver.resolve(2)
+        self.assertEqual(self.loads, [1, 2, 1])
+
+    async def test_invalidate_everyone(self):
+        await self.resolver.resolve(1)
+        await self.resolver.resolve(2)
+        self.resolver.invalidate()
+        await self.resolver.resolve(1)
+        await self.resolver.resolve(2)
+        self.assertEqual(self.loads, [1, 2, 1, 2])
+
+    async def test_invalidate_during_load(self):
+        # A load that started before the change is neither shared nor cached
+        stale = asyncio.create_task(self.resolver.resolve(1))
+        await asyncio.sleep(0)
+        self.scopes[1] = []
+        self.resolver.invalidate(1)
+        self.assertEqual(await self.resolver.resolve(1), 0)
+        await stale
+        self.assertEqual(await self.resolver.resolve(1), 0)
+        self.assertEqual(self.loads, [1, 1])
+
+    async def test_evicts_least_recently_used(self):
+        for user_id in (1, 2, 1, 3):
+            await self.resolver.resolve(user_id)
+        await self.resolver.resolve(2)
+        self.assertEqual(self.loads, [1, 2, 3, 2])
+
+
+class TestScopesForUser(AsyncTableTest):
+    tables = [
+        User,
+        Session,
+        Role,
+        RoleScope,
+        UserGroup,
+        UserGroupMember,
+        UserGroupRole,
+    ]
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        scope_resolver.invalidate()
+        self.user = await User.create_user("a@example.com", "password")
+        self.role = Role(name="editor")
+        await self.role.save()
+        group = UserGroup(name="editors")
+        await group.save()
+        await UserGroupMember.add(self.user.id, group.id)
+        await UserGroupRole.assign(group.id, self.role.id)
+
+        app = FastAPI()
+
+        @app.get("/tasks", dependencies=[Depends(require_scopes(["tasks:write"]))])
+        async def tasks():
+            return []
+
+        session = await Session.create_session(self.user.id)
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://test",
+            headers={"Authorization": f"Bearer {session.id}"},
+        )
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await super().asyncTearDown()
+
+    async def test_scopes_for_user(self):
+        self.assertEqual(await Role.scopes_for_user(self.user.id), [])
+        await RoleScope.grant(self.role.id, "tasks:read")
+        await RoleScope.grant(self.role.id, "tasks:write")
+        self.assertEqual(
+            sorted(await Role.scopes_for_user(self.user.id)),
+            ["tasks:read", "tasks:write"],
+        )
+
+        await User.update({User.active: False}, force=True)
+        self.assertEqual(await Role.scopes_for_user(self.user.id), [])
+
+    async def test_require_scopes(self):
+        self.assertEqual((await self.client.get("/tasks")).status_code, 403)
+
+        await RoleScope.grant(self.role.id, "tasks:write")
+        self.assertEqual((await self.client.get("/tasks")).status_code, 200)
+
+        await RoleScope.revoke(self.role.id, "tasks:write")
+        self.assertEqual((await self.client.get("/tasks")).status_code, 403)
+
+    async def test_require_scopes_without_session(self):
+        response = await self.client.get("/tasks", headers={"Authorization": ""})
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,79 @@
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+from piccolo.testing.test_case import AsyncTableTest
+
+from shared.lib.exceptions import (
+    ServiceUnavailableException,
+    TooManyRequestsException,
+)
+from shared.lib.rate_limit import MemoryBackend, RateLimit, RateLimiter, rate_limiter
+from shared.tables.users import User
+
+
+class TestRetryAfter(TestCase):
+    def test_rounds_up(self):
+        for retry_after, header in ((0.01, "1"), (1.0, "1"), (1.2, "2"), (59.5, "60")):
+            exc = TooManyRequestsException(retry_after=retry_after)
+            self.assertEqual(exc.headers, {"Retry-After": header})
+        self.assertIsNone(ServiceUnavailableException().headers)
+
+    def test_status(self):
+        exc = TooManyRequestsException()
+        self.assertEqual(exc.status_code, 429)
+        self.assertNotIsInstance(exc, ServiceUnavailableException)
+
+
+class TestMemoryBackend(IsolatedAsyncioTestCase):
+    async def test_burst_then_refill(self):
+        backend = MemoryBackend(max_keys=10)
+        with mock.patch("shared.lib.rate_limit.time.monotonic", return_value=100.0):
+            for _ in range(3):
+                self.assertEqual(await backend.take("key", rate=0.5, burst=3), 0)
+            self.assertEqual(await backend.take("key", rate=0.5, burst=3), 2.0)
+            # Other keys have their own bucket
+            self.assertEqual(await backend.take("other", rate=0.5, burst=3), 0)
+
+        with mock.patch("shared.lib.rate_limit.time.monotonic", return_value=102.0):
+            self.assertEqual(await backend.take("key", rate=0.5, burst=3), 0)
+            self.assertGreater(await backend.take("key", rate=0.5, burst=3), 0)
+
+    async def test_evicts_least_recently_used(self):
+        backend = MemoryBackend(max_keys=2)
+        for key in ("a", "b", "c"):
+            await backend.take(key, rate=1, burst=1)
+        self.assertEqual(list(backend._buckets), ["b", "c"])
+
+
+class TestRateLimiter(IsolatedAsyncioTestCase):
+    async def test_check(self):
+        limiter = RateLimiter(MemoryBackend(max_keys=10))
+        limit = RateLimit("test", per_minute=1, burst=1)
+        await limiter.check(limit, "a")
+        with self.assertRaises(TooManyRequestsException) as context:
+            await limiter.check(limit, "a")
+        self.assertEqual(context.exception.headers, {"Retry-After": "60"})
+
+        # No value, or no limit, isn't checked
+        await limiter.check(limit, None)
+        await limiter.check(RateLimit("off", per_minute=0, burst=1), "a")
+        await limiter.check(RateLimit("off", per_minute=0, burst=1), "a")
+
+
+class TestLoginRateLimit(AsyncTableTest):
+    tables = [User]
+
+    async def test_limited_per_ip_and_email(self):
+        backend = MemoryBackend(max_keys=100)
+        with mock.patch.object(rate_limiter, "backend", backend), mock.patch(
+            "shared.tables.users.LOGIN_BY_IP", RateLimit("login_ip", 0.6, 3)
+        ), mock.patch(
+            "shared.tables.users.LOGIN_BY_EMAIL", RateLimit("login_email", 0.6, 2)
+        ):
+            for _ in range(2):
+                self.assertIsNone(await User.login("a@example.com", "wrong", "1.1.1.1"))
+            with self.assertRaises(TooManyRequestsException):
+                await User.login("a@example.com", "wrong", "2.2.2.2")
+
+            self.assertIsNone(await User.login("b@example.com", "wrong", "1.1.1.1"))
+            with self.assertRaises(TooManyRequestsException):
+                await User.login("c@example.com", "wrong", "1.1.1.1")
@@ -0,0 +1,60 @@
+import asyncio
+import json
+from unittest import IsolatedAsyncioTestCase
+
+from shared.lib.request_logging import RequestLogger
+
+
+class TestRequestLogger(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.lines = []
+        self.logger = RequestLogger(
+            enabled=True,
+            sample_rate=1.0,
+            max_body_bytes=4,
+            queue_size=3,
+            batch_size=2,
+            flush_interval=0.01,
+            sink=self.lines.extend,
+        )
+
+    async def test_capture_truncates(self):
+        self.assertEqual(self.logger.capture(None), ("", False))
+        self.assertEqual(self.logger.capture("abcd"), ("abcd", False))
+        self.assertEqual(self.logger.capture(b"abcdef"), ("abcd", True))
+
+    async def test_drops_when_full(self):
+        for index in range(5):
+            self.logger.submit({"index": index})
+        self.assertEqual(self.logger.stats(), {"queued": 3, "written": 0, "dropped": 2})
+
+    async def test_writes_in_batches(self):
+        await self.logger.start()
+        for index in range(3):
+            self.logger.submit({"index": index})
+        await asyncio.sleep(0.1)
+        await self.logger.stop()
+
+        self.assertEqual([json.loads(line)["index"] for line in self.lines], [0, 1, 2])
+        self.assertEqual(self.logger.stats()["written"], 3)
+
+    async def test_stop_flushes_queue(self):
+        await self.logger.start()
+        await asyncio.sleep(0)
+        for index in range(3):
+            self.logger.submit({"index": index})
+        await self.logger.stop()
+        self.assertEqual(len(self.lines), 3)
+
+    async def test_tee_captures_stream(self):
+        async def body():
+            for chunk in (b"ab", "cd", b"ef"):
+                yield chunk
+
+        record = {}
+        chunks = [chunk async for chunk in self.logger.tee(body(), record)]
+
+        self.assertEqual(chunks, [b"ab", "cd", b"ef"])
+        self.assertEqual(record["response_body"], "abcd")
+        self.assertTrue(record["response_body_truncated"])
+        self.assertEqual(self.logger.queue.get_nowait(), record)
@@ -0,0 +1,72 @@
+import datetime
+from unittest import IsolatedAsyncioTestCase
+
+from shared.lib.session_cache import MISSING, CachedSession, SessionCache
+
+
+def _session(user_id: int = 1) -> CachedSession:
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    return CachedSession(user_id, now, now + datetime.timedelta(days=1))
+
+
+class TestSessionCache(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.flushed = []
+        self.fail_flush = False
+
+        async def flush(pending):
+            if self.fail_flush:
+                raise ConnectionError()
+            self.flushed.append(pending)
+
+        self.cache = SessionCache(
+            ttl=60, negative_ttl=0, max_size=2, flush_interval=60, flush=flush
+        )
+
+    def test_hit_and_miss(self):
+        session = _session()
+        self.assertIs(self.cache.get("a"), MISSING)
+        self.cache.put("a", session)
+        self.assertEqual(self.cache.get("a"), session)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_negative_entries_expire(self):
+        self.cache.put("bad", None)
+        self.assertIs(self.cache.get("bad"), MISSING)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put("a", _session(1))
+        self.cache.put("b", _session(2))
+        self.cache.get("a")
+        self.cache.put("c", _session(3))
+        self.assertIs(self.cache.get("b"), MISSING)
+        self.assertEqual(self.cache.get("a").user_id, 1)
+
+    async def test_flushes_extensions(self):
+        session = _session()
+        self.cache.extend("a", session)
+        self.assertEqual(self.cache.get("a"), session)
+
+        await self.cache.flush_pending()
+        self.assertEqual(self.flushed, [{"a": session.expiry_date}])
+        self.assertEqual(self.cache.stats()["pending_extensions"], 0)
+
+    async def test_failed_flush_keeps_newer_extensions(self):
+        old = _session()
+        new = old._replace(expiry_date=old.expiry_date + datetime.timedelta(hours=1))
+        self.cache.extend("a", old)
+        self.fail_flush = True
+        await self.cache.flush_pending()
+        self.cache.extend("a", new)
+        self.cache.extend("b", old)
+        self.fail_flush = False
+        await self.cache.flush_pending()
+        self.assertEqual(self.flushed, [{"a": new.expiry_date, "b": old.expiry_date}])
+
+    async def test_invalidate_drops_pending(self):
+        self.cache.extend("a", _session())
+        self.cache.invalidate("a")
+        await self.cache.stop()
+        self.assertIs(self.cache.get("a"), MISSING)
+        self.assertEqual(self.flushed, [])
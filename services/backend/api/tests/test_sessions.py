@@ -0,0 +1,38 @@
+import datetime
+from unittest import IsolatedAsyncioTestCase
+
+from shared.tables.sessions import Session
+from shared.tables.users import User
+
+
+class TestPartitionedSessions(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await User.create_table(if_not_exists=True)
+        await Session.create_partitioned_table()
+        self.user = await User.create_user("a@example.com", "password")
+
+    async def asyncTearDown(self):
+        await Session.raw("DROP TABLE IF EXISTS sessions CASCADE")
+        await User.alter().drop_table(if_exists=True)
+
+    async def count(self, tablename: str) -> int:
+        rows = await Session.raw(f"SELECT count(*) AS count FROM {tablename}")
+        return rows[0]["count"]
+
+    async def test_sessions_outside_partitions(self):
+        far = datetime.datetime.now() + datetime.timedelta(days=400)
+        await Session.create_session(self.user.id, max_expiry_date=far)
+        self.assertEqual(await self.count("sessions_default"), 1)
+
+        # Its month's partition takes it from the DEFAULT partition
+        await Session.ensure_partitions(months_ahead=15)
+        await Session.ensure_partitions(months_ahead=15)
+        self.assertEqual(await self.count("sessions_default"), 0)
+        self.assertEqual(
+            await self.count(Session._partition_name(far.date().replace(day=1))), 1
+        )
+        self.assertEqual(await Session.count(), 1)
+
+    async def test_default_partition_never_dropped(self):
+        self.assertEqual(await Session.drop_expired_partitions(), 0)
+        self.assertTrue(await Session._table_exists("sessions_default"))
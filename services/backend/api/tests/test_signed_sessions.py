@@ -0,0 +1,85 @@
+import time
+import uuid
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+from shared.lib.signed_sessions import RevocationList, TokenSigner
+from shared.tables import sessions
+from shared.tables.sessions import Session
+
+KEY = "k" * 32
+OTHER_KEY = "o" * 32
+
+
+class TestTokenSigner(TestCase):
+    def setUp(self):
+        self.signer = TokenSigner({"a": KEY}, "a")
+
+    def test_round_trip(self):
+        user_id = uuid.uuid4()
+        token, payload = self.signer.sign(user_id, 1234.5)
+        self.assertTrue(token.startswith("a."))
+        verified = self.signer.verify(token)
+        self.assertEqual(verified.user_id, str(user_id))
+        self.assertEqual(verified.token_id, payload.token_id)
+        self.assertEqual(verified.expires_at, 1234.5)
+
+    def test_tampered(self):
+        token, _ = self.signer.sign("user", 1234.5)
+        key_id, encoded, signature = token.split(".")
+        other, _ = self.signer.sign("other", 1234.5)
+        for bad in (
+            f"{key_id}.{other.split('.')[1]}.{signature}",
+            f"{key_id}.{encoded}.{signature[:-2]}",
+            f"b.{encoded}.{signature}",
+            "garbage",
+            "",
+        ):
+            self.assertIsNone(self.signer.verify(bad), bad)
+
+    def test_rotation(self):
+        old_token, _ = self.signer.sign("user", 1234.5)
+        rotated = TokenSigner({"a": KEY, "b": OTHER_KEY}, "b")
+        new_token, _ = rotated.sign("user", 1234.5)
+        self.assertTrue(new_token.startswith("b."))
+        self.assertIsNotNone(rotated.verify(old_token))
+        self.assertIsNone(self.signer.verify(new_token))
+
+    def test_rejects_bad_keys(self):
+        for keys, key_id in (
+            ({"a": KEY}, "b"),
+            ({"a.b": KEY}, "a.b"),
+            ({"a": ""}, "a"),
+            ({"a": "short"}, "a"),
+            ({"a": KEY, "b": "k" * 31}, "a"),
+        ):
+            with self.assertRaises(ValueError):
+                TokenSigner(keys, key_id)
+
+
+class TestSignedUserId(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.signer = TokenSigner({"a": KEY}, "a")
+        self.revocations = RevocationList(
+            sync_interval=60, store=mock.AsyncMock(), load=mock.AsyncMock()
+        )
+        for name, value in (
+            ("token_signer", self.signer),
+            ("revocation_list", self.revocations),
+        ):
+            patcher = mock.patch.object(sessions, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_returns_uuid(self):
+        user_id = uuid.uuid4()
+        token, _ = self.signer.sign(user_id, time.time() + 60)
+        self.assertEqual(await Session.get_user_id(token), user_id)
+
+    async def test_expired_or_revoked(self):
+        user_id = uuid.uuid4()
+        expired, _ = self.signer.sign(user_id, time.time() - 1)
+        self.assertIsNone(await Session.get_user_id(expired))
+
+        token, payload = self.signer.sign(user_id, time.time() + 60)
+        await self.revocations.revoke(payload)
+        self.assertIsNone(await Session.get_user_id(token))
@@ -0,0 +1,75 @@
+"""
+Runs background jobs from the tasks table, see shared.lib.jobs.
+
+    python worker.py
+
+Run as many as needed, they share the queue without blocking each other.
+SIGTERM stops claiming jobs and exits once the running ones finish.
+"""
+
+import asyncio
+import signal
+
+from home.settings import settings
+
+from shared.lib.db import open_database_connection_pool, close_database_connection_pool
+from shared.lib.metrics import registry
+from shared.tables.task import job_queue, load_job_modules
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def serve_metrics(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    """
+    Answers any request with the metrics, for scraping
+    """
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = registry.render().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {len(body)}\r\n".encode()
+            + b"Connection: close\r\n\r\n"
+            + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main() -> None:
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    load_job_modules()
+    await open_database_connection_pool()
+    metrics_server = None
+    if settings.job_worker_metrics_port:
+        metrics_server = await asyncio.start_server(
+            serve_metrics, settings.host, settings.job_worker_metrics_port
+        )
+
+    await job_queue.start()
+    logger.info(f"Running jobs: {', '.join(sorted(job_queue.handlers))}")
+    await stopping.wait()
+
+    logger.info("Stopping, waiting for running jobs")
+    await job_queue.stop()
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await close_database_connection_pool()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,22 @@
+from home.settings import settings
+from shared.lib.db import slow_query_log
+from shared.lib.exceptions import NotFoundException
+from shared.lib.routes.fast import FastRoute
+
+
+class GetSlowQueries(FastRoute):
+    PATH = "/debug/slow-queries"
+    METHOD = "GET"
+    SUMMARY = "Get Slow Queries Endpoint"
+    DESCRIPTION = "Most recent slow queries first, with their parameters."
+
+    @classmethod
+    async def endpoint(cls):
+        # Query parameters can hold user data, so this is off unless enabled
+        if not settings.enable_debug_endpoints:
+            raise NotFoundException()
+
+        return {
+            "threshold_ms": slow_query_log.threshold_ms,
+            "queries": slow_query_log.recent(),
+        }
@@ -0,0 +1,16 @@
+from fastapi.responses import PlainTextResponse
+
+from shared.lib.metrics import registry
+from shared.lib.routes.fast import FastRoute
+
+
+class GetMetrics(FastRoute):
+    PATH = "/metrics"
+    METHOD = "GET"
+    SUMMARY = "Get Metrics Endpoint"
+
+    @classmethod
+    async def endpoint(cls):
+        return PlainTextResponse(
+            registry.render(), media_type="text/plain; version=0.0.4"
+        )
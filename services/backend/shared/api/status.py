@@ -1,3 +1,5 @@
+from shared.lib.db import pool_stats
+from shared.lib.replicas import replica_router
 from shared.lib.routes.fast import FastRoute
 
 
@@ -8,4 +10,8 @@ class GetStatus(FastRoute):
 
     @classmethod
     async def endpoint(cls):
-        return {"status": "ok"}
+        return {
+            "status": "ok",
+            "db_pool": pool_stats(),
+            "db_replicas": replica_router.stats(),
+        }
@@ -3,32 +3,88 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
+from piccolo.engine import engine_finder
 
 from home.settings import settings
 
+from shared.lib.compression import CompressionMiddleware
 from shared.lib.db import open_database_connection_pool, close_database_connection_pool
+from shared.lib.hashing import hashing_pool
+from shared.lib.replicas import replica_router
+from shared.lib.request_logging import request_logger
+from shared.lib.routes.caching import response_cache
+from shared.tables.sessions import (
+    revocation_list,
+    session_cache,
+    session_reaper,
+    token_signer,
+)
+from shared.tables.changes import change_feed
+from shared.tables.task import job_queue, load_job_modules
+from shared.tables.users import login_tasks
 from shared.lib.routes import register_route_class, register_routes
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await open_database_connection_pool()
+    await replica_router.start(engine_finder())
+    await request_logger.start()
+    await session_cache.start()
+    if token_signer is not None:
+        await revocation_list.start()
+    await login_tasks.start()
+    await session_reaper.start()
+    if settings.crud_changes_enabled:
+        # Writes through other workers, or outside the API, invalidate too
+        change_feed.add_listener(
+            lambda event: response_cache.invalidate_tablename(event.table)
+        )
+        await change_feed.start(engine_finder())
+    if settings.job_worker_in_app:
+        load_job_modules()
+        await job_queue.start()
     yield
+    await job_queue.stop()
+    await change_feed.stop()
+    await session_reaper.stop()
+    await login_tasks.stop()
+    await revocation_list.stop()
+    await session_cache.stop()
+    await request_logger.stop()
+    await replica_router.stop()
     await close_database_connection_pool()
+    hashing_pool.shutdown()
 
 
+middleware = [
+    Middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_methods=["GET", "PUT", "PATCH", "POST", "DELETE", "OPTIONS"],
+        allow_headers=["*"],
+    )
+]
+if settings.compression_enabled:
+    middleware.append(
+        Middleware(
+            CompressionMiddleware,
+            minimum_size=settings.compression_minimum_size,
+            encodings=settings.compression_encodings,
+            levels={
+                "gzip": settings.compression_gzip_level,
+                "br": settings.compression_brotli_quality,
+                "zstd": settings.compression_zstd_level,
+            },
+        )
+    )
+
 app = FastAPI(
     title=settings.service_name,
+    openapi_url="/openapi.json" if settings.enable_swagger else None,
     docs_url="/docs" if settings.enable_swagger else None,
     redoc_url="/redoc" if settings.enable_swagger else None,
-    middleware=[
-        Middleware(
-            CORSMiddleware,
-            allow_origins=["*"],
-            allow_methods=["GET", "PUT", "POST", "DELETE", "OPTIONS"],
-            allow_headers=["*"],
-        )
-    ],
+    middleware=middleware,
     lifespan=lifespan,
 )
 
@@ -0,0 +1,208 @@
+"""
+Fan out of table change events to server-sent event subscribers.
+
+Triggers append every insert, update and delete on a watched table to the
+``changes`` log and NOTIFY the entry.  Each worker holds one LISTEN
+connection and hands events to its subscribers through bounded queues; a
+subscriber whose queue fills up is dropped rather than slowing everyone
+else down, and resumes from its last event id by replaying the log.
+
+Log ids are taken when a row is written, not when its transaction commits,
+so concurrent transactions can deliver ids slightly out of order.
+"""
+
+import asyncio
+import json
+import typing as t
+
+from shared.lib.exceptions import ServiceUnavailableException
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "changes"
+
+
+class ChangeEvent(t.NamedTuple):
+    id: int
+    table: str
+    #: INSERT, UPDATE or DELETE
+    op: str
+    pk: str
+
+
+class Subscriber(object):
+    def __init__(self, table: str, queue_size: int):
+        self.table = table
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+    def push(self, event: ChangeEvent) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def close(self) -> None:
+        self.dropped = True
+        # Wake the consumer if it's waiting
+        self.push(None)
+
+
+class ChangeFeed(object):
+    def __init__(
+        self,
+        queue_size: int,
+        max_subscribers: int,
+        retention: float,
+        trim: t.Callable[[float], t.Awaitable[int]],
+    ):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.retention = retention
+        self.trim = trim
+        self._listeners: t.List[t.Callable[[ChangeEvent], None]] = []
+
+        self._subscribers: t.Dict[str, t.Set[Subscriber]] = {}
+        self._tasks: t.List[asyncio.Task] = []
+        self.connected = False
+        self.events = 0
+        self.dropped = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def add_listener(self, listener: t.Callable[[ChangeEvent], None]) -> None:
+        """
+        Call ``listener`` with every change, on any table
+        """
+        self._listeners.append(listener)
+
+    def subscribe(self, table: str) -> Subscriber:
+        if not self.connected:
+            raise ServiceUnavailableException("Change feed unavailable.", retry_after=5)
+        if self.subscriber_count >= self.max_subscribers:
+            raise ServiceUnavailableException(
+                "Too many change feed subscribers.", retry_after=5
+            )
+
+        subscriber = Subscriber(table, self.queue_size)
+        self._subscribers.setdefault(table, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self._subscribers.get(subscriber.table)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.table]
+
+    def publish(self, event: ChangeEvent) -> None:
+        self.events += 1
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Change listener failed")
+
+        for subscriber in list(self._subscribers.get(event.table, ())):
+            if not subscriber.push(event):
+                # Too slow, it resumes from its last event id
+                self.dropped += 1
+                self.unsubscribe(subscriber)
+                subscriber.close()
+
+    def _close_subscribers(self) -> None:
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in list(subscribers):
+                subscriber.close()
+        self._subscribers = {}
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        try:
+            data = json.loads(payload)
+            event = ChangeEvent(
+                int(data["id"]), data["table"], data["op"], str(data["pk"])
+            )
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed change notification {payload!r}")
+            return
+        self.publish(event)
+
+    async def start(self, engine) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._listen(engine)),
+                asyncio.create_task(self._run_trim()),
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._close_subscribers()
+
+    async def _listen(self, engine) -> None:
+        while True:
+            lost = asyncio.Event()
+            connection = None
+            try:
+                connection = await engine.get_new_connection()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(CHANNEL, self._on_notify)
+                self.connected = True
+                await lost.wait()
+                logger.warning("Lost the change feed connection, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to listen for changes")
+            finally:
+                self.connected = False
+                # Events may be missed until we're back, subscribers resume
+                # from their last event id when they reconnect
+                self._close_subscribers()
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(1)
+
+    async def _run_trim(self) -> None:
+        while True:
+            try:
+                trimmed = await self.trim(self.retention)
+                if trimmed:
+                    logger.info(f"Trimmed {trimmed} changes from the log")
+            except Exception:
+                logger.exception("Failed to trim the change log")
+            await asyncio.sleep(min(60.0, self.retention))
+
+    def stats(self) -> dict:
+        return {
+            "connected": int(self.connected),
+            "subscribers": self.subscriber_count,
+            "events": self.events,
+            "dropped": self.dropped,
+        }
+
+
+def format_event(event: ChangeEvent) -> bytes:
+    data = json.dumps({"op": event.op, "pk": event.pk, "table": event.table})
+    return f"id: {event.id}\nevent: change\ndata: {data}\n\n".encode()
+
+
+def format_control(name: str) -> bytes:
+    """
+    An event telling the client to reconnect ("dropped") or to reload what
+    it has, as changes it missed are no longer available ("reset")
+    """
+    return f"event: {name}\ndata: {{}}\n\n".encode()
+
+
+HEARTBEAT = b": keepalive\n\n"
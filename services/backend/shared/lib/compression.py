@@ -0,0 +1,291 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+An ASGI middleware, so it sees the messages a response sends rather than
+the response object: route handling, including the request log capturing
+the body in ``FastRoute._after_request``, works on the uncompressed body,
+and streaming responses are compressed chunk by chunk as they are sent.
+Each chunk is flushed, so clients get rows as soon as they are produced.
+
+Bodies smaller than ``minimum_size`` are sent as they are.  A stream is
+held back only until that many bytes have arrived, or it ends.
+"""
+
+import asyncio
+import typing as t
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from shared.lib.metrics import registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_BYTES = registry.counter(
+    "http_compression_bytes_total",
+    "Response bytes before and after compression, by encoding.",
+    ("encoding", "stage"),
+)
+
+# Compressing this much at once would hold up the event loop, the
+# compressors release the GIL so it happens on a thread instead
+OFFLOAD_SIZE = 256 * 1024
+
+# Already compressed, or streams of small events that barely compress
+UNCOMPRESSIBLE_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/gzip",
+    "application/zip",
+    "application/zstd",
+    "application/x-bzip2",
+    "application/x-7z-compressed",
+    "application/octet-stream",
+    "text/event-stream",
+)
+
+
+class Compressor(t.Protocol):
+    def compress(self, data: bytes) -> bytes:
+        """
+        Compresses a chunk, flushed so it can be decompressed on arrival
+        """
+
+    def finish(self) -> bytes:
+        """
+        The end of the stream
+        """
+
+
+class GzipCompressor(object):
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor(object):
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(object):
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def available_encodings() -> t.Dict[str, t.Callable[[dict], Compressor]]:
+    encodings = {"gzip": lambda levels: GzipCompressor(levels["gzip"])}
+    if brotli is not None:
+        encodings["br"] = lambda levels: BrotliCompressor(levels["br"])
+    if zstandard is not None:
+        encodings["zstd"] = lambda levels: ZstdCompressor(levels["zstd"])
+    return encodings
+
+
+def negotiate(accept_encoding: str, encodings: t.Sequence[str]) -> t.Optional[str]:
+    """
+    The encoding to use from those the client accepts, picking the highest
+    q-value, and the earliest in ``encodings`` on a tie
+    """
+    weights: t.Dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        name = name.strip()
+        if not name:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class CompressionMiddleware(object):
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int,
+        encodings: t.Sequence[str],
+        levels: t.Dict[str, int],
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        available = available_encodings()
+        self.compressors = {
+            encoding: available[encoding]
+            for encoding in encodings
+            if encoding in available
+        }
+        self.levels = levels
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.compressors:
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(
+            Headers(scope=scope).get("accept-encoding", ""), list(self.compressors)
+        )
+        responder = CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder(object):
+    def __init__(
+        self, middleware: CompressionMiddleware, encoding: t.Optional[str], send: Send
+    ):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start: t.Optional[Message] = None
+        self.compressor: t.Optional[Compressor] = None
+        # Body held back until we know it's worth compressing
+        self.pending: t.List[bytes] = []
+        self.pending_size = 0
+        # Passing messages through untouched
+        self.passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if self.passthrough:
+            await self._send(message)
+        elif message["type"] == "http.response.start":
+            self._on_start(message)
+            if self.passthrough:
+                await self._send(message)
+        elif message["type"] == "http.response.body":
+            await self._on_body(message)
+        else:
+            await self._send(message)
+
+    def _on_start(self, message: Message) -> None:
+        headers = Headers(raw=message["headers"])
+        content_type = headers.get("content-type", "")
+        if (
+            message["status"] < 200
+            or message["status"] in (204, 206, 304)
+            or "content-encoding" in headers
+            or "content-range" in headers
+            or "no-transform" in headers.get("cache-control", "")
+            or content_type.startswith(UNCOMPRESSIBLE_TYPES)
+        ):
+            self.passthrough = True
+            return
+
+        # Caches must key on Accept-Encoding, whichever we end up sending
+        MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+        if self.encoding is None:
+            self.passthrough = True
+            return
+        self.start = message
+
+    async def _on_body(self, message: Message) -> None:
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            self.pending.append(body)
+            self.pending_size += len(body)
+            if more_body and self.pending_size < self.middleware.minimum_size:
+                return
+
+            body = b"".join(self.pending)
+            self.pending = []
+            if not more_body and self.pending_size < self.middleware.minimum_size:
+                # Too small to be worth it
+                self.passthrough = True
+                await self._send(self.start)
+                await self._send({**message, "body": body})
+                return
+
+            self.compressor = self.middleware.compressors[self.encoding](
+                self.middleware.levels
+            )
+            compressed = await self._compress(body, finish=not more_body)
+            headers = MutableHeaders(raw=self.start["headers"])
+            headers["Content-Encoding"] = self.encoding
+            if more_body:
+                if "content-length" in headers:
+                    del headers["content-length"]
+            else:
+                headers["Content-Length"] = str(len(compressed))
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # The compressed bytes differ, so it's no longer a strong match
+                headers["ETag"] = f"W/{etag}"
+            await self._send(self.start)
+            await self._send(
+                {
+                    "type": "http.response.body",
+                    "body": compressed,
+                    "more_body": more_body,
+                }
+            )
+            return
+
+        compressed = await self._compress(body, finish=not more_body)
+        if compressed or not more_body:
+            await self._send(
+                {
+                    "type": "http.response.body",
+                    "body": compressed,
+                    "more_body": more_body,
+                }
+            )
+
+    async def _compress(self, body: bytes, finish: bool) -> bytes:
+        compressor = self.compressor
+
+        def run() -> bytes:
+            data = compressor.compress(body) if body else b""
+            return data + compressor.finish() if finish else data
+
+        if len(body) >= OFFLOAD_SIZE:
+            compressed = await asyncio.get_running_loop().run_in_executor(None, run)
+        else:
+            compressed = run()
+        COMPRESSION_BYTES.inc(self.encoding, "in", amount=len(body))
+        COMPRESSION_BYTES.inc(self.encoding, "out", amount=len(compressed))
+        return compressed
@@ -1,18 +1,414 @@
+import asyncio
+import collections
+import contextvars
+import re
+import time
+import typing as t
 
+from piccolo.columns import Column
 from piccolo.engine import engine_finder
+from piccolo.engine.postgres import AsyncBatch, PostgresEngine
+from piccolo.querystring import QueryString
+
+from home.settings import settings
+from shared.lib.exceptions import ServiceUnavailableException
+from shared.lib.metrics import record_phase, registry
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUERY_DURATION = registry.histogram(
+    "db_query_duration_seconds",
+    "Time spent running a query, by statement type.",
+    ("operation",),
+)
+POOL_ACQUIRE_DURATION = registry.histogram(
+    "db_pool_acquire_duration_seconds",
+    "Time spent waiting for a connection from the pool.",
+)
+
+
+# Postgres won't cast to pseudo types like SERIAL
+SQL_CAST_TYPES = {"SERIAL": "INTEGER", "BIGSERIAL": "BIGINT"}
+
+
+def sql_type(column: Column) -> str:
+    """
+    The type to cast a column's parameters to in raw SQL
+    """
+    return SQL_CAST_TYPES.get(column.column_type, column.column_type)
+
+
+class RequestQueries(object):
+    """
+    The queries run on behalf of a single request
+    """
+
+    __slots__ = ("request_id", "count", "total_ns", "wrote", "read_primary")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.count = 0
+        self.total_ns = 0
+        # Reads go to the primary once the request has written, or when the
+        # client asked for it (see shared.lib.replicas)
+        self.wrote = False
+        self.read_primary = False
+
+
+_request_queries: contextvars.ContextVar[t.Optional[RequestQueries]] = (
+    contextvars.ContextVar("request_queries", default=None)
+)
+
+
+def track_request_queries(request_id: str) -> RequestQueries:
+    """
+    Attribute the queries run from here on, in this context, to a request
+    """
+    queries = RequestQueries(request_id)
+    _request_queries.set(queries)
+    return queries
+
+
+def current_request_queries() -> t.Optional[RequestQueries]:
+    return _request_queries.get()
+
+
+class SlowQuery(t.NamedTuple):
+    timestamp: float
+    duration_ms: float
+    request_id: t.Optional[str]
+    query: str
+    params: t.List[str]
+
+
+class SlowQueryLog(object):
+    """
+    Keeps the most recent slow queries in a bounded ring buffer
+    """
+
+    def __init__(self, threshold_ms: float, size: int, max_param_length: int = 200):
+        self.threshold_ms = threshold_ms
+        self.max_param_length = max_param_length
+        self.entries: t.Deque[SlowQuery] = collections.deque(maxlen=size)
+
+    def record(
+        self,
+        query: str,
+        args: t.Sequence[t.Any],
+        duration_ms: float,
+        request_id: t.Optional[str],
+    ) -> None:
+        params = [repr(arg)[: self.max_param_length] for arg in args]
+        self.entries.append(
+            SlowQuery(time.time(), duration_ms, request_id, query, params)
+        )
+        logger.warning(
+            f"Slow query ({duration_ms:.1f}ms, request {request_id}): {query}"
+        )
+
+    def recent(self) -> t.List[dict]:
+        return [entry._asdict() for entry in reversed(self.entries)]
+
+
+slow_query_log = SlowQueryLog(
+    threshold_ms=settings.db_slow_query_ms, size=settings.db_slow_query_log_size
+)
+
+
+def _operation(querystring: QueryString) -> str:
+    words = querystring.template.lstrip().split(None, 1)
+    return words[0].upper() if words and words[0].isalpha() else "OTHER"
+
+
+# Statements that write, so the request's later reads go to the primary.
+# Anything else, e.g. EXPLAIN or SHOW, is a read.
+WRITE_OPERATIONS = frozenset(("INSERT", "UPDATE", "DELETE", "MERGE", "COPY", "DDL"))
+
+_DATA_MODIFYING = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+
+def _writes(operation: str, querystring: QueryString) -> bool:
+    if operation == "WITH":
+        # e.g. WITH deleted AS (DELETE ... RETURNING ...) SELECT ...
+        return _DATA_MODIFYING.search(querystring.template) is not None
+    return operation in WRITE_OPERATIONS
+
+
+class PooledBatch(AsyncBatch):
+    """
+    A server side cursor on a connection from the pool, which goes back to
+    the pool afterwards.  Unlike AsyncBatch, exceptions raised in its block
+    propagate, so it can be used in an ``async with`` around a ``yield``.
+    """
+
+    def __init__(self, engine: "InstrumentedPostgresEngine", **kwargs):
+        super().__init__(**kwargs)
+        self.engine = engine
+
+    async def __aenter__(self) -> "PooledBatch":
+        try:
+            return await super().__aenter__()
+        except BaseException:
+            # __aexit__ isn't called when entering fails
+            await self.engine.release(self.connection)
+            raise
+
+    async def __aexit__(self, exception_type, exception, traceback):
+        try:
+            if self._transaction is not None:
+                if exception_type is None:
+                    await self._transaction.commit()
+                else:
+                    await self._transaction.rollback()
+        finally:
+            await self.engine.release(self.connection)
+        return False
+
+
+class InstrumentedPostgresEngine(PostgresEngine):
+    """
+    PostgresEngine that times every query. Query time is added to the
+    request's ``db`` phase and query count, and slow queries are kept in
+    ``slow_query_log``.
+
+    Queries run in the pool go through ``acquire``, which applies the
+    acquire timeout and tracks waiters and acquire latency, so pool
+    starvation shows up in ``pool_stats``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_waiters = 0
+        # Recent acquire latencies, for pool_stats
+        self._acquire_ns: t.Deque[int] = collections.deque(maxlen=1024)
+        self._recycle_task: t.Optional[asyncio.Task] = None
+
+    async def run_querystring(self, querystring: QueryString, in_pool: bool = True):
+        start = time.perf_counter_ns()
+        try:
+            return await super().run_querystring(querystring, in_pool=in_pool)
+        finally:
+            elapsed_ns = time.perf_counter_ns() - start
+            operation = _operation(querystring)
+            self._record(operation, elapsed_ns, _writes(operation, querystring))
+            if elapsed_ns / 1e6 >= slow_query_log.threshold_ms:
+                query, args = querystring.compile_string(engine_type=self.engine_type)
+                self._record_slow(query, args, elapsed_ns)
+
+    async def run_ddl(self, ddl: str, in_pool: bool = True):
+        start = time.perf_counter_ns()
+        try:
+            return await super().run_ddl(ddl, in_pool=in_pool)
+        finally:
+            elapsed_ns = time.perf_counter_ns() - start
+            self._record("DDL", elapsed_ns, writes=True)
+            if elapsed_ns / 1e6 >= slow_query_log.threshold_ms:
+                self._record_slow(ddl, [], elapsed_ns)
+
+    def _record(self, operation: str, elapsed_ns: int, writes: bool) -> None:
+        QUERY_DURATION.observe(operation, value=elapsed_ns / 1e9)
+        record_phase("db", elapsed_ns)
+
+        queries = _request_queries.get()
+        if queries is not None:
+            queries.count += 1
+            queries.total_ns += elapsed_ns
+            if writes:
+                queries.wrote = True
+
+    def _record_slow(
+        self, query: str, args: t.Sequence[t.Any], elapsed_ns: int
+    ) -> None:
+        queries = _request_queries.get()
+        slow_query_log.record(
+            query, args, elapsed_ns / 1e6, queries.request_id if queries else None
+        )
+
+    ###########################################################################
+    # Pool
+
+    async def start_connection_pool(self, **kwargs) -> None:
+        await super().start_connection_pool(**kwargs)
+        if self.pool and settings.db_pool_max_lifetime > 0:
+            self._recycle_task = asyncio.create_task(self._recycle_connections())
+
+    async def close_connection_pool(self) -> None:
+        if self._recycle_task is not None:
+            self._recycle_task.cancel()
+            self._recycle_task = None
+        await super().close_connection_pool()
+
+    async def _recycle_connections(self) -> None:
+        """
+        asyncpg only expires idle connections, so cap the total lifetime by
+        expiring the whole pool periodically.  Connections are replaced as
+        they are next released or acquired, not all at once.
+        """
+        while True:
+            await asyncio.sleep(settings.db_pool_max_lifetime)
+            if self.pool is not None:
+                await self.pool.expire_connections()
+
+    async def acquire(self):
+        self.pool_waiters += 1
+        start = time.perf_counter_ns()
+        try:
+            return await self.pool.acquire(timeout=settings.db_pool_acquire_timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                f"Timed out acquiring a database connection, {self.pool_waiters} "
+                f"waiting: {self.pool_stats()}"
+            )
+            raise ServiceUnavailableException("Database connection unavailable.")
+        finally:
+            self.pool_waiters -= 1
+            elapsed_ns = time.perf_counter_ns() - start
+            self._acquire_ns.append(elapsed_ns)
+            POOL_ACQUIRE_DURATION.observe(value=elapsed_ns / 1e9)
+
+    async def release(self, connection) -> None:
+        if self.pool is not None:
+            await self.pool.release(connection)
+        else:
+            await connection.close()
+
+    async def batch(
+        self, query, batch_size: int = 100, node: t.Optional[str] = None
+    ) -> PooledBatch:
+        """
+        Cursors run on pooled connections, so concurrent streams are bounded
+        by the pool and wait no longer than its acquire timeout
+        """
+        engine: t.Any = self.extra_nodes.get(node) if node else self
+        if engine.pool is not None:
+            connection = await engine.acquire()
+        else:
+            connection = await engine.get_new_connection()
+        return PooledBatch(
+            engine, connection=connection, query=query, batch_size=batch_size
+        )
+
+    async def _run_in_pool(
+        self, query: str, args: t.Optional[t.Sequence[t.Any]] = None
+    ):
+        if not self.pool:
+            raise ValueError("A pool isn't currently running.")
+
+        connection = await self.acquire()
+        try:
+            return await connection.fetch(query, *(args or []))
+        finally:
+            await self.pool.release(connection)
+
+    async def warm_up(self) -> None:
+        """
+        Check out min_size connections at once and run a trivial query on
+        each, so broken connections fail here rather than on a request
+        """
+        connections = await asyncio.gather(
+            *(self.acquire() for _ in range(self.pool.get_min_size()))
+        )
+        try:
+            await asyncio.gather(
+                *(connection.fetchval("SELECT 1") for connection in connections)
+            )
+        finally:
+            for connection in connections:
+                await self.pool.release(connection)
+
+    def pool_stats(self) -> dict:
+        if self.pool is None:
+            return {"running": False}
+
+        acquire_ns = list(self._acquire_ns)
+        return {
+            "running": True,
+            "size": self.pool.get_size(),
+            "max_size": self.pool.get_max_size(),
+            "in_use": self.pool.get_size() - self.pool.get_idle_size(),
+            "idle": self.pool.get_idle_size(),
+            "waiters": self.pool_waiters,
+            "acquire_ms_avg": (
+                round(sum(acquire_ns) / len(acquire_ns) / 1e6, 3) if acquire_ns else 0
+            ),
+            "acquire_ms_max": round(max(acquire_ns) / 1e6, 3) if acquire_ns else 0,
+        }
+
+
+def pool_stats() -> dict:
+    engine = engine_finder()
+    if not isinstance(engine, InstrumentedPostgresEngine):
+        return {"running": False}
+    return engine.pool_stats()
+
+
+registry.callback(
+    "db_pool",
+    "Database connection pool: size, in_use, idle and waiters.",
+    ("stat",),
+    lambda: {
+        (key,): value
+        for key, value in pool_stats().items()
+        if key in ("size", "in_use", "idle", "waiters")
+    },
+)
+
+
+def replica_nodes(config: dict) -> t.Dict[str, PostgresEngine]:
+    """
+    Engines for the read replicas in settings, to pass as ``extra_nodes``
+    """
+    nodes = {}
+    for index, replica in enumerate(settings.db_replica_hosts):
+        host, _, port = replica.partition(":")
+        nodes[f"replica_{index}"] = InstrumentedPostgresEngine(
+            config={**config, "host": host, "port": int(port or config["port"])}
+        )
+    return nodes
 
 
 async def open_database_connection_pool():
-    try:
-        engine = engine_finder()
+    engine = engine_finder()
+    if not isinstance(engine, PostgresEngine):
         await engine.start_connection_pool()
+        return
+
+    await _open_pool(engine)
+    for node in engine.extra_nodes.values():
+        await _open_pool(node)
+
+
+async def _open_pool(engine: PostgresEngine):
+    try:
+        await engine.start_connection_pool(
+            min_size=settings.db_pool_min_size,
+            max_size=settings.db_pool_max_size,
+            max_inactive_connection_lifetime=settings.db_pool_max_idle_lifetime,
+            server_settings={
+                "statement_timeout": str(settings.db_statement_timeout_ms),
+                "application_name": settings.service_name,
+            },
+        )
+        if isinstance(engine, InstrumentedPostgresEngine):
+            await engine.warm_up()
     except Exception:
-        print("Unable to connect to the database")
+        if settings.db_pool_fail_fast:
+            raise
+        logger.exception(
+            "Unable to open the database connection pool, "
+            "falling back to a connection per query"
+        )
+        if engine.pool is not None:
+            await engine.close_connection_pool()
 
 
 async def close_database_connection_pool():
     try:
         engine = engine_finder()
+        for node in getattr(engine, "extra_nodes", {}).values():
+            await node.close_connection_pool()
         await engine.close_connection_pool()
     except Exception:
-        print("Unable to connect to the database")
+        logger.exception("Unable to close the database connection pool")
@@ -1,4 +1,5 @@
 import http.client
+import math
 
 from fastapi.exceptions import HTTPException
 
@@ -55,6 +56,23 @@ class ValidationException(BaseException):
                 self.detail += f"{error['msg']}: {error['loc'][-1]}"
 
 
+class BulkValidationException(ValidationException):
+    """
+    Error describing which items of a bulk request are not valid
+    """
+
+    DEFAULT_MESSAGE = "Invalid items in bulk request."
+
+    def __init__(self, message=None, items=None):
+        super().__init__(message)
+        self.items = items or []
+
+    def content(self):
+        content = super().content()
+        content["items"] = self.items
+        return content
+
+
 class NotFoundException(BaseException):
     """
     Error describing when a request is not valid (403)
@@ -65,6 +83,16 @@ class NotFoundException(BaseException):
     DEFAULT_MESSAGE = "Resource Not Found"
 
 
+class PreconditionFailedException(BaseException):
+    """
+    Error describing when an If-Match precondition does not hold (412)
+    """
+
+    STATUS_CODE = http.client.PRECONDITION_FAILED
+    CATEGORY = ErrorCategories.VALIDATION
+    DEFAULT_MESSAGE = "Resource has been modified."
+
+
 class ForbiddenException(BaseException):
     """
     Error describing when a request is not valid (403)
@@ -93,3 +121,40 @@ class ExternalCommunicationFailure(BaseException):
     STATUS_CODE = http.client.SERVICE_UNAVAILABLE
     CATEGORY = ErrorCategories.GENERAL
     DEFAULT_MESSAGE = "FAILED TO COMMUNICATE WITH AN EXTERNAL RESOURCE"
+
+
+def retry_after_headers(retry_after=None):
+    """
+    Headers telling the client how many whole seconds to wait, at least one
+    """
+    if retry_after is None:
+        return None
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+class ServiceUnavailableException(BaseException):
+    """
+    Error describing when we are too busy to serve a request (503)
+    """
+
+    STATUS_CODE = http.client.SERVICE_UNAVAILABLE
+    CATEGORY = ErrorCategories.GENERAL
+    DEFAULT_MESSAGE = "Service temporarily unavailable."
+
+    def __init__(self, message=None, retry_after=None):
+        super().__init__(message)
+        self.headers = retry_after_headers(retry_after)
+
+
+class TooManyRequestsException(BaseException):
+    """
+    Error describing when a client has hit a rate limit (429)
+    """
+
+    STATUS_CODE = http.client.TOO_MANY_REQUESTS
+    CATEGORY = ErrorCategories.SECURITY
+    DEFAULT_MESSAGE = "Too many requests."
+
+    def __init__(self, message=None, retry_after=None):
+        super().__init__(message)
+        self.headers = retry_after_headers(retry_after)
@@ -0,0 +1,101 @@
+"""
+Runs CPU heavy password hashing off the event loop.
+"""
+
+import asyncio
+import functools
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+from home.settings import settings
+from shared.lib.exceptions import ServiceUnavailableException
+from shared.lib.metrics import registry
+
+
+class HashingPool(object):
+    """
+    A bounded thread pool for password hashing.
+
+    ``hashlib.pbkdf2_hmac`` releases the GIL, so threads give real
+    parallelism here.  Callers past ``max_workers`` wait on a semaphore
+    rather than piling up in the executor queue, which lets us report how
+    deep the queue is, and once ``max_queue`` are waiting further calls are
+    shed with a 503 instead of queueing behind minutes of hashing.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: t.Optional[ThreadPoolExecutor] = None
+        self._semaphore: t.Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.shed = 0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="hashing"
+            )
+        return self._executor
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running loop, not the import one
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        return self._semaphore
+
+    async def run(self, func: t.Callable, *args, **kwargs) -> t.Any:
+        if self.waiting >= self.max_queue:
+            self.shed += 1
+            raise ServiceUnavailableException(
+                "Too many password checks in progress.", retry_after=1
+            )
+
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs)
+            )
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "completed": self.completed,
+            "shed": self.shed,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+hashing_pool = HashingPool(
+    max_workers=settings.password_hash_workers,
+    max_queue=settings.password_hash_max_queue,
+)
+
+registry.stats(
+    "password_hash_pool",
+    "Password hashing pool: max_workers, in_flight and queue_depth.",
+    lambda: hashing_pool.stats(),
+    counters=("completed", "shed"),
+    counter_documentation="Password hashing pool: completed and shed operations.",
+)
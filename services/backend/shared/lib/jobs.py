@@ -0,0 +1,272 @@
+"""
+A durable background job queue kept in Postgres.
+
+Jobs are rows, claimed in batches with ``FOR UPDATE SKIP LOCKED`` so any
+number of workers can poll the same table without blocking each other.
+A claimed job holds a lease; if its worker dies the lease expires and the
+job is queued again.  Failed jobs are retried with exponential backoff
+until they run out of attempts.
+
+Handlers are coroutines taking the job's payload, registered by name:
+
+    @job_queue.handler("send_email")
+    async def send_email(payload: dict) -> None:
+        ...
+
+Handlers must finish within the lease, or the job may run twice.
+"""
+
+import asyncio
+import datetime
+import random
+import time
+import typing as t
+
+from shared.lib.metrics import registry
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOB_DURATION = registry.histogram(
+    "job_duration_seconds",
+    "Time spent running a job, by job name and result.",
+    ("name", "result"),
+)
+JOB_LAG = registry.histogram(
+    "job_lag_seconds",
+    "Time between a job being due and a worker starting it.",
+    ("name",),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+JOBS_PROCESSED = registry.counter(
+    "jobs_processed_total",
+    "Jobs run, by job name and result: done, retry or failed.",
+    ("name", "result"),
+)
+
+Handler = t.Callable[[t.Any], t.Awaitable[None]]
+
+
+class Job(t.NamedTuple):
+    id: t.Any
+    name: str
+    payload: t.Any
+    attempts: int
+    max_attempts: int
+    run_at: datetime.datetime
+
+
+class JobStore(t.Protocol):
+    async def dequeue(
+        self, names: t.List[str], batch_size: int, lease: float
+    ) -> t.List[Job]:
+        """
+        Claims up to ``batch_size`` due jobs named in ``names``, leasing them
+        for ``lease`` seconds
+        """
+
+    async def complete(self, ids: t.List[t.Any]) -> None:
+        """
+        Marks jobs done
+        """
+
+    async def retry(self, job_id: t.Any, delay: float, error: str) -> None:
+        """
+        Queues a failed job again, to run after ``delay`` seconds
+        """
+
+    async def fail(self, job_id: t.Any, error: str) -> None:
+        """
+        Marks a job failed for good
+        """
+
+    async def requeue_expired(self) -> int:
+        """
+        Queues jobs with expired leases again, returning how many
+        """
+
+    async def queue_stats(self, names: t.List[str]) -> t.Tuple[int, float]:
+        """
+        The number of due jobs named in ``names``, and how many seconds the
+        oldest has waited
+        """
+
+
+class JobQueue(object):
+    def __init__(
+        self,
+        store: JobStore,
+        batch_size: int,
+        concurrency: int,
+        poll_interval: float,
+        lease: float,
+        backoff_base: float,
+        backoff_max: float,
+        stats_interval: float,
+    ):
+        self.store = store
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats_interval = stats_interval
+
+        self.handlers: t.Dict[str, Handler] = {}
+        self._tasks: t.List[asyncio.Task] = []
+        self._stopping: t.Optional[asyncio.Event] = None
+        self.in_flight = 0
+        self.depth = 0
+        self.oldest_due_seconds = 0.0
+
+    def handler(self, name: str) -> t.Callable[[Handler], Handler]:
+        def register(func: Handler) -> Handler:
+            if name in self.handlers:
+                raise ValueError(f"Job handler '{name}' is already registered")
+            self.handlers[name] = func
+            return func
+
+        return register
+
+    def backoff(self, attempts: int) -> float:
+        """
+        Seconds before retrying a job that has failed ``attempts`` times,
+        with full jitter so retries of a failed batch spread out
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    async def start(self) -> None:
+        if not self.handlers:
+            logger.warning("No job handlers are registered, not running jobs")
+            return
+        if not self._tasks:
+            self._stopping = asyncio.Event()
+            self._maintenance_task = asyncio.create_task(self._run_maintenance())
+            self._tasks = [asyncio.create_task(self._run()), self._maintenance_task]
+
+    async def stop(self) -> None:
+        """
+        Stop claiming jobs, and wait for the running ones to finish
+        """
+        if not self._tasks:
+            return
+
+        self._stopping.set()
+        # The polling loop exits once its jobs are done
+        self._maintenance_task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _run(self) -> None:
+        running: t.Set[asyncio.Task] = set()
+        stopping = asyncio.create_task(self._stopping.wait())
+        try:
+            while not self._stopping.is_set():
+                free = self.concurrency - len(running)
+                if free <= 0:
+                    # Claim more as soon as a slot frees up
+                    await asyncio.wait(
+                        running | {stopping}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    continue
+
+                claim = min(self.batch_size, free)
+                try:
+                    # Only jobs this process can run, so workers can specialise
+                    jobs = await self.store.dequeue(
+                        list(self.handlers), claim, self.lease
+                    )
+                except Exception:
+                    logger.exception("Failed to dequeue jobs")
+                    jobs = []
+
+                now = datetime.datetime.now(datetime.timezone.utc)
+                for job in jobs:
+                    task = asyncio.create_task(self._process(job, now))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                if len(jobs) < claim:
+                    # The queue is drained for now
+                    await asyncio.wait({stopping}, timeout=self.poll_interval)
+        finally:
+            stopping.cancel()
+            if running:
+                await asyncio.wait(running)
+
+    async def _process(self, job: Job, now: datetime.datetime) -> None:
+        """
+        Run a claimed job, marking it done as soon as it succeeds
+        """
+        try:
+            if await self._run_job(job, now):
+                await self.store.complete([job.id])
+        except Exception:
+            # Its lease will expire and it'll run again
+            logger.exception(f"Failed to record the result of job {job.id}")
+
+    async def _run_job(self, job: Job, now: datetime.datetime) -> bool:
+        """
+        Run a job, returning whether it succeeded
+        """
+        run_at = job.run_at
+        if run_at.tzinfo is None:
+            run_at = run_at.replace(tzinfo=datetime.timezone.utc)
+        JOB_LAG.observe(job.name, value=max(0.0, (now - run_at).total_seconds()))
+
+        handler = self.handlers.get(job.name)
+        if handler is None:
+            JOBS_PROCESSED.inc(job.name, "failed")
+            await self.store.fail(job.id, f"No handler for job '{job.name}'")
+            return False
+
+        self.in_flight += 1
+        start = time.perf_counter()
+        result = "failed"
+        try:
+            await handler(job.payload)
+        except Exception as exception:
+            error = f"{type(exception).__name__}: {exception}"
+            if job.attempts < job.max_attempts:
+                result = "retry"
+                await self.store.retry(job.id, self.backoff(job.attempts), error)
+            else:
+                logger.exception(
+                    f"Job {job.id} '{job.name}' failed after {job.attempts} attempts"
+                )
+                await self.store.fail(job.id, error)
+            return False
+        else:
+            result = "done"
+            return True
+        finally:
+            self.in_flight -= 1
+            JOB_DURATION.observe(job.name, result, value=time.perf_counter() - start)
+            JOBS_PROCESSED.inc(job.name, result)
+
+    async def _run_maintenance(self) -> None:
+        while True:
+            try:
+                requeued = await self.store.requeue_expired()
+                if requeued:
+                    logger.warning(f"Requeued {requeued} jobs with expired leases")
+                self.depth, self.oldest_due_seconds = await self.store.queue_stats(
+                    list(self.handlers)
+                )
+            except Exception:
+                logger.exception("Job queue maintenance failed")
+            await asyncio.sleep(self.stats_interval)
+
+    def stats(self) -> dict:
+        return {
+            "due": self.depth,
+            "oldest_due_seconds": self.oldest_due_seconds,
+            "in_flight": self.in_flight,
+            "handlers": len(self.handlers),
+        }
@@ -0,0 +1,107 @@
+"""
+Work taken off the login critical path.
+
+``last_login`` timestamps are collected and written back in batches, and
+passwords stored with an outdated iteration count are rehashed by a
+background worker, one at a time so rehashing never competes with logins
+for more than one hashing thread.
+"""
+
+import asyncio
+import datetime
+import typing as t
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LoginTasks(object):
+    def __init__(
+        self,
+        flush_interval: float,
+        max_rehash_queue: int,
+        flush: t.Callable[[t.Dict[t.Any, datetime.datetime]], t.Awaitable[None]],
+        rehash: t.Callable[[t.Any, str], t.Awaitable[None]],
+    ):
+        self.flush_interval = flush_interval
+        self.max_rehash_queue = max_rehash_queue
+        self.flush = flush
+        self.rehash = rehash
+
+        self._pending: t.Dict[t.Any, datetime.datetime] = {}
+        self._rehash_queue: t.Optional[asyncio.Queue] = None
+        self._tasks: t.List[asyncio.Task] = []
+        self.rehashed = 0
+        self.rehash_dropped = 0
+
+    @property
+    def rehash_queue(self) -> asyncio.Queue:
+        # Created lazily so it binds to the running loop, not the import one
+        if self._rehash_queue is None:
+            self._rehash_queue = asyncio.Queue(maxsize=self.max_rehash_queue)
+        return self._rehash_queue
+
+    def record_login(self, user_id: t.Any, when: datetime.datetime) -> None:
+        self._pending[user_id] = when
+
+    def schedule_rehash(self, user_id: t.Any, password: str) -> None:
+        try:
+            self.rehash_queue.put_nowait((user_id, password))
+        except asyncio.QueueFull:
+            # It will be queued again on the user's next login
+            self.rehash_dropped += 1
+
+    async def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._run_flush()),
+                asyncio.create_task(self._run_rehash()),
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self.flush_pending()
+
+    async def _run_flush(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_pending()
+
+    async def _run_rehash(self) -> None:
+        while True:
+            user_id, password = await self.rehash_queue.get()
+            try:
+                await self.rehash(user_id, password)
+                self.rehashed += 1
+            except Exception:
+                logger.exception(f"Failed to rehash the password of user {user_id}")
+
+    async def flush_pending(self) -> None:
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        try:
+            await self.flush(pending)
+        except Exception:
+            logger.exception(f"Failed to flush {len(pending)} last_login updates")
+            # Keep them for the next round, newer logins win
+            for user_id, when in pending.items():
+                self._pending.setdefault(user_id, when)
+
+    def stats(self) -> dict:
+        return {
+            "pending_last_login": len(self._pending),
+            "rehash_queue_depth": (
+                self._rehash_queue.qsize() if self._rehash_queue else 0
+            ),
+            "rehashed": self.rehashed,
+            "rehash_dropped": self.rehash_dropped,
+        }
@@ -0,0 +1,271 @@
+"""
+In-process metrics, rendered in the Prometheus text exposition format.
+
+Metrics are per worker; scrape each worker, or aggregate downstream.
+"""
+
+import collections
+import contextlib
+import contextvars
+import math
+import time
+import typing as t
+
+LabelValues = t.Tuple[str, ...]
+
+# Seconds, tuned for API latencies
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names: t.Sequence[str], values: LabelValues) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric(object):
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: t.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> t.List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+
+    def samples(self) -> t.List[str]:
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: t.Dict[LabelValues, float] = collections.defaultdict(float)
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] += amount
+
+    def samples(self) -> t.List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] -= amount
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+
+class CallbackMetric(Metric):
+    """
+    A metric read from a callback at scrape time, e.g. from a pool's stats()
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: t.Sequence[str],
+        callback: t.Callable[[], t.Dict[LabelValues, float]],
+        metric_type: str = "gauge",
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.TYPE = metric_type
+
+    def samples(self) -> t.List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self.callback().items()
+        ]
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, *args, buckets: t.Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._counts: t.Dict[LabelValues, t.List[int]] = {}
+        self._sums: t.Dict[LabelValues, float] = collections.defaultdict(float)
+
+    def observe(self, *labels: str, value: float) -> None:
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * len(self.buckets)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        self._sums[labels] += value
+
+    def samples(self) -> t.List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(names, labels + (le,))} "
+                    f"{cumulative}"
+                )
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {self._sums[labels]}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics: t.Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), **kwargs
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def callback(
+        self, name: str, documentation: str, labelnames, callback, metric_type="gauge"
+    ) -> CallbackMetric:
+        return self.register(
+            CallbackMetric(name, documentation, labelnames, callback, metric_type)
+        )
+
+    def stats(
+        self,
+        name: str,
+        documentation: str,
+        stats: t.Callable[[], dict],
+        counters: t.Sequence[str] = (),
+        counter_documentation: str = "",
+    ) -> None:
+        """
+        Expose a component's stats() labelled by ``stat``: the ever growing
+        ``counters`` as a ``{name}_total`` counter, so rate() works on them,
+        and the rest as a gauge
+        """
+        self.callback(
+            name,
+            documentation,
+            ("stat",),
+            lambda: {
+                (key,): value for key, value in stats().items() if key not in counters
+            },
+        )
+        if counters:
+            self.callback(
+                f"{name}_total",
+                counter_documentation,
+                ("stat",),
+                lambda: {
+                    (key,): value for key, value in stats().items() if key in counters
+                },
+                metric_type="counter",
+            )
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.header()
+            lines += metric.samples()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds",
+    "Total time spent handling a request.",
+    ("route", "method", "status"),
+)
+REQUEST_PHASE_DURATION = registry.histogram(
+    "http_request_phase_duration_seconds",
+    "Time spent in each phase of a request: before_request, handler, and the "
+    "db and serialization time within the handler.",
+    ("route", "method", "phase"),
+)
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight",
+    "Requests currently being handled.",
+    ("route", "method"),
+)
+REQUEST_ERRORS = registry.counter(
+    "http_request_errors_total",
+    "Requests that ended in an error, by ErrorCategories category.",
+    ("route", "method", "category"),
+)
+DB_QUERIES_PER_REQUEST = registry.histogram(
+    "db_queries_per_request",
+    "Number of queries run while handling a request.",
+    ("route", "method"),
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+
+
+###############################################################################
+# Request phases
+
+_phases: contextvars.ContextVar[t.Optional[t.Dict[str, int]]] = contextvars.ContextVar(
+    "request_phases", default=None
+)
+
+
+def start_phases() -> contextvars.Token:
+    """
+    Start collecting phase timings for the current request
+    """
+    return _phases.set(collections.defaultdict(int))
+
+
+def finish_phases(token: contextvars.Token) -> t.Dict[str, int]:
+    phases = _phases.get() or {}
+    _phases.reset(token)
+    return phases
+
+
+def record_phase(phase: str, elapsed_ns: int) -> None:
+    """
+    Add time to a phase of the current request, a no-op outside of one
+    """
+    phases = _phases.get()
+    if phases is not None:
+        phases[phase] += elapsed_ns
+
+
+@contextlib.contextmanager
+def timed_phase(phase: str):
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter_ns() - start)
@@ -0,0 +1,123 @@
+"""
+Resolution of users' effective scopes, as bitsets.
+
+Every scope name is given a bit the first time it is seen, so a user's
+scopes are a single int and checking a route's required scopes is one
+AND.  Bits are assigned per process and never leave it.
+
+Resolved scopes are cached per user.  Changes made through the role and
+group tables' helpers invalidate the cache of this worker; other workers
+pick them up within ``ttl`` seconds.
+"""
+
+import asyncio
+import collections
+import time
+import typing as t
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ScopeIndex(object):
+    def __init__(self):
+        self._bits: t.Dict[str, int] = {}
+
+    def bit(self, scope: str) -> int:
+        bit = self._bits.get(scope)
+        if bit is None:
+            bit = self._bits[scope] = 1 << len(self._bits)
+        return bit
+
+    def mask(self, scopes: t.Iterable[str]) -> int:
+        mask = 0
+        for scope in scopes:
+            mask |= self.bit(scope)
+        return mask
+
+    def scopes(self, mask: int) -> t.List[str]:
+        return [scope for scope, bit in self._bits.items() if mask & bit]
+
+
+class ScopeResolver(object):
+    """
+    A TTL/LRU cache of each user's scope bitset, loaded on a miss.
+
+    Concurrent misses for the same user share one load.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_size: int,
+        load: t.Callable[[t.Any], t.Awaitable[t.Iterable[str]]],
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.load = load
+        self.index = ScopeIndex()
+
+        self.hits = 0
+        self.misses = 0
+        self._entries: t.OrderedDict[t.Any, t.Tuple[float, int]] = (
+            collections.OrderedDict()
+        )
+        self._loading: t.Dict[t.Any, asyncio.Future] = {}
+        # Bumped by invalidate() so loads started before it aren't cached
+        self._generation = 0
+
+    async def resolve(self, user_id: t.Any) -> int:
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] >= time.monotonic():
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        future = self._loading.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = future
+            future.add_done_callback(lambda _: self._loaded(user_id, future))
+        return await asyncio.shield(future)
+
+    def _loaded(self, user_id: t.Any, future: asyncio.Future) -> None:
+        # invalidate() may have replaced it with a newer load already
+        if self._loading.get(user_id) is future:
+            del self._loading[user_id]
+
+    async def _load(self, user_id: t.Any) -> int:
+        generation = self._generation
+        mask = self.index.mask(await self.load(user_id))
+        if generation == self._generation:
+            self._entries[user_id] = (time.monotonic() + self.ttl, mask)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return mask
+
+    async def has_scopes(self, user_id: t.Any, mask: int) -> bool:
+        return (await self.resolve(user_id)) & mask == mask
+
+    def invalidate(self, user_id: t.Any = None) -> None:
+        """
+        Forget one user's scopes, or everyone's when a role changes
+        """
+        self._generation += 1
+        # Loads already running may have read the old scopes, so later
+        # lookups start their own rather than sharing them
+        if user_id is None:
+            self._entries.clear()
+            self._loading.clear()
+        else:
+            self._entries.pop(user_id, None)
+            self._loading.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "scopes": len(self.index._bits),
+        }
@@ -0,0 +1,113 @@
+"""
+Token bucket rate limiting.
+
+Buckets live in process memory by default, so each worker enforces its own
+limits.  To share them across workers, point ``rate_limit_backend`` at a
+``RateLimitBackend`` subclass, e.g. one backed by Redis.
+"""
+
+import collections
+import importlib
+import time
+import typing as t
+
+from home.settings import settings
+from shared.lib.exceptions import TooManyRequestsException
+from shared.lib.metrics import registry
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = registry.counter(
+    "rate_limited_total",
+    "Requests rejected by a rate limit.",
+    ("limit",),
+)
+
+
+class RateLimitBackend(object):
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """
+        Take a token from the bucket for ``key``, refilled at ``rate`` tokens
+        a second up to ``burst``.  Returns 0 if one was taken, otherwise the
+        seconds until one will be available.
+        """
+        raise NotImplementedError()
+
+
+class MemoryBackend(RateLimitBackend):
+    """
+    Buckets in an LRU dict.  Evicting a bucket refills it, so ``max_keys``
+    should comfortably exceed the number of clients seen per refill period.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: t.OrderedDict[str, t.Tuple[float, float]] = (
+            collections.OrderedDict()
+        )
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class RateLimit(t.NamedTuple):
+    name: str
+    per_minute: float
+    burst: int
+
+
+class RateLimiter(object):
+    def __init__(self, backend: RateLimitBackend):
+        self.backend = backend
+
+    async def check(self, limit: RateLimit, value: t.Optional[str]) -> None:
+        """
+        Raise a TooManyRequestsException if ``value`` is over the limit
+        """
+        if value is None or limit.per_minute <= 0:
+            return
+
+        wait = await self.backend.take(
+            f"{limit.name}:{value}", limit.per_minute / 60, limit.burst
+        )
+        if wait > 0:
+            RATE_LIMITED.inc(limit.name)
+            logger.warning(f"Rate limit '{limit.name}' hit")
+            raise TooManyRequestsException(retry_after=wait)
+
+
+def load_backend() -> RateLimitBackend:
+    if not settings.rate_limit_backend:
+        return MemoryBackend(max_keys=settings.rate_limit_max_keys)
+
+    module_name, class_name = settings.rate_limit_backend.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+LOGIN_BY_IP = RateLimit(
+    "login_ip",
+    settings.login_rate_limit_ip_per_minute,
+    settings.login_rate_limit_ip_burst,
+)
+LOGIN_BY_EMAIL = RateLimit(
+    "login_email",
+    settings.login_rate_limit_email_per_minute,
+    settings.login_rate_limit_email_burst,
+)
+
+rate_limiter = RateLimiter(load_backend())
@@ -0,0 +1,163 @@
+"""
+Routes safe reads to read replicas.
+
+Replicas are the ``extra_nodes`` of the primary engine, built from
+``db_replica_hosts``.  Reads go to the primary instead when:
+
+* they run inside a transaction on the primary
+* the current request has already written, or a recent request from the
+  same client did (the read-your-writes window, carried in a cookie so it
+  holds across workers)
+* every replica is unreachable or lagging more than ``max_lag`` seconds
+"""
+
+import asyncio
+import itertools
+import math
+import time
+import typing as t
+
+from fastapi import Request, Response
+from piccolo.engine.postgres import PostgresEngine
+from piccolo.querystring import QueryString
+
+from home.settings import settings
+from shared.lib.db import current_request_queries
+from shared.lib.metrics import registry
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cookie holding the epoch time until which reads go to the primary
+READ_PRIMARY_COOKIE = "read_primary_until"
+
+# Time since the last replayed transaction.  This overstates lag while the
+# primary is idle, which only sends reads to the primary a little early.
+LAG_QUERY = QueryString(
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "ELSE 0 END AS lag"
+)
+
+
+class ReplicaRouter(object):
+    def __init__(self, max_lag: float, check_interval: float):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.engine: t.Optional[PostgresEngine] = None
+        self.nodes: t.List[str] = []
+        self._lag: t.Dict[str, t.Optional[float]] = {}
+        self._cycle: t.Iterator[int] = itertools.count()
+        self._task: t.Optional[asyncio.Task] = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    def healthy_nodes(self) -> t.List[str]:
+        limit = self.max_lag if self.max_lag > 0 else math.inf
+        return [
+            node
+            for node in self.nodes
+            # None means the last check failed
+            if self._lag.get(node) is not None and self._lag[node] <= limit
+        ]
+
+    def read_node(self) -> t.Optional[str]:
+        """
+        The node to run a read on, None meaning the primary
+        """
+        if not self.nodes or self.engine.current_transaction.get() is not None:
+            self.primary_reads += 1
+            return None
+
+        queries = current_request_queries()
+        if queries is not None and (queries.wrote or queries.read_primary):
+            self.primary_reads += 1
+            return None
+
+        nodes = self.healthy_nodes()
+        if not nodes:
+            self.primary_reads += 1
+            return None
+
+        self.replica_reads += 1
+        return nodes[next(self._cycle) % len(nodes)]
+
+    async def start(self, engine: PostgresEngine) -> None:
+        self.engine = engine
+        self.nodes = sorted(getattr(engine, "extra_nodes", {}))
+        if self.nodes and self._task is None:
+            await self.check_lag()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_lag()
+
+    async def check_lag(self) -> None:
+        for node in self.nodes:
+            try:
+                rows = await self.engine.extra_nodes[node].run_querystring(LAG_QUERY)
+                self._lag[node] = float(rows[0]["lag"])
+            except Exception:
+                if self._lag.get(node, 0) is not None:
+                    logger.exception(f"Replica '{node}' is unavailable")
+                self._lag[node] = None
+
+    def wants_primary(self, request: Request) -> bool:
+        """
+        Whether the client's read-your-writes window is still open
+        """
+        try:
+            return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def open_window(self, response: Response) -> None:
+        """
+        Send the client's reads to the primary for the next little while
+        """
+        if not self.nodes or settings.db_read_your_writes_seconds <= 0:
+            return
+
+        window = settings.db_read_your_writes_seconds
+        response.set_cookie(
+            READ_PRIMARY_COOKIE,
+            str(time.time() + window),
+            max_age=math.ceil(window),
+            httponly=True,
+            samesite="lax",
+        )
+
+    def stats(self) -> dict:
+        return {
+            "replicas": len(self.nodes),
+            "healthy_replicas": len(self.healthy_nodes()),
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+        }
+
+
+replica_router = ReplicaRouter(
+    max_lag=settings.db_replica_max_lag_seconds,
+    check_interval=settings.db_replica_check_interval,
+)
+
+registry.stats(
+    "db_replicas",
+    "Read replica routing: replicas and healthy_replicas.",
+    lambda: replica_router.stats(),
+    counters=("replica_reads", "primary_reads"),
+    counter_documentation="Read replica routing: reads sent to replicas and the "
+    "primary.",
+)
@@ -0,0 +1,191 @@
+"""
+Asynchronous request/response log pipeline used by FastRoute.
+
+Routes hand records to a bounded queue and move on, a background task
+batches them up and writes them out off the event loop.
+"""
+
+import asyncio
+import json
+import random
+import sys
+import typing as t
+
+from home.settings import settings
+from shared.lib.metrics import registry
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _write_to_stdout(lines: t.List[str]) -> None:
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+
+
+class RequestLogger(object):
+    """
+    Collects request log records and writes them out in batches.
+
+    Records are dropped, and counted, rather than ever blocking a request
+    when the queue is full.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        sample_rate: float,
+        max_body_bytes: int,
+        queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        sink: t.Callable[[t.List[str]], None] = _write_to_stdout,
+    ):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_body_bytes = max_body_bytes
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sink = sink
+
+        self.dropped = 0
+        self.written = 0
+        self._queue: t.Optional[asyncio.Queue] = None
+        self._task: t.Optional[asyncio.Task] = None
+        self._pending: t.List[dict] = []
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        return self._queue
+
+    def should_log(self) -> bool:
+        if not self.enabled:
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def capture(self, body: t.Union[bytes, str, None]) -> t.Tuple[str, bool]:
+        """
+        Returns the (possibly truncated) body as text and whether it was cut
+        """
+        if not body:
+            return "", False
+        if isinstance(body, str):
+            body = body.encode()
+        truncated = len(body) > self.max_body_bytes
+        return body[: self.max_body_bytes].decode(errors="replace"), truncated
+
+    def submit(self, record: dict) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def tee(self, body_iterator: t.AsyncIterable, record: dict) -> t.AsyncIterator:
+        """
+        Wrap a streaming body so the first max_body_bytes are captured as the
+        chunks go past. The record is submitted once the stream finishes.
+        """
+
+        async def _iterate():
+            captured = bytearray()
+            total = 0
+            try:
+                async for chunk in body_iterator:
+                    raw = chunk.encode() if isinstance(chunk, str) else chunk
+                    total += len(raw)
+                    if len(captured) < self.max_body_bytes:
+                        captured += raw[: self.max_body_bytes - len(captured)]
+                    yield chunk
+            finally:
+                record["response_body"] = captured.decode(errors="replace")
+                record["response_body_truncated"] = total > len(captured)
+                self.submit(record)
+
+        return _iterate()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Flush whatever is left so shutdown doesn't lose records
+        await self._write(self._pending)
+        self._pending = []
+        while batch := self._drain():
+            await self._write(batch)
+
+    def _drain(self) -> t.List[dict]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = self._pending = [await self.queue.get()]
+            # Give the batch a moment to fill up before writing it
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.flush_interval
+            try:
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    batch.append(
+                        await asyncio.wait_for(self.queue.get(), timeout=timeout)
+                    )
+            except asyncio.TimeoutError:
+                pass
+            self._pending = []
+            await self._write(batch)
+
+    async def _write(self, batch: t.List[dict]) -> None:
+        if not batch:
+            return
+        try:
+            lines = [json.dumps(record, default=str) for record in batch]
+            await asyncio.to_thread(self.sink, lines)
+            self.written += len(batch)
+        except Exception:
+            logger.exception("Failed to write request log batch")
+            self.dropped += len(batch)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+
+request_logger = RequestLogger(
+    enabled=settings.enable_request_logging,
+    sample_rate=settings.request_log_sample_rate,
+    max_body_bytes=settings.request_log_max_body_bytes,
+    queue_size=settings.request_log_queue_size,
+    batch_size=settings.request_log_batch_size,
+    flush_interval=settings.request_log_flush_interval,
+)
+
+registry.stats(
+    "request_log_records",
+    "Request log pipeline: records queued.",
+    lambda: request_logger.stats(),
+    counters=("written", "dropped"),
+    counter_documentation="Request log pipeline: records written and dropped.",
+)
@@ -1,10 +1,10 @@
-
 from shared.lib.routes.fast import FastRoute
 from shared.lib.routes.crud import CrudRoutes
+from shared.lib.routes.models import get_crud_models
+
+from home.settings import settings
 
-import os
-import importlib
-import inspect
+import time
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,36 +15,35 @@ def register_route_class(app):
 
 
 def register_routes(app):
-    route_files = [
-        ".".join(root.split(os.sep) + [filename]).strip().removesuffix(".py")
-        for root, subdirs, files in os.walk("home/api")
-        for filename in files
-        if (len(filename) > 3 and filename[-3:] == ".py" and filename != "__init__.py")
-    ]
-    route_files += [
-        ".".join(root.split(os.sep) + [filename]).strip().removesuffix(".py")
-        for root, subdirs, files in os.walk("shared/api")
-        for filename in files
-        if (len(filename) > 3 and filename[-3:] == ".py" and filename != "__init__.py")
-    ]
-
-    for route_file in route_files:
-        try:
-            module = importlib.import_module(route_file)
-        except ModuleNotFoundError:
-            logger.exception(f"Failed to import route file '{route_file}'")
-            continue
-
-        route_classes = []
-        for attr in dir(module):
-            attribute = getattr(module, attr)
-            if (
-                inspect.isclass(attribute)
-                and attribute != FastRoute
-                and attribute != CrudRoutes
-                and issubclass(attribute, FastRoute)
-            ):
-                route_classes.append(attribute)
-
-        for route_class in route_classes:
-            route_class.register(app)
+    # Imported here so `python -m shared.lib.routes.manifest` runs cleanly
+    from shared.lib.routes.manifest import discover_route_classes, load_manifest
+
+    timings = {}
+
+    start = time.perf_counter()
+    route_classes = None
+    if settings.use_route_manifest:
+        route_classes = load_manifest(settings.route_manifest_path)
+    timings["source"] = "manifest" if route_classes is not None else "discovery"
+    if route_classes is None:
+        route_classes = discover_route_classes()
+    timings["import_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for route_class in route_classes:
+        if issubclass(route_class, CrudRoutes):
+            get_crud_models(route_class.DB_MODEL)
+    timings["models_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for route_class in route_classes:
+        route_class.register(app.router)
+    timings["routes_ms"] = (time.perf_counter() - start) * 1000
+
+    timings["route_classes"] = len(route_classes)
+    app.state.startup_timings = timings
+    logger.info(
+        "Registered {route_classes} route classes from {source}: "
+        "import {import_ms:.1f}ms, models {models_ms:.1f}ms, "
+        "routes {routes_ms:.1f}ms".format(**timings)
+    )
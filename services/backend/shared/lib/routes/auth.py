@@ -0,0 +1,49 @@
+"""
+Route dependencies for authentication and scope checks.
+
+A route's required scopes are turned into a bitmask once, when it is
+registered, so each request costs a session lookup, a cache lookup and an
+AND.
+"""
+
+import typing as t
+
+from fastapi import Depends, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from shared.lib.exceptions import ForbiddenException, UnauthorizedException
+from shared.tables.roles import scope_resolver
+from shared.tables.sessions import Session
+
+bearer = HTTPBearer(auto_error=False)
+
+
+async def current_user_id(
+    request: Request,
+    credentials: t.Optional[HTTPAuthorizationCredentials] = Depends(bearer),
+) -> t.Any:
+    """
+    The id of the user whose session token is in the Authorization header
+    """
+    if credentials is None:
+        raise UnauthorizedException()
+
+    user_id = await Session.get_user_id(credentials.credentials)
+    if user_id is None:
+        raise UnauthorizedException()
+
+    request.state.user_id = user_id
+    return user_id
+
+
+def require_scopes(scopes: t.Iterable[str]) -> t.Callable:
+    """
+    A dependency rejecting users who don't hold every one of ``scopes``
+    """
+    mask = scope_resolver.index.mask(scopes)
+
+    async def _require_scopes(user_id: t.Any = Depends(current_user_id)) -> None:
+        if not await scope_resolver.has_scopes(user_id, mask):
+            raise ForbiddenException()
+
+    return _require_scopes
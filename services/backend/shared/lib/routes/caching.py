@@ -0,0 +1,164 @@
+"""
+ETags and a small server-side response cache for CrudRoutes.
+
+ETags come from Postgres' ``xmin`` system column, the id of the transaction
+that last wrote a row, so they are identical across workers, change on
+every write, and can be checked without fetching or serializing the row.
+The response cache is per worker and is keyed by a per-table version that
+is bumped by writes going through this worker; writes made anywhere else
+are only picked up when entries expire, so keep ``ttl`` short.
+"""
+
+import collections
+import hashlib
+import time
+import typing as t
+
+from fastapi import Request
+from piccolo.columns import BigInt, Column
+from piccolo.table import Table
+
+from home.settings import settings
+from shared.lib.metrics import registry
+from shared.lib.routes.responses import dumps
+
+#: The key the row version is selected as
+VERSION_KEY = "xmin"
+
+_version_columns: t.Dict[t.Type[Table], Column] = {}
+
+
+def version_column(table: t.Type[Table]) -> Column:
+    """
+    A column for the table's ``xmin``, to select or return alongside a row
+    """
+    column = _version_columns.get(table)
+    if column is None:
+        column = BigInt(db_column_name=VERSION_KEY)
+        column._meta._name = VERSION_KEY
+        column._meta._table = table
+        _version_columns[table] = column
+    return column
+
+
+def row_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def page_etag(rows: t.List[dict], pk_name: str) -> str:
+    """
+    An ETag for a page of rows, which changes when any row on it is written,
+    or rows join or leave it
+    """
+    versions = ",".join(f"{row[pk_name]}:{row[VERSION_KEY]}" for row in rows)
+    return f'"{hashlib.blake2b(versions.encode(), digest_size=16).hexdigest()}"'
+
+
+def etag_matches(header: t.Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match / If-Match header against an ETag
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag for candidate in header.split(",")
+    )
+
+
+class Rendered(t.NamedTuple):
+    body: bytes
+    etag: str
+    headers: t.Dict[str, str]
+
+
+def render(
+    content: t.Any, etag: str, headers: t.Optional[t.Dict[str, str]] = None
+) -> Rendered:
+    return Rendered(dumps(content), etag, headers or {})
+
+
+CacheKey = t.Tuple[str, int, str]
+
+
+class ResponseCache(object):
+    """
+    LRU cache of rendered responses keyed by table, table version and URL
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._versions: t.Dict[str, int] = collections.defaultdict(int)
+        self._entries: t.OrderedDict[CacheKey, t.Tuple[float, Rendered]] = (
+            collections.OrderedDict()
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def key(self, table: t.Type[Table], request: Request) -> CacheKey:
+        """
+        Take the key before reading from the database, so a write landing in
+        between leaves the entry under the old, already invalid, version
+        """
+        url = f"{request.url.path}?{request.url.query}"
+        return (table._meta.tablename, self.version(table), url)
+
+    def get(self, key: CacheKey) -> t.Optional[Rendered]:
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: CacheKey, rendered: Rendered) -> None:
+        if not self.enabled:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, rendered)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def version(self, table: t.Type[Table]) -> int:
+        """
+        Bumped on every write to the table through this worker
+        """
+        return self._versions[table._meta.tablename]
+
+    def invalidate(self, table: t.Type[Table]) -> None:
+        """
+        Bump the table version, orphaned entries age out of the LRU
+        """
+        self.invalidate_tablename(table._meta.tablename)
+
+    def invalidate_tablename(self, tablename: str) -> None:
+        self._versions[tablename] += 1
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+response_cache = ResponseCache(
+    ttl=settings.crud_response_cache_ttl,
+    max_entries=settings.crud_response_cache_max_entries,
+)
+
+registry.stats(
+    "crud_response_cache",
+    "CRUD response cache: size.",
+    lambda: response_cache.stats(),
+    counters=("hits", "misses"),
+    counter_documentation="CRUD response cache lookups: hits and misses.",
+)
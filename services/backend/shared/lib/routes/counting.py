@@ -0,0 +1,130 @@
+"""
+Row counts for CrudRoutes COUNT endpoints.
+
+An exact COUNT(*) has to visit every matching row, so on Postgres the
+planner's estimate is used first: ``pg_class.reltuples`` for the whole
+table, or the row estimate from EXPLAIN when filtering.  Only when that
+is below ``exact_threshold`` is the exact count run.
+"""
+
+import json
+import time
+import typing as t
+
+import pydantic
+from piccolo.columns.combination import Combinable
+from piccolo.querystring import QueryString
+from piccolo.table import Table
+
+from home.settings import settings
+from shared.lib.routes.caching import response_cache
+
+
+class CountResponse(pydantic.BaseModel):
+    count: int
+    estimated: bool
+
+
+class RowCount(t.NamedTuple):
+    count: int
+    estimated: bool
+
+
+CountKey = t.Tuple[str, int, str]
+
+
+class RowCounter(object):
+    def __init__(self, exact_threshold: int, ttl: float, max_entries: int):
+        self.exact_threshold = exact_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: t.Dict[CountKey, t.Tuple[float, RowCount]] = {}
+
+    async def count(
+        self,
+        table: t.Type[Table],
+        where: t.Optional[Combinable] = None,
+        node: t.Optional[str] = None,
+    ) -> RowCount:
+        # Keyed by the table version too, so writes through this worker
+        # invalidate cached counts
+        key = (
+            table._meta.tablename,
+            response_cache.version(table),
+            str(where.querystring) if where is not None else "",
+        )
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        result = await self._count(table, where, node)
+        if self.ttl > 0:
+            self._evict()
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+        return result
+
+    async def _count(
+        self,
+        table: t.Type[Table],
+        where: t.Optional[Combinable],
+        node: t.Optional[str],
+    ) -> RowCount:
+        if table._meta.db.engine_type in ("postgres", "cockroach"):
+            estimate = await self._estimate(table, where, node)
+            if estimate is not None and estimate > self.exact_threshold:
+                return RowCount(estimate, estimated=True)
+
+        query = table.count()
+        if where is not None:
+            query = query.where(where)
+        return RowCount(await query.run(node=node), estimated=False)
+
+    async def _estimate(
+        self,
+        table: t.Type[Table],
+        where: t.Optional[Combinable],
+        node: t.Optional[str],
+    ) -> t.Optional[int]:
+        engine = table._meta.db
+        if node is not None:
+            engine = engine.extra_nodes[node]
+
+        if where is None:
+            rows = await engine.run_querystring(
+                QueryString(
+                    "SELECT reltuples::bigint AS estimate FROM pg_class "
+                    "WHERE oid = to_regclass({})",
+                    table._meta.tablename,
+                )
+            )
+            # -1 until the table has been vacuumed or analyzed
+            if not rows or rows[0]["estimate"] < 0:
+                return None
+            return rows[0]["estimate"]
+
+        select = table.select(table._meta.primary_key).where(where)
+        rows = await engine.run_querystring(
+            QueryString("EXPLAIN (FORMAT JSON) {}", select.querystrings[0])
+        )
+        plan = rows[0]["QUERY PLAN"]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def _evict(self) -> None:
+        if len(self._entries) < self.max_entries:
+            return
+
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[key]
+        # Then the oldest, dicts keep insertion order
+        while len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+
+
+row_counter = RowCounter(
+    exact_threshold=settings.crud_count_exact_threshold,
+    ttl=settings.crud_count_cache_ttl,
+    max_entries=settings.crud_response_cache_max_entries,
+)
@@ -1,14 +1,23 @@
-
 from home.settings import settings
 
-from fastapi import FastAPI, Request, Response, Depends, APIRouter
+from fastapi import (
+    FastAPI,
+    Request,
+    Response,
+    Depends,
+    APIRouter,
+    Query,
+    Body,
+    Header,
+)
 from fastapi.routing import APIRoute
 from fastapi.exceptions import HTTPException, RequestValidationError
-from fastapi.responses import JSONResponse, RedirectResponse
-
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 
 
+import asyncio
 import datetime
+import http.client
 import uuid
 import time
 import json
@@ -18,21 +27,103 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-from shared.lib.routes.fast import FastRoute
+from shared.lib.routes.fast import API_PREFIX, FastRoute
+from piccolo.columns import Column
+from piccolo.columns.combination import Combinable
 from piccolo.table import Table
 import typing as t
-from piccolo_api.crud.serializers import create_pydantic_model
-from shared.lib.exceptions import NotFoundException
-
+import pydantic
+from shared.lib.db import sql_type
+from shared.lib.replicas import replica_router
+from shared.lib.exceptions import (
+    BulkValidationException,
+    NotFoundException,
+    PreconditionFailedException,
+    ValidationException,
+)
+from shared.lib.change_feed import (
+    HEARTBEAT,
+    ChangeEvent,
+    Subscriber,
+    format_control,
+    format_event,
+)
+from shared.lib.routes.auth import require_scopes
+from shared.lib.routes.caching import (
+    VERSION_KEY,
+    Rendered,
+    etag_matches,
+    page_etag,
+    render,
+    response_cache,
+    row_etag,
+    version_column,
+)
+from shared.lib.routes.counting import CountResponse, row_counter
+from shared.lib.routes.filters import (
+    build_filters,
+    cursor_value,
+    filterable_columns,
+    keyset_where,
+    parse_fields,
+    parse_sort,
+    sort_options,
+    sortable_columns,
+    warn_unindexed,
+)
+from shared.lib.routes.models import get_crud_models
+from shared.lib.routes.pagination import decode_cursor, encode_cursor, stream_rows
+from shared.lib.routes.responses import FastJSONResponse
+from shared.tables.changes import Change, change_feed
+
+
+def _quote(column: Column) -> str:
+    return f'"{column._meta.db_column_name}"'
 
 
 class CrudRoutes(FastRoute):
     PATH: str
-    METHODS: t.List[t.Literal["INDEX", "GET", "PUT", "POST", "DELETE"]] = ["INDEX", "GET", "PUT", "POST", "DELETE"]
+    METHODS: t.List[
+        t.Literal[
+            "INDEX",
+            "COUNT",
+            "GET",
+            "PUT",
+            "PATCH",
+            "POST",
+            "DELETE",
+            "BULK_POST",
+            "BULK_PUT",
+            "BULK_DELETE",
+            "CHANGES",
+        ]
+    ] = [
+        "INDEX",
+        "COUNT",
+        "GET",
+        "PUT",
+        "PATCH",
+        "POST",
+        "DELETE",
+        "BULK_POST",
+        "BULK_PUT",
+        "BULK_DELETE",
+    ]
     DB_MODEL: Table
+    #: Columns INDEX can filter on, None for the primary key and indexed
+    #: columns.  List any others explicitly.
+    FILTER_FIELDS: t.Optional[t.List[str]] = None
+    #: Non-nullable columns INDEX can sort by besides the primary key, None
+    #: for the indexed ones
+    SORT_FIELDS: t.Optional[t.List[str]] = None
+    #: Columns whose updates alone aren't sent as changes, when CHANGES is
+    #: served
+    CHANGES_IGNORE_FIELDS: t.Sequence[str] = ()
+    #: Scopes needed for particular methods, on top of SCOPES
+    METHOD_SCOPES: t.Dict[str, t.List[str]] = {}
 
     @classmethod
-    def register(cls, app: FastAPI) -> None:
+    def register(cls, router: APIRouter) -> None:
         # Assemble token dependencies
         dependencies = []
         # if not cls.PUBLIC:
@@ -40,103 +131,670 @@ class CrudRoutes(FastRoute):
         #     if settings.env != 'local':
         #         dependencies.append(Depends(csrf_token_header))
 
-        response_model = create_pydantic_model(
-            table=cls.DB_MODEL,
-            include_default_columns=True,
-            model_name="ResponseModel",
-        )
+        response_model = get_crud_models(cls.DB_MODEL).response
+        if "INDEX" in cls.METHODS or "COUNT" in cls.METHODS:
+            warn_unindexed(cls.__name__, "filter", cls._filter_columns())
+            warn_unindexed(cls.__name__, "sort", cls._sort_columns())
 
-        router = APIRouter(
-            route_class=cls,
-            prefix=f"/{settings.service_name}/v1"
+        # Bulk, count and changes routes go first so "/bulk", "/count" and
+        # "/changes" aren't captured by "/{pk}"
+        methods = sorted(
+            cls.METHODS,
+            key=lambda m: not (m.startswith("BULK_") or m in ("COUNT", "CHANGES")),
         )
-        for method in cls.METHODS:
+        for method in methods:
+            if method == "CHANGES" and not settings.crud_changes_enabled:
+                logger.info(
+                    f"{cls.__name__}: not serving changes, crud_changes_enabled "
+                    "is off"
+                )
+                continue
+
             http_method = str(method)
             resp_model = response_model
-            path = str(cls.PATH.rstrip("/"))
+            path = API_PREFIX + str(cls.PATH.rstrip("/"))
 
             if method == "INDEX":
                 http_method = "GET"
                 resp_model = t.List[resp_model]
-            elif method in ["GET", "PUT", "DELETE"]:
+            elif method == "COUNT":
+                http_method = "GET"
+                resp_model = CountResponse
+                path += "/count"
+            elif method == "CHANGES":
+                http_method = "GET"
+                resp_model = None
+                path += "/changes"
+            elif method in ["GET", "PUT", "PATCH", "DELETE"]:
                 path += "/{pk}"
+            elif method.startswith("BULK_"):
+                http_method = method.removeprefix("BULK_")
+                resp_model = t.List[resp_model]
+                path += "/bulk"
+
+            scopes = cls.SCOPES + cls.METHOD_SCOPES.get(method, [])
+            route_dependencies = dependencies + (
+                [Depends(require_scopes(scopes))] if scopes else []
+            )
 
             try:
                 router.add_api_route(
                     path=path,
                     endpoint=cls._get_crud(method),
                     methods=[http_method],
-                    dependencies=dependencies,
+                    dependencies=route_dependencies,
                     summary=cls.SUMMARY,
                     description=cls.DESCRIPTION,
-                    response_model=resp_model,
+                    response_model=cls._schema_response_model(resp_model),
+                    response_class=FastJSONResponse,
+                    route_class_override=cls,
                 )
             except Exception:
                 logger.error(f"Failed to add route {method} -> {path}")
                 raise
 
-        app.include_router(router)
+    @staticmethod
+    def _schema_response_model(response_model: t.Any) -> t.Any:
+        """
+        CRUD handlers return pre-serialized responses, so their response
+        models only feed the OpenAPI schema.  Don't build them when it isn't
+        served.
+        """
+        return response_model if settings.enable_swagger else None
+
+    @classmethod
+    async def _change_events(
+        cls, subscriber: Subscriber, replay: t.Optional[t.List[ChangeEvent]]
+    ) -> t.AsyncIterator[bytes]:
+        try:
+            if replay is None:
+                yield format_control("reset")
+                replay = []
+
+            for event in replay:
+                yield format_event(event)
+            replayed = {event.id for event in replay}
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscriber.queue.get(), settings.crud_changes_heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+                    continue
+
+                if subscriber.dropped:
+                    yield format_control("dropped")
+                    return
+                if event.id not in replayed:
+                    yield format_event(event)
+        finally:
+            change_feed.unsubscribe(subscriber)
+
+    @classmethod
+    def _filter_columns(cls) -> t.List[Column]:
+        columns = get_crud_models(cls.DB_MODEL).response_columns
+        return filterable_columns(columns, cls.FILTER_FIELDS)
+
+    @classmethod
+    def _sort_columns(cls) -> t.List[Column]:
+        columns = get_crud_models(cls.DB_MODEL).response_columns
+        try:
+            return sortable_columns(columns, cls.SORT_FIELDS)
+        except ValueError as exc:
+            raise ValueError(f"{cls.__name__}: {exc}") from None
+
+    @classmethod
+    async def _before_write(cls, values: dict) -> dict:
+        """
+        Hook to transform incoming values before they are written
+        """
+        return values
 
     @classmethod
     def _get_crud(cls, method: str) -> callable:
+        # Handlers return FastJSONResponse with rows selected to match the
+        # response model, so FastAPI doesn't validate them a second time
+        models = get_crud_models(cls.DB_MODEL)
+        columns = models.response_columns
+
         if method == "INDEX":
-            async def _index():
-                return await cls.DB_MODEL.select().order_by(cls.DB_MODEL.id)
+            primary_key = cls.DB_MODEL._meta.primary_key
+            pk_name = primary_key._meta.name
+            version = version_column(cls.DB_MODEL)
+            sort_columns = [primary_key, *cls._sort_columns()]
+            filters = build_filters(cls._filter_columns())
+
+            async def _index(
+                request: Request,
+                limit: int = Query(
+                    default=settings.crud_index_default_limit,
+                    ge=1,
+                    le=settings.crud_index_max_limit,
+                ),
+                after: t.Optional[str] = None,
+                stream: t.Optional[t.Literal["ndjson", "json"]] = None,
+                order_by: t.Optional[
+                    t.Literal[tuple(sort_options(sort_columns))]
+                ] = None,
+                fields: t.Optional[str] = Query(
+                    default=None, description="Comma separated columns to return"
+                ),
+                where: t.Optional[Combinable] = Depends(filters),
+            ):
+                sort_column, ascending = parse_sort(order_by, sort_columns, primary_key)
+                # The primary key breaks ties, so the order is total
+                ordering = (
+                    [primary_key]
+                    if sort_column is primary_key
+                    else [sort_column, primary_key]
+                )
+                cursor = decode_cursor(after) if after is not None else None
+
+                def page_query(*selected: Column):
+                    query = cls.DB_MODEL.select(*selected).order_by(
+                        *ordering, ascending=ascending
+                    )
+                    if where is not None:
+                        query = query.where(where)
+                    if after is not None:
+                        query = query.where(
+                            keyset_where(sort_column, ascending, primary_key, cursor)
+                        )
+                    return query
+
+                selected = parse_fields(fields, columns, primary_key)
+                if stream:
+                    # Streams everything after the cursor, limit does not apply
+                    return stream_rows(
+                        page_query(*selected),
+                        stream,
+                        settings.crud_stream_batch_size,
+                        node=replica_router.read_node(),
+                    )
+
+                cache_key = response_cache.key(cls.DB_MODEL, request)
+                rendered = response_cache.get(cache_key)
+                if rendered is None:
+                    if_none_match = request.headers.get("if-none-match")
+                    if if_none_match:
+                        # Only the page's row versions, unless it has changed
+                        versions = (
+                            await page_query(primary_key, version)
+                            .limit(limit + 1)
+                            .run(node=replica_router.read_node())
+                        )
+                        etag = page_etag(versions, pk_name)
+                        if etag_matches(if_none_match, etag):
+                            return cls._not_modified(etag)
+
+                    # Fetch one extra row to find out if there is another page
+                    rows = (
+                        await page_query(*selected, version)
+                        .limit(limit + 1)
+                        .run(node=replica_router.read_node())
+                    )
+                    etag = page_etag(rows, pk_name)
+                    for row in rows:
+                        del row[VERSION_KEY]
+                    headers = {}
+                    if len(rows) > limit:
+                        rows = rows[:limit]
+                        headers["X-Next-Cursor"] = encode_cursor(
+                            cursor_value(rows[-1], sort_column, primary_key)
+                        )
+
+                    rendered = render(rows, etag, headers)
+                    response_cache.put(cache_key, rendered)
+
+                return cls._conditional_response(request, rendered)
 
             return _index
-        
+
+        elif method == "COUNT":
+            filters = build_filters(cls._filter_columns())
+
+            async def _count(where: t.Optional[Combinable] = Depends(filters)):
+                result = await row_counter.count(
+                    cls.DB_MODEL, where, node=replica_router.read_node()
+                )
+                return FastJSONResponse(
+                    {"count": result.count, "estimated": result.estimated},
+                    headers={
+                        "X-Count-Kind": "estimate" if result.estimated else "exact"
+                    },
+                )
+
+            return _count
+
+        elif method == "CHANGES":
+            tablename = cls.DB_MODEL._meta.tablename
+
+            async def _changes(
+                after: t.Optional[int] = Query(
+                    default=None, description="Resume after this event id"
+                ),
+                last_event_id: t.Optional[int] = Header(default=None),
+            ):
+                cursor = after if after is not None else last_event_id
+                subscriber = change_feed.subscribe(tablename)
+                # Subscribed before reading the log so nothing falls in between
+                try:
+                    replay = (
+                        await Change.since(
+                            tablename, cursor, settings.crud_changes_replay_limit
+                        )
+                        if cursor is not None
+                        else []
+                    )
+                except BaseException:
+                    change_feed.unsubscribe(subscriber)
+                    raise
+
+                return StreamingResponse(
+                    cls._change_events(subscriber, replay),
+                    media_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                )
+
+            return _changes
+
         elif method == "POST":
-            request_model = create_pydantic_model(
-                table=cls.DB_MODEL,
-                model_name="RequestModel",
-            )
+            request_model = models.request
 
             async def _create(model: request_model):
-                obj = cls.DB_MODEL(**model.dict())
-                await obj.save()
-                return obj.to_dict()
+                obj = cls.DB_MODEL(**await cls._before_write(model.dict()))
+                rows = await cls.DB_MODEL.insert(obj).returning(*columns)
+                return FastJSONResponse(rows[0])
 
             return _create
 
         elif method == "GET":
-            async def _get_by_id(pk: str):
-                obj = await cls.DB_MODEL.objects().get(cls.DB_MODEL._meta.primary_key == pk)
-                if not obj:
-                    raise NotFoundException()
-
-                return obj.to_dict()
+            version = version_column(cls.DB_MODEL)
+
+            async def _get_by_id(pk: str, request: Request):
+                cache_key = response_cache.key(cls.DB_MODEL, request)
+                rendered = response_cache.get(cache_key)
+                if rendered is None:
+                    where = cls.DB_MODEL._meta.primary_key == cls._parse_pk(pk)
+                    if_none_match = request.headers.get("if-none-match")
+                    if if_none_match:
+                        # Only the row's version, unless it has changed
+                        row = (
+                            await cls.DB_MODEL.select(version)
+                            .where(where)
+                            .first()
+                            .run(node=replica_router.read_node())
+                        )
+                        if not row:
+                            raise NotFoundException()
+
+                        etag = row_etag(row[VERSION_KEY])
+                        if etag_matches(if_none_match, etag):
+                            return cls._not_modified(etag)
+
+                    row = (
+                        await cls.DB_MODEL.select(*columns, version)
+                        .where(where)
+                        .first()
+                        .run(node=replica_router.read_node())
+                    )
+                    if not row:
+                        raise NotFoundException()
+
+                    rendered = cls._render_row(row)
+                    response_cache.put(cache_key, rendered)
+
+                return cls._conditional_response(request, rendered)
 
             return _get_by_id
-        
+
         elif method == "PUT":
-            request_model = create_pydantic_model(
-                table=cls.DB_MODEL,
-                model_name="RequestModel",
-            )
+            request_model = models.request
 
-            async def _update_by_id(pk: str, model: request_model):
-                obj = await cls.DB_MODEL.objects().get(cls.DB_MODEL._meta.primary_key == pk)
-                if not obj:
-                    raise NotFoundException()
+            async def _update_by_id(pk: str, model: request_model, request: Request):
+                row = await cls._update_returning(
+                    pk,
+                    await cls._before_write(model.dict()),
+                    request.headers.get("if-match"),
+                )
+                return cls._conditional_response(request, cls._render_row(row))
 
-                for key, value in model.dict().items():
-                    setattr(obj, key, value)
+            return _update_by_id
 
-                await obj.save()
-                return obj.to_dict()
+        elif method == "PATCH":
+            request_model = models.patch
 
-            return _update_by_id
+            async def _patch_by_id(pk: str, model: request_model, request: Request):
+                # Only the columns the client actually sent are written
+                values = model.dict(exclude_unset=True)
+                if not values:
+                    raise ValidationException("No fields to update.")
+
+                row = await cls._update_returning(
+                    pk, await cls._before_write(values), request.headers.get("if-match")
+                )
+                return cls._conditional_response(request, cls._render_row(row))
+
+            return _patch_by_id
 
         elif method == "DELETE":
-            async def _delete_by_id(pk: str):
-                obj = await cls.DB_MODEL.objects().get(cls.DB_MODEL._meta.primary_key == pk)
-                if not obj:
-                    raise NotFoundException()
 
-                await obj.remove()
+            async def _delete_by_id(pk: str, request: Request):
+                query = (
+                    cls.DB_MODEL.delete()
+                    .where(cls.DB_MODEL._meta.primary_key == cls._parse_pk(pk))
+                    .returning(*columns)
+                )
+
+                if_match = request.headers.get("if-match")
+                if if_match:
+                    async with cls.DB_MODEL._meta.db.transaction():
+                        await cls._check_if_match(pk, if_match)
+                        rows = await query
+                else:
+                    rows = await query
+
+                if not rows:
+                    raise NotFoundException()
 
-                return obj.to_dict()
+                return FastJSONResponse(rows[0])
 
             return _delete_by_id
 
+        elif method == "BULK_POST":
+            request_model = models.request
+
+            async def _bulk_create(items: t.List[t.Dict[str, t.Any]] = Body(...)):
+                cls._check_bulk_size(items)
+
+                validated = cls._validate_bulk_items(request_model, items)
+                objs = [
+                    cls.DB_MODEL(**await cls._before_write(model.dict()))
+                    for model in validated
+                ]
+                if not objs:
+                    return FastJSONResponse([])
+
+                # A single multi-row INSERT ... RETURNING
+                return FastJSONResponse(
+                    await cls.DB_MODEL.insert(*objs).returning(*columns)
+                )
+
+            return _bulk_create
+
+        elif method == "BULK_PUT":
+            request_model = models.request
+            pk_name = cls.DB_MODEL._meta.primary_key._meta.name
+
+            async def _bulk_update(items: t.List[t.Dict[str, t.Any]] = Body(...)):
+                cls._check_bulk_size(items)
+
+                pks = cls._parse_bulk_pks([item.get(pk_name) for item in items])
+                models = cls._validate_bulk_items(
+                    request_model,
+                    [{k: v for k, v in item.items() if k != pk_name} for item in items],
+                )
+                rows = [
+                    (pk, await cls._before_write(model.dict()))
+                    for pk, model in zip(pks, models)
+                ]
+                if not rows:
+                    return FastJSONResponse([])
+
+                async with cls.DB_MODEL._meta.db.transaction():
+                    updated = await cls._bulk_update_rows(rows)
+                    cls._check_bulk_found([pk for pk, _ in rows], updated)
+
+                return FastJSONResponse(updated)
+
+            return _bulk_update
+
+        elif method == "BULK_DELETE":
+
+            async def _bulk_delete(pks: t.List[t.Any] = Body(...)):
+                cls._check_bulk_size(pks)
+                if not pks:
+                    return FastJSONResponse([])
+
+                pks = cls._parse_bulk_pks(pks)
+                primary_key = cls.DB_MODEL._meta.primary_key
+                async with cls.DB_MODEL._meta.db.transaction():
+                    deleted = await cls.DB_MODEL.raw(
+                        f"DELETE FROM {cls.DB_MODEL._meta.get_formatted_tablename()} "
+                        f"WHERE {_quote(primary_key)} = ANY({{}}::{sql_type(primary_key)}[]) "
+                        f"RETURNING {cls._returning_columns()}",
+                        pks,
+                    )
+                    cls._check_bulk_found(pks, deleted)
+
+                return FastJSONResponse(deleted)
+
+            return _bulk_delete
+
         raise Exception(f"Method {method} Unsupported")
+
+    async def _after_request(self, request: Request, response: Response):
+        if request.method not in ("GET", "HEAD") and response.status_code < 400:
+            response_cache.invalidate(self.DB_MODEL)
+
+        return await super()._after_request(request, response)
+
+    @classmethod
+    def _parse_pk(cls, pk: str) -> t.Any:
+        """
+        Path parameters arrive as strings, the driver wants the column's type
+        """
+        try:
+            return cls.DB_MODEL._meta.primary_key.value_type(pk)
+        except (TypeError, ValueError):
+            raise NotFoundException() from None
+
+    @classmethod
+    def _render_row(cls, row: dict) -> Rendered:
+        """
+        Render a row selected with its version column, which becomes the ETag
+        """
+        return render(row, row_etag(row.pop(VERSION_KEY)))
+
+    @classmethod
+    def _not_modified(
+        cls, etag: str, headers: t.Optional[t.Dict[str, str]] = None
+    ) -> Response:
+        return Response(
+            status_code=http.client.NOT_MODIFIED,
+            headers={**(headers or {}), "ETag": etag},
+        )
+
+    @classmethod
+    def _conditional_response(cls, request: Request, rendered: Rendered) -> Response:
+        """
+        Answer 304 if the client already has this version, otherwise send the
+        pre-rendered body with its ETag
+        """
+        if request.method == "GET" and etag_matches(
+            request.headers.get("if-none-match"), rendered.etag
+        ):
+            return cls._not_modified(rendered.etag, rendered.headers)
+
+        return FastJSONResponse(
+            rendered.body, headers={**rendered.headers, "ETag": rendered.etag}
+        )
+
+    @classmethod
+    async def _check_if_match(cls, pk: str, if_match: str) -> None:
+        """
+        Lock the row and make sure it still matches the client's ETag.
+        Must be called inside a transaction.
+        """
+        primary_key = cls.DB_MODEL._meta.primary_key
+        rows = await cls.DB_MODEL.raw(
+            f"SELECT {VERSION_KEY} "
+            f"FROM {cls.DB_MODEL._meta.get_formatted_tablename()} "
+            f"WHERE {_quote(primary_key)} = {{}} FOR UPDATE",
+            cls._parse_pk(pk),
+        )
+        if not rows:
+            raise NotFoundException()
+
+        if not etag_matches(if_match, row_etag(rows[0][VERSION_KEY])):
+            raise PreconditionFailedException()
+
+    @classmethod
+    async def _update_returning(
+        cls, pk: str, values: dict, if_match: t.Optional[str] = None
+    ) -> dict:
+        """
+        Update a single row with one UPDATE ... RETURNING, no row means 404
+        """
+        query = (
+            cls.DB_MODEL.update(values)
+            .where(cls.DB_MODEL._meta.primary_key == cls._parse_pk(pk))
+            .returning(
+                *get_crud_models(cls.DB_MODEL).response_columns,
+                version_column(cls.DB_MODEL),
+            )
+        )
+
+        if if_match:
+            async with cls.DB_MODEL._meta.db.transaction():
+                await cls._check_if_match(pk, if_match)
+                rows = await query
+        else:
+            rows = await query
+
+        if not rows:
+            raise NotFoundException()
+
+        return rows[0]
+
+    @classmethod
+    def _returning_columns(cls, alias: t.Optional[str] = None) -> str:
+        prefix = f"{alias}." if alias else ""
+        return ", ".join(
+            f"{prefix}{_quote(column)}"
+            for column in get_crud_models(cls.DB_MODEL).response_columns
+        )
+
+    @classmethod
+    def _check_bulk_size(cls, items: list) -> None:
+        if len(items) > settings.crud_bulk_max_size:
+            raise ValidationException(
+                f"Bulk requests are limited to {settings.crud_bulk_max_size} items."
+            )
+
+    @classmethod
+    def _validate_bulk_items(
+        cls, request_model: t.Type[pydantic.BaseModel], items: t.List[dict]
+    ) -> t.List[pydantic.BaseModel]:
+        """
+        Validate every item, reporting all of the failures at once
+        """
+        models, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                models.append(request_model(**item))
+            except pydantic.ValidationError as exc:
+                error = ValidationException()
+                error.from_request_validation_errors(exc.errors())
+                errors.append({"index": index, "error": error.detail})
+
+        if errors:
+            raise BulkValidationException(items=errors)
+
+        return models
+
+    @classmethod
+    def _parse_bulk_pks(cls, pks: t.List[t.Any]) -> t.List[t.Any]:
+        """
+        Coerce every pk to the column's type, as _parse_pk does, reporting
+        all of the failures at once
+        """
+        primary_key = cls.DB_MODEL._meta.primary_key
+        pk_name = primary_key._meta.name
+        parsed, errors = [], []
+        for index, pk in enumerate(pks):
+            if pk is None:
+                errors.append({"index": index, "error": f"'{pk_name}' is Required."})
+                continue
+            try:
+                parsed.append(primary_key.value_type(pk))
+            except (AttributeError, TypeError, ValueError):
+                errors.append({"index": index, "error": f"Invalid {pk_name}."})
+
+        if errors:
+            raise BulkValidationException(items=errors)
+
+        return parsed
+
+    @classmethod
+    def _check_bulk_found(cls, pks: t.List[t.Any], rows: t.List[dict]) -> None:
+        """
+        Raise (rolling back the surrounding transaction) if any pk didn't match
+        """
+        pk_name = cls.DB_MODEL._meta.primary_key._meta.db_column_name
+        found = {str(row[pk_name]) for row in rows}
+        errors = [
+            {"index": index, "error": NotFoundException.DEFAULT_MESSAGE}
+            for index, pk in enumerate(pks)
+            if str(pk) not in found
+        ]
+        if errors:
+            raise BulkValidationException(items=errors)
+
+    @classmethod
+    async def _bulk_update_rows(
+        cls, rows: t.List[t.Tuple[t.Any, dict]]
+    ) -> t.List[dict]:
+        """
+        Update many rows, with one UPDATE per set of columns written.
+        ``_before_write`` may leave different columns out of different rows,
+        and a row only writes the columns it has, as with a single PUT.
+        Must be called inside a transaction.
+        """
+        groups: t.Dict[t.FrozenSet[str], t.List[t.Tuple[t.Any, dict]]] = {}
+        for pk, data in rows:
+            groups.setdefault(frozenset(data), []).append((pk, data))
+
+        updated = []
+        for group in groups.values():
+            updated.extend(await cls._bulk_update_group(group))
+        return updated
+
+    @classmethod
+    async def _bulk_update_group(
+        cls, rows: t.List[t.Tuple[t.Any, dict]]
+    ) -> t.List[dict]:
+        """
+        Update rows writing the same set of columns with one
+        UPDATE ... FROM (VALUES ...) ... RETURNING.
+
+        Parameters are bound per value, so crud_bulk_max_size needs to stay
+        well below Postgres' limit of 32767 parameters per statement.
+        """
+        primary_key = cls.DB_MODEL._meta.primary_key
+        columns = [primary_key] + [
+            cls.DB_MODEL._meta.get_column_by_name(name) for name in rows[0][1]
+        ]
+
+        placeholders = ", ".join(f"{{}}::{sql_type(column)}" for column in columns)
+        values = ", ".join(f"({placeholders})" for _ in rows)
+        assignments = ", ".join(
+            f"{_quote(column)} = v.{_quote(column)}" for column in columns[1:]
+        )
+        args = [
+            arg
+            for pk, data in rows
+            for arg in [pk] + [data[column._meta.name] for column in columns[1:]]
+        ]
+
+        return await cls.DB_MODEL.raw(
+            f"UPDATE {cls.DB_MODEL._meta.get_formatted_tablename()} AS t "
+            f"SET {assignments} "
+            f"FROM (VALUES {values}) "
+            f"AS v({', '.join(_quote(column) for column in columns)}) "
+            f"WHERE t.{_quote(primary_key)} = v.{_quote(primary_key)} "
+            f"RETURNING {cls._returning_columns('t')}",
+            *args,
+        )
@@ -1,23 +1,37 @@
-
 from home.settings import settings
+from shared.lib.db import track_request_queries
 from shared.lib.exceptions import (
     BaseException,
+    ErrorCategories,
     ValidationException,
 )
+from shared.lib.metrics import (
+    DB_QUERIES_PER_REQUEST,
+    REQUEST_DURATION,
+    REQUEST_ERRORS,
+    REQUEST_PHASE_DURATION,
+    REQUESTS_IN_FLIGHT,
+    finish_phases,
+    start_phases,
+    timed_phase,
+)
+from shared.lib.replicas import replica_router
+from shared.lib.request_logging import request_logger
+from shared.lib.routes.auth import require_scopes
 
 from fastapi import FastAPI, Request, Response, Depends, APIRouter
 from fastapi.routing import APIRoute
 from fastapi.exceptions import HTTPException, RequestValidationError
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 
 from typing import (
     Any,
     Callable,
+    List,
     Literal,
     Optional,
 )
 
-import datetime
 import uuid
 import time
 import json
@@ -25,40 +39,42 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+API_PREFIX = f"/{settings.service_name}/v1"
+
 
 class FastRoute(APIRoute):
     PATH: str
-    METHOD: Literal["GET", "PUT", "POST", "DELETE"]
+    METHOD: Literal["GET", "PUT", "PATCH", "POST", "DELETE"]
     SUMMARY: Optional[str] = None
     DESCRIPTION: Optional[str] = None
     RESPONSE_MODEL: Any = None
+    #: Scopes a user needs to call the route, empty for a public route
+    SCOPES: List[str] = []
 
     @classmethod
-    def register(cls, app: FastAPI) -> None:
+    def register(cls, router: APIRouter) -> None:
         # Assemble token dependencies
         dependencies = []
         # if not cls.PUBLIC:
         #     dependencies.append(Depends(api_token_header))
         #     if settings.env != 'local':
         #         dependencies.append(Depends(csrf_token_header))
+        if cls.SCOPES:
+            dependencies.append(Depends(require_scopes(cls.SCOPES)))
 
         try:
-            # Making a router per route seems crazy,
-            # but it allows us to have a different route class for each
-            router = APIRouter(
-                route_class=cls,
-                prefix=f"/{settings.service_name}/v1"
-            )
+            # All route classes share one router, route_class_override still
+            # gives each route its own class without a router per route
             router.add_api_route(
-                path=cls.PATH,
+                path=API_PREFIX + cls.PATH,
                 endpoint=cls.endpoint,
                 methods=[cls.METHOD],
                 dependencies=dependencies,
                 summary=cls.SUMMARY,
                 description=cls.DESCRIPTION,
                 response_model=cls.RESPONSE_MODEL,
+                route_class_override=cls,
             )
-            app.include_router(router)
         except Exception:
             logger.error(f"Failed to add route {cls.PATH}")
             raise
@@ -71,16 +87,25 @@ class FastRoute(APIRoute):
         original_route_handler = super().get_route_handler()
 
         async def custom_route_handler(request: Request) -> Response:
+            start = time.perf_counter_ns()
+            phases_token = start_phases()
+            REQUESTS_IN_FLIGHT.inc(self.path, request.method)
+            error_category = None
+            response = None
+
             try:
-                await self._before_request(request)
+                with timed_phase("before_request"):
+                    await self._before_request(request)
 
                 # if not self.PUBLIC:
                 #     await self._route_auth(request)
 
-                response = await original_route_handler(request)
+                with timed_phase("handler"):
+                    response = await original_route_handler(request)
 
             except json.decoder.JSONDecodeError:
                 error = ValidationException("Invalid JSON")
+                error_category = error.CATEGORY
                 logger.exception(error)
                 response = JSONResponse(
                     status_code=error.STATUS_CODE, content=error.content()
@@ -88,6 +113,7 @@ class FastRoute(APIRoute):
 
             except RequestValidationError as exc:
                 error = ValidationException()
+                error_category = error.CATEGORY
                 error.from_request_validation_errors(exc.errors())
                 logger.exception(error)
                 response = JSONResponse(
@@ -95,20 +121,41 @@ class FastRoute(APIRoute):
                 )
 
             except HTTPException as exc:
+                error_category = getattr(exc, "CATEGORY", ErrorCategories.GENERAL)
                 logger.exception(exc)
                 response = JSONResponse(
-                    status_code=exc.STATUS_CODE, content=exc.content()
+                    status_code=exc.STATUS_CODE,
+                    content=exc.content(),
+                    headers=exc.headers,
                 )
 
             except Exception as exc:
                 logger.exception(exc)
                 error = BaseException()
+                error_category = error.CATEGORY
                 response = JSONResponse(
                     status_code=error.STATUS_CODE, content=error.content()
                 )
 
             finally:
-                return await self._after_request(request, response)
+                # First, so nothing after can leak the in-flight count
+                REQUESTS_IN_FLIGHT.dec(self.path, request.method)
+                phases = finish_phases(phases_token)
+                # None if the request was cancelled
+                if response is not None:
+                    self._record_metrics(
+                        request,
+                        response,
+                        time.perf_counter_ns() - start,
+                        phases,
+                        error_category,
+                    )
+
+            queries = getattr(request.state, "db_queries", None)
+            if queries is not None and queries.wrote:
+                replica_router.open_window(response)
+
+            return await self._after_request(request, response)
 
         return custom_route_handler
 
@@ -118,7 +165,9 @@ class FastRoute(APIRoute):
         """
 
         request.state.request_id = str(uuid.uuid4())
-        request.state.request_start_time = datetime.datetime.now()
+        request.state.request_start_ns = time.perf_counter_ns()
+        request.state.db_queries = track_request_queries(request.state.request_id)
+        request.state.db_queries.read_primary = replica_router.wants_primary(request)
 
     async def _after_request(self, request: Request, response: Response):
         """
@@ -128,67 +177,88 @@ class FastRoute(APIRoute):
         if isinstance(response, RedirectResponse):
             return response
 
-        content_type = response.headers["content-type"]
+        content_type = response.headers.get("content-type", "")
         if (
             "text/csv" in content_type
             or "text/xml" in content_type
             or "image" in content_type
             or self._skip_request_logging(request)
+            or not request_logger.should_log()
         ):
             return response
 
-        # Get response body
-        if isinstance(response, JSONResponse):
-            response_body = response.body
-        else:
-            # Load the streaming response into memory hmmm
-            response_body = [chunk async for chunk in response.body_iterator][0]
-
-        try:
-            if isinstance(response_body, bytes):
-                response_body = response_body.decode()
-            response_body = json.loads(response_body)
-        except Exception:
-            pass
-
         # Total elapsed response time
-        response_total_ms = int(
-            (
-                datetime.datetime.now() - request.state.request_start_time
-            ).total_seconds()
-            * 1000
-        )
-
-        # Get request body
-        request_body = await request.body()
-        request_form = await request.form()
-        if request_body:
-            request_data = str(request_body)
-        elif request_form:
-            request_data = str(dict(request_form))
+        response_total_ms = (
+            time.perf_counter_ns() - request.state.request_start_ns
+        ) // 1_000_000
+
+        # The body is cached on the request by the time the route has run
+        request_body = b""
+        if request.method in ("POST", "PUT", "PATCH"):
+            request_body = await request.body()
+        request_data, request_truncated = request_logger.capture(request_body)
+
+        record = {
+            "route": request.url.path,
+            "method": request.method,
+            "service": settings.service_name,
+            "request_id": request.state.request_id,
+            "timestamp": time.strftime("%Y-%b-%d %H:%M:%S"),
+            "from": request.client.host if request.client else None,
+            "request_headers": dict(request.headers),
+            "request_body": request_data,
+            "request_body_truncated": request_truncated,
+            "response_headers": dict(response.headers),
+            "response_status": response.status_code,
+            "response_total_ms": response_total_ms,
+            "db_queries": request.state.db_queries.count,
+            "db_total_ms": request.state.db_queries.total_ns // 1_000_000,
+        }
+
+        if isinstance(response, StreamingResponse):
+            # Captured as the chunks are sent, the record is queued at the end
+            response.body_iterator = request_logger.tee(response.body_iterator, record)
         else:
-            request_data = ""
-
-        # TODO: fix logging and set this up
-        print(
-            {
-                "route": request.url.path,
-                "method": request.method,
-                "service": settings.service_name,
-                "request_id": request.state.request_id,
-                "timestamp": time.strftime("%Y-%b-%d %H:%M:%S"),
-                "from": request.client.host,
-                "request_headers": dict(request.headers),
-                "request_body": request_data,
-                "response_headers": dict(response.headers),
-                "response_status": response.status_code,
-                "response_total_ms": response_total_ms,
-                "response_body": response_body,
-            }
-        )
+            # Log the serialized body as-is rather than parsing it back again
+            (
+                record["response_body"],
+                record["response_body_truncated"],
+            ) = request_logger.capture(getattr(response, "body", None))
+            request_logger.submit(record)
 
         return response
 
+    def _record_metrics(
+        self,
+        request: Request,
+        response: Response,
+        elapsed_ns: int,
+        phases: dict,
+        error_category: Optional[str],
+    ) -> None:
+        # The route template rather than the URL keeps label cardinality low
+        REQUEST_DURATION.observe(
+            self.path, request.method, str(response.status_code), value=elapsed_ns / 1e9
+        )
+        for phase, phase_ns in phases.items():
+            REQUEST_PHASE_DURATION.observe(
+                self.path, request.method, phase, value=phase_ns / 1e9
+            )
+        if error_category is not None:
+            REQUEST_ERRORS.inc(self.path, request.method, error_category)
+
+        # Missing if _before_request failed
+        queries = getattr(request.state, "db_queries", None)
+        if queries is not None:
+            DB_QUERIES_PER_REQUEST.observe(
+                self.path, request.method, value=queries.count
+            )
+            if queries.count > settings.db_queries_per_request_warning:
+                logger.warning(
+                    f"{request.method} {self.path} ran {queries.count} queries "
+                    f"(request {queries.request_id}), possible N+1"
+                )
+
     def _skip_request_logging(self, request):
         return any(
             (
@@ -198,6 +268,8 @@ class FastRoute(APIRoute):
                     "/redoc",
                     "/openapi.json",
                     "/status",
+                    "/metrics",
+                    "/debug/",
                 ]
             )
-        )
\ No newline at end of file
+        )
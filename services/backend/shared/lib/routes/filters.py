@@ -0,0 +1,269 @@
+"""
+Filtering, sorting and sparse fieldsets for CrudRoutes INDEX endpoints.
+
+Filters are typed query parameters generated from the table's columns:
+
+    ?name=foo                   equality
+    ?id__in=1&id__in=2          IN
+    ?created_at__gte=2024-01-01 range: __gt, __gte, __lt, __lte
+    ?email__prefix=admin        prefix match, on text columns
+
+Sorting is ``order_by=column`` or ``order_by=-column`` for descending, with
+the primary key as tie breaker so keyset pagination still works, and
+``fields=id,name`` selects a subset of columns.
+"""
+
+import datetime
+import decimal
+import inspect
+import typing as t
+import uuid
+
+import pydantic
+from fastapi import Query
+from piccolo.columns import Column, Secret
+from piccolo.columns.combination import Combinable
+
+from shared.lib.exceptions import ValidationException
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FILTERABLE_TYPES = (
+    str,
+    int,
+    float,
+    decimal.Decimal,
+    bool,
+    datetime.datetime,
+    datetime.date,
+    datetime.time,
+    uuid.UUID,
+)
+RANGE_OPERATORS = {
+    "gt": Column.__gt__,
+    "gte": Column.__ge__,
+    "lt": Column.__lt__,
+    "lte": Column.__le__,
+}
+# Taken by INDEX itself, so never used as filter names
+RESERVED_PARAMETERS = {"request", "limit", "after", "stream", "order_by", "fields"}
+
+
+def is_indexed(column: Column) -> bool:
+    return column._meta.primary_key or column._meta.index or column._meta.unique
+
+
+def coerce(column: Column, value: t.Any) -> t.Any:
+    """
+    Convert a value decoded from JSON, like a cursor, to the column's type
+    so asyncpg will accept it as a parameter
+    """
+    try:
+        return pydantic.TypeAdapter(column.value_type).validate_python(value)
+    except pydantic.ValidationError:
+        raise ValidationException("Invalid cursor.")
+
+
+def filterable_columns(
+    columns: t.Sequence[Column], names: t.Optional[t.Sequence[str]]
+) -> t.List[Column]:
+    """
+    The columns that can be filtered on: the named ones, or by default the
+    primary key and indexed columns of a supported type.  Secrets never are.
+    """
+    by_name: t.Dict[str, Column] = {}
+    for column in columns:
+        by_name.setdefault(column._meta.name, column)
+
+    if names is not None:
+        unknown = set(names) - set(by_name)
+        if unknown:
+            raise ValueError(f"Unknown filter fields: {sorted(unknown)}")
+        candidates = [by_name[name] for name in names]
+    else:
+        candidates = [column for column in by_name.values() if is_indexed(column)]
+
+    return [
+        column
+        for column in candidates
+        if not isinstance(column, Secret)
+        and column.value_type in FILTERABLE_TYPES
+        and column._meta.name not in RESERVED_PARAMETERS
+    ]
+
+
+def sortable_columns(
+    columns: t.Sequence[Column], names: t.Optional[t.Sequence[str]]
+) -> t.List[Column]:
+    """
+    The columns besides the primary key that can be sorted by: the named
+    ones, or by default the indexed, non-nullable columns of a supported type
+    """
+    if names is None:
+        return [
+            column
+            for column in filterable_columns(columns, None)
+            if not column._meta.primary_key and not column._meta.null
+        ]
+
+    by_name = {column._meta.name: column for column in columns}
+    unknown = set(names) - set(by_name)
+    if unknown:
+        raise ValueError(f"Unknown sort fields: {sorted(unknown)}")
+
+    for name in names:
+        # NULLs never compare greater or less, so keyset pagination would
+        # skip them
+        if by_name[name]._meta.null:
+            raise ValueError(f"Can't sort by nullable '{name}'")
+    return [by_name[name] for name in names]
+
+
+def warn_unindexed(route: str, kind: str, columns: t.Sequence[Column]) -> None:
+    for column in columns:
+        if not is_indexed(column):
+            logger.warning(
+                f"{route}: {kind} column '{column._meta.name}' has no index, "
+                f"set index=True on it or drop it from the route's {kind} fields"
+            )
+
+
+def build_filters(
+    columns: t.Sequence[Column],
+) -> t.Callable[..., t.Optional[Combinable]]:
+    """
+    A FastAPI dependency taking a query parameter per filter, and returning
+    the combined where clause or None
+    """
+    parameters = []
+    operators: t.Dict[str, t.Tuple[Column, str]] = {}
+
+    def add(name: str, column: Column, operator: str, annotation: t.Any) -> None:
+        parameters.append(
+            inspect.Parameter(
+                name,
+                inspect.Parameter.KEYWORD_ONLY,
+                default=Query(None),
+                annotation=t.Optional[annotation],
+            )
+        )
+        operators[name] = (column, operator)
+
+    for column in columns:
+        name = column._meta.name
+        value_type = column.value_type
+
+        add(name, column, "eq", value_type)
+        add(f"{name}__in", column, "in", t.List[value_type])
+        if value_type is not bool:
+            for operator in RANGE_OPERATORS:
+                add(f"{name}__{operator}", column, operator, value_type)
+        if value_type is str:
+            add(f"{name}__prefix", column, "prefix", str)
+
+    def _filters(**values) -> t.Optional[Combinable]:
+        clauses: t.List[Combinable] = []
+        for name, value in values.items():
+            if value is None:
+                continue
+
+            column, operator = operators[name]
+            if operator == "eq":
+                clauses.append(column == value)
+            elif operator == "in":
+                clauses.append(column.is_in(value))
+            elif operator == "prefix":
+                escaped = (
+                    value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                )
+                clauses.append(column.like(f"{escaped}%"))
+            else:
+                clauses.append(RANGE_OPERATORS[operator](column, value))
+
+        if not clauses:
+            return None
+
+        where = clauses[0]
+        for clause in clauses[1:]:
+            where = where & clause
+        return where
+
+    _filters.__signature__ = inspect.Signature(parameters)
+    return _filters
+
+
+def sort_options(columns: t.Sequence[Column]) -> t.List[str]:
+    names = [column._meta.name for column in columns]
+    return names + [f"-{name}" for name in names]
+
+
+def parse_sort(
+    order_by: t.Optional[str], columns: t.Sequence[Column], primary_key: Column
+) -> t.Tuple[Column, bool]:
+    """
+    The column to sort by and whether it's ascending
+    """
+    if order_by is None:
+        return primary_key, True
+
+    name = order_by.removeprefix("-")
+    for column in columns:
+        if column._meta.name == name:
+            return column, not order_by.startswith("-")
+
+    raise ValidationException(f"Can't order by '{name}'.")
+
+
+def parse_fields(
+    fields: t.Optional[str], columns: t.Sequence[Column], primary_key: Column
+) -> t.Sequence[Column]:
+    """
+    The columns named in a comma separated ``fields`` parameter, always
+    including the primary key so results can still be paginated
+    """
+    if not fields:
+        return columns
+
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    selected = [column for column in columns if column._meta.name in names]
+    unknown = names - {column._meta.name for column in selected}
+    if unknown:
+        raise ValidationException(f"Unknown fields: {', '.join(sorted(unknown))}.")
+
+    # Column overloads ==, so compare by identity rather than with ``in``
+    if not any(column is primary_key for column in selected):
+        selected.insert(0, primary_key)
+    return selected
+
+
+def keyset_where(
+    sort_column: Column,
+    ascending: bool,
+    primary_key: Column,
+    cursor: t.Any,
+) -> Combinable:
+    """
+    Rows after the cursor for the given sort, the cursor being the primary
+    key, or ``[sort value, primary key]`` when sorting by another column
+    """
+    after = Column.__gt__ if ascending else Column.__lt__
+    if sort_column is primary_key:
+        return after(primary_key, coerce(primary_key, cursor))
+
+    if not isinstance(cursor, list) or len(cursor) != 2:
+        raise ValidationException("Invalid cursor.")
+
+    sort_value = coerce(sort_column, cursor[0])
+    pk_value = coerce(primary_key, cursor[1])
+    return after(sort_column, sort_value) | (
+        (sort_column == sort_value) & after(primary_key, pk_value)
+    )
+
+
+def cursor_value(row: dict, sort_column: Column, primary_key: Column) -> t.Any:
+    pk_value = row[primary_key._meta.name]
+    if sort_column is primary_key:
+        return pk_value
+    return [row[sort_column._meta.name], pk_value]
@@ -0,0 +1,108 @@
+"""
+Route discovery, and the manifest that lets the app skip it at boot.
+
+Generate the manifest at build time with:
+
+    python -m shared.lib.routes.manifest
+"""
+
+import importlib
+import importlib.util
+import inspect
+import json
+import os
+import pkgutil
+import typing as t
+
+from home.settings import settings
+from shared.lib.routes.crud import CrudRoutes
+from shared.lib.routes.fast import FastRoute
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+ROUTE_PACKAGES = ["home.api", "shared.api"]
+
+
+def discover_route_modules() -> t.List[str]:
+    """
+    Every module under ROUTE_PACKAGES, found through the import system so it
+    doesn't depend on the working directory
+    """
+    modules = []
+    for package in ROUTE_PACKAGES:
+        spec = importlib.util.find_spec(package)
+        if spec is None or spec.submodule_search_locations is None:
+            logger.warning(f"Route package '{package}' not found")
+            continue
+
+        for module_info in pkgutil.walk_packages(
+            spec.submodule_search_locations, prefix=f"{package}."
+        ):
+            if not module_info.ispkg:
+                modules.append(module_info.name)
+
+    return sorted(modules)
+
+
+def find_route_classes(module) -> t.List[t.Type[FastRoute]]:
+    return [
+        attribute
+        for _, attribute in inspect.getmembers(module, inspect.isclass)
+        if (
+            attribute not in (FastRoute, CrudRoutes)
+            and issubclass(attribute, FastRoute)
+            # Only classes defined here, not ones imported from elsewhere
+            and attribute.__module__ == module.__name__
+        )
+    ]
+
+
+def discover_route_classes() -> t.List[t.Type[FastRoute]]:
+    route_classes = []
+    for route_file in discover_route_modules():
+        try:
+            module = importlib.import_module(route_file)
+        except ModuleNotFoundError:
+            logger.exception(f"Failed to import route file '{route_file}'")
+            continue
+
+        route_classes += find_route_classes(module)
+
+    return route_classes
+
+
+def load_manifest(path: str) -> t.Optional[t.List[t.Type[FastRoute]]]:
+    """
+    Import the route classes listed in the manifest, or None if there is no
+    manifest to load
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as manifest_file:
+        entries = json.load(manifest_file)["routes"]
+
+    route_classes = []
+    for entry in entries:
+        module_name, class_name = entry.split(":")
+        route_classes.append(getattr(importlib.import_module(module_name), class_name))
+
+    return route_classes
+
+
+def generate_manifest(path: str) -> t.List[str]:
+    entries = [
+        f"{route_class.__module__}:{route_class.__name__}"
+        for route_class in discover_route_classes()
+    ]
+    with open(path, "w") as manifest_file:
+        json.dump({"routes": entries}, manifest_file, indent=2)
+
+    return entries
+
+
+if __name__ == "__main__":
+    for entry in generate_manifest(settings.route_manifest_path):
+        print(entry)
@@ -0,0 +1,51 @@
+"""
+Per-table registry of the Pydantic models used by CrudRoutes.
+"""
+
+import typing as t
+
+import pydantic
+from piccolo.columns import Column
+from piccolo.table import Table
+from piccolo_api.crud.serializers import create_pydantic_model
+
+
+class CrudModels(t.NamedTuple):
+    response: t.Type[pydantic.BaseModel]
+    request: t.Type[pydantic.BaseModel]
+    patch: t.Type[pydantic.BaseModel]
+    #: The columns behind ``response``, select these and the rows can be
+    #: serialized directly without validating them against the model again
+    response_columns: t.Tuple[Column, ...]
+
+
+_registry: t.Dict[t.Type[Table], CrudModels] = {}
+
+
+def get_crud_models(table: t.Type[Table]) -> CrudModels:
+    """
+    Build the models for a table the first time they are asked for, and hand
+    back the same ones after that.
+    """
+    models = _registry.get(table)
+    if models is None:
+        name = table.__name__
+        response = create_pydantic_model(
+            table=table,
+            include_default_columns=True,
+            model_name=f"{name}Response",
+        )
+        models = _registry[table] = CrudModels(
+            response=response,
+            request=create_pydantic_model(table=table, model_name=f"{name}Request"),
+            patch=create_pydantic_model(
+                table=table, model_name=f"{name}Patch", all_optional=True
+            ),
+            response_columns=tuple(
+                column
+                for column in table._meta.columns
+                if column._meta.name in response.model_fields
+            ),
+        )
+
+    return models
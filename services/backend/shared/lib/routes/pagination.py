@@ -0,0 +1,110 @@
+"""
+Keyset pagination and streaming helpers for CrudRoutes INDEX endpoints.
+"""
+
+import base64
+import json
+import typing as t
+
+from fastapi.responses import StreamingResponse
+from piccolo.query import Select
+
+from home.settings import settings
+from shared.lib.exceptions import ServiceUnavailableException, ValidationException
+from shared.lib.routes.responses import dumps
+
+
+def encode_cursor(value: t.Any) -> str:
+    """
+    Turns the last primary key of a page into an opaque cursor token
+    """
+    raw = json.dumps(value, default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> t.Any:
+    """
+    Reverses encode_cursor, raising a ValidationException on garbage input
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValidationException("Invalid cursor.")
+
+
+class StreamSlots(object):
+    """
+    Caps the rows streams running at once in this worker.  Each holds a
+    database connection for as long as its client takes to read it, so
+    without a cap slow clients could take every connection in the pool.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+
+    def acquire(self) -> None:
+        if self.in_use >= self.limit:
+            raise ServiceUnavailableException(
+                "Too many streams in progress.", retry_after=1
+            )
+        self.in_use += 1
+
+    def release(self) -> None:
+        self.in_use -= 1
+
+
+stream_slots = StreamSlots(settings.crud_stream_max_concurrent)
+
+
+class RowStreamResponse(StreamingResponse):
+    """
+    Gives back its stream slot however the response ends, even if the
+    client went away before the body was started
+    """
+
+    def __init__(self, rows: t.AsyncGenerator[bytes, None], media_type: str):
+        super().__init__(rows, media_type=media_type)
+        self.rows = rows
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.rows.aclose()
+            stream_slots.release()
+
+
+def stream_rows(
+    query: Select,
+    fmt: t.Literal["ndjson", "json"],
+    batch_size: int,
+    node: t.Optional[str] = None,
+) -> StreamingResponse:
+    """
+    Stream the rows of a select query from a server side cursor, either as
+    newline delimited JSON or as a chunked JSON array.  Only one batch of
+    rows is held in memory at a time.
+    """
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+
+    async def _generate() -> t.AsyncGenerator[bytes, None]:
+        async with await query.batch(batch_size=batch_size, node=node) as batch:
+            if fmt == "json":
+                yield b"["
+
+            first = True
+            async for rows in batch:
+                if fmt == "ndjson":
+                    yield b"".join(dumps(row) + b"\n" for row in rows)
+                else:
+                    chunk = b",".join(dumps(row) for row in rows)
+                    yield chunk if first else b"," + chunk
+                first = False
+
+            if fmt == "json":
+                yield b"]"
+
+    stream_slots.acquire()
+    return RowStreamResponse(_generate(), media_type=media_type)
@@ -0,0 +1,68 @@
+"""
+Production server: a gunicorn master supervising uvicorn workers.
+
+The master restarts workers that exit, which is what lets them be recycled
+after a number of requests, and on SIGTERM it stops accepting connections
+and gives workers time to drain before killing them.  Each worker runs the
+lifespan itself, so opens its own database pool before it accepts any
+connections.
+"""
+
+import logging
+import os
+import typing as t
+
+from gunicorn.app.base import BaseApplication
+from gunicorn.util import import_app
+from uvicorn.workers import UvicornWorker
+
+from home.settings import settings
+
+
+class ProductionWorker(UvicornWorker):
+    CONFIG_KWARGS = {
+        "loop": "uvloop",
+        "http": "httptools",
+        # Requests still running this long after SIGTERM are cut off
+        "timeout_graceful_shutdown": int(settings.server_drain_timeout),
+    }
+
+
+class ProductionServer(BaseApplication):
+    def __init__(self, app_path: str, options: t.Dict[str, t.Any]):
+        self.app_path = app_path
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return import_app(self.app_path)
+
+
+def server_options() -> t.Dict[str, t.Any]:
+    return {
+        "bind": f"{settings.host}:{settings.app_port}",
+        "workers": settings.server_workers or os.cpu_count() or 1,
+        "worker_class": f"{ProductionWorker.__module__}.ProductionWorker",
+        "preload_app": False,
+        "backlog": settings.server_backlog,
+        "keepalive": settings.server_keep_alive,
+        # Jitter stops every worker restarting at once
+        "max_requests": settings.server_max_requests,
+        "max_requests_jitter": settings.server_max_requests_jitter,
+        # Draining, then the lifespan shutdown flushing logs and closing the
+        # pool, have to fit in this before the worker is killed
+        "graceful_timeout": int(
+            settings.server_drain_timeout + settings.server_shutdown_timeout
+        ),
+        "timeout": settings.server_worker_timeout,
+        "loglevel": logging.getLevelName(settings.log_level).lower(),
+        "accesslog": None,
+    }
+
+
+def run_production(app_path: str) -> None:
+    ProductionServer(app_path, server_options()).run()
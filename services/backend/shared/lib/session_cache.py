@@ -0,0 +1,135 @@
+"""
+In-process cache of validated session tokens.
+
+Each worker keeps its own cache, so a session removed through another
+worker stays usable here for at most ``ttl`` seconds.
+"""
+
+import asyncio
+import collections
+import datetime
+import time
+import typing as t
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CachedSession(t.NamedTuple):
+    user_id: t.Any
+    expiry_date: datetime.datetime
+    max_expiry_date: datetime.datetime
+
+
+# Returned by SessionCache.get when the token has never been looked up
+MISSING = object()
+
+
+class SessionCache(object):
+    """
+    A TTL/LRU cache of sessions keyed by token.
+
+    Unknown tokens are cached as ``None`` for ``negative_ttl`` seconds so
+    repeated bad tokens don't hit the database either.  Expiry extensions
+    are recorded here and written back in batches by a background task.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        negative_ttl: float,
+        max_size: int,
+        flush_interval: float,
+        flush: t.Callable[[t.Dict[str, datetime.datetime]], t.Awaitable[None]],
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.flush = flush
+
+        self.hits = 0
+        self.misses = 0
+        self._entries: t.OrderedDict[str, t.Tuple[float, t.Optional[CachedSession]]] = (
+            collections.OrderedDict()
+        )
+        self._pending: t.Dict[str, datetime.datetime] = {}
+        self._task: t.Optional[asyncio.Task] = None
+
+    def get(self, token: str) -> t.Union[CachedSession, None, object]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        expires_at, session = entry
+        if expires_at < time.monotonic():
+            del self._entries[token]
+            self.misses += 1
+            return MISSING
+
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return session
+
+    def put(self, token: str, session: t.Optional[CachedSession]) -> None:
+        ttl = self.ttl if session is not None else self.negative_ttl
+        self._entries[token] = (time.monotonic() + ttl, session)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        self._entries.pop(token, None)
+        self._pending.pop(token, None)
+
+    def extend(self, token: str, session: CachedSession) -> None:
+        """
+        Store an extended session and queue its new expiry for write-back
+        """
+        entry = self._entries.get(token)
+        expires_at = entry[0] if entry else time.monotonic() + self.ttl
+        self._entries[token] = (expires_at, session)
+        self._pending[token] = session.expiry_date
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_pending()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_pending()
+
+    async def flush_pending(self) -> None:
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        try:
+            await self.flush(pending)
+        except Exception:
+            logger.exception(f"Failed to flush {len(pending)} session extensions")
+            # Keep them for the next round, newer extensions win
+            for token, expiry_date in pending.items():
+                if token not in self._pending:
+                    self._pending[token] = expiry_date
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending_extensions": len(self._pending),
+        }
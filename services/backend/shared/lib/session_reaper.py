@@ -0,0 +1,93 @@
+"""
+Background deletion of expired sessions.
+
+Every worker runs a reaper.  Batches are claimed with SKIP LOCKED, so
+reapers in different workers split the work rather than contend for it.
+"""
+
+import asyncio
+import time
+import typing as t
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SessionReaper(object):
+    def __init__(
+        self,
+        interval: float,
+        batch_size: int,
+        batch_pause: float,
+        reap: t.Callable[[int], t.Awaitable[int]],
+        count_backlog: t.Callable[[], t.Awaitable[int]],
+        maintain_partitions: t.Optional[t.Callable[[], t.Awaitable[int]]] = None,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.reap = reap
+        self.count_backlog = count_backlog
+        self.maintain_partitions = maintain_partitions
+
+        self._task: t.Optional[asyncio.Task] = None
+        self.reaped = 0
+        self.partitions_dropped = 0
+        self.backlog = 0
+        self.last_run_seconds = 0.0
+
+    async def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Failed to reap expired sessions")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """
+        Delete expired sessions a batch at a time until there are none left,
+        pausing between batches so the reaper never hogs the pool
+        """
+        start = time.monotonic()
+        if self.maintain_partitions is not None:
+            self.partitions_dropped += await self.maintain_partitions()
+
+        reaped = 0
+        while True:
+            deleted = await self.reap(self.batch_size)
+            reaped += deleted
+            if deleted < self.batch_size:
+                break
+            await asyncio.sleep(self.batch_pause)
+
+        self.reaped += reaped
+        self.backlog = await self.count_backlog()
+        self.last_run_seconds = time.monotonic() - start
+        if reaped:
+            logger.info(
+                f"Reaped {reaped} expired sessions in {self.last_run_seconds:.2f}s"
+            )
+        return reaped
+
+    def stats(self) -> dict:
+        return {
+            "reaped": self.reaped,
+            "backlog": self.backlog,
+            "partitions_dropped": self.partitions_dropped,
+            "last_run_seconds": self.last_run_seconds,
+        }
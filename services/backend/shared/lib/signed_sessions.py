@@ -0,0 +1,163 @@
+"""
+Stateless session tokens, signed with HMAC-SHA256.
+
+A token is ``<key id>.<payload>.<signature>``, the payload being base64
+JSON holding the user id, the expiry and a random token id.  Verifying one
+needs no I/O: the signature is checked against the key it names, then the
+expiry, then the in-memory revocation list.
+
+Keys rotate by adding a new key to ``session_signing_keys``, switching
+``session_signing_key_id`` to it, and removing the old key once every
+token signed with it has expired.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
+import typing as t
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# HMAC-SHA256 keys shorter than its 32 byte output weaken the signature
+MIN_KEY_LENGTH = 32
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+class TokenPayload(t.NamedTuple):
+    user_id: t.Any
+    token_id: str
+    #: Epoch seconds
+    expires_at: float
+
+
+class TokenSigner(object):
+    def __init__(self, keys: t.Dict[str, str], key_id: str):
+        if key_id not in keys:
+            raise ValueError(f"Session signing key '{key_id}' is not configured")
+        if any("." in kid for kid in keys):
+            raise ValueError("Session signing key ids can't contain '.'")
+        for kid, key in keys.items():
+            if len(key.encode()) < MIN_KEY_LENGTH:
+                raise ValueError(
+                    f"Session signing key '{kid}' must be at least "
+                    f"{MIN_KEY_LENGTH} bytes long"
+                )
+
+        self.key_id = key_id
+        self._keys = {kid: key.encode() for kid, key in keys.items()}
+
+    def _signature(self, key_id: str, payload: str) -> str:
+        message = f"{key_id}.{payload}".encode()
+        return _b64encode(
+            hmac.new(self._keys[key_id], message, hashlib.sha256).digest()
+        )
+
+    def sign(self, user_id: t.Any, expires_at: float) -> t.Tuple[str, TokenPayload]:
+        payload = TokenPayload(user_id, secrets.token_urlsafe(12), expires_at)
+        encoded = _b64encode(
+            json.dumps(
+                {"uid": user_id, "jti": payload.token_id, "exp": expires_at},
+                default=str,
+                separators=(",", ":"),
+            ).encode()
+        )
+        token = f"{self.key_id}.{encoded}.{self._signature(self.key_id, encoded)}"
+        return token, payload
+
+    def verify(self, token: str) -> t.Optional[TokenPayload]:
+        """
+        The payload of a token with a valid signature, expired or not
+        """
+        try:
+            key_id, encoded, signature = token.split(".")
+        except ValueError:
+            return None
+
+        if key_id not in self._keys or not hmac.compare_digest(
+            signature, self._signature(key_id, encoded)
+        ):
+            return None
+
+        try:
+            data = json.loads(_b64decode(encoded))
+            return TokenPayload(data["uid"], data["jti"], float(data["exp"]))
+        except (ValueError, KeyError, TypeError):
+            return None
+
+
+class RevocationList(object):
+    """
+    Revoked token ids, kept until the tokens expire anyway.
+
+    Revocations are written to the database and each worker reloads the
+    full list every ``sync_interval`` seconds, so a token revoked through
+    another worker is accepted here for at most that long.
+    """
+
+    def __init__(
+        self,
+        sync_interval: float,
+        store: t.Callable[[str, float], t.Awaitable[None]],
+        load: t.Callable[[], t.Awaitable[t.Dict[str, float]]],
+    ):
+        self.sync_interval = sync_interval
+        self.store = store
+        self.load = load
+        self._revoked: t.Dict[str, float] = {}
+        self._task: t.Optional[asyncio.Task] = None
+
+    def is_revoked(self, token_id: str) -> bool:
+        return token_id in self._revoked
+
+    async def revoke(self, payload: TokenPayload) -> None:
+        self._revoked[payload.token_id] = payload.expires_at
+        await self.store(payload.token_id, payload.expires_at)
+
+    async def start(self) -> None:
+        if self._task is None:
+            await self.sync()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.sync()
+
+    async def sync(self) -> None:
+        try:
+            revoked = await self.load()
+        except Exception:
+            logger.exception("Failed to sync the session revocation list")
+            return
+
+        # Keep local revocations that may not have been read back yet
+        now = time.time()
+        for token_id, expires_at in self._revoked.items():
+            if expires_at > now:
+                revoked.setdefault(token_id, expires_at)
+        self._revoked = revoked
+
+    def stats(self) -> dict:
+        return {"revoked": len(self._revoked)}
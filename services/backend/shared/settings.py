@@ -1,19 +1,190 @@
 from pydantic_settings import BaseSettings
 
 import logging
+import typing as t
 
 
 class SharedSettings(BaseSettings):
     app_port: int = 9000
     host: str = "0.0.0.0"
-    env: str = 'local'
+    env: str = "local"
     log_level: int = logging.DEBUG
 
+    # "development" runs one process with the reloader, "production" runs
+    # server_workers uvicorn workers under gunicorn, see shared.lib.server
+    server_mode: t.Literal["development", "production"] = "development"
+    # 0 for one per CPU.  Each opens its own pool of up to db_pool_max_size
+    # connections.
+    server_workers: int = 0
+    # Keep longer than the load balancer's idle timeout, so it never reuses
+    # a connection the server has just closed
+    server_keep_alive: int = 75
+    server_backlog: int = 2048
+    # Workers are restarted after about this many requests, bounding memory
+    # growth, 0 disables it
+    server_max_requests: int = 10000
+    server_max_requests_jitter: int = 1000
+    # Seconds in-flight requests get to finish after SIGTERM, and then the
+    # lifespan shutdown gets, before the worker is killed
+    server_drain_timeout: float = 30.0
+    server_shutdown_timeout: float = 15.0
+    # Workers that block their event loop this long are killed and replaced
+    server_worker_timeout: int = 60
+
     enable_request_logging: bool = True
+    request_log_sample_rate: float = 1.0
+    request_log_max_body_bytes: int = 4096
+    request_log_queue_size: int = 10000
+    request_log_batch_size: int = 200
+    request_log_flush_interval: float = 1.0
     enable_swagger: bool = True
 
+    # Responses of at least this many bytes are compressed with the first
+    # of compression_encodings the client accepts, 0 compresses everything.
+    # "br" and "zstd" are only offered when brotli and zstandard are
+    # installed.
+    compression_enabled: bool = True
+    compression_minimum_size: int = 1024
+    compression_encodings: t.List[str] = ["zstd", "br", "gzip"]
+    # Tuned for responses compressed on the fly rather than for ratio
+    compression_gzip_level: int = 5
+    compression_brotli_quality: int = 4
+    compression_zstd_level: int = 3
+
+    # Written at build time by `python -m shared.lib.routes.manifest`,
+    # routes are discovered by walking the route packages when it's missing
+    use_route_manifest: bool = True
+    route_manifest_path: str = "route_manifest.json"
+
     db_name: str = "dev_db"
     db_user: str = "dev_user"
     db_password: str = "password"
     db_host: str = "db.piccolo"
-    db_port: int = 5432
\ No newline at end of file
+    db_port: int = 5432
+    db_pool_min_size: int = 5
+    db_pool_max_size: int = 20
+    db_pool_acquire_timeout: float = 5.0
+    db_statement_timeout_ms: int = 30000
+    # Seconds, 0 disables the limit
+    db_pool_max_lifetime: float = 1800.0
+    db_pool_max_idle_lifetime: float = 300.0
+    # Refuse to start without a working pool, rather than running with a
+    # new connection per query
+    db_pool_fail_fast: bool = False
+
+    # Read replicas as "host" or "host:port", with the primary's database
+    # and credentials. Set as JSON, e.g. DB_REPLICA_HOSTS='["db-replica:5432"]'
+    db_replica_hosts: t.List[str] = []
+    # After a write, the client's reads go to the primary for this long
+    db_read_your_writes_seconds: float = 5.0
+    # Replicas further behind than this are skipped, 0 disables the check
+    db_replica_max_lag_seconds: float = 10.0
+    db_replica_check_interval: float = 5.0
+    db_slow_query_ms: float = 200.0
+    db_slow_query_log_size: int = 100
+    # Requests running more queries than this are logged as likely N+1s
+    db_queries_per_request_warning: int = 25
+
+    # Serves things like the slow query log, which contains query parameters
+    enable_debug_endpoints: bool = False
+
+    crud_index_default_limit: int = 100
+    crud_index_max_limit: int = 1000
+    crud_stream_batch_size: int = 500
+    # Streamed INDEX responses running at once per worker, each holding a
+    # pooled connection until the client has read it all.  Keep it well
+    # under db_pool_max_size, more are refused with a 503.
+    crud_stream_max_concurrent: int = 5
+    crud_bulk_max_size: int = 1000
+    # Server side cache of GET/INDEX responses, 0 disables it. Only writes
+    # through the same worker invalidate it, unless the change feed is
+    # enabled, so keep this short.
+    crud_response_cache_ttl: float = 0.0
+    crud_response_cache_max_entries: int = 1024
+    # COUNT runs an exact count below this many (estimated) rows, and
+    # returns the planner's estimate above it
+    crud_count_exact_threshold: int = 100000
+    crud_count_cache_ttl: float = 10.0
+    # Server-sent change events for CrudRoutes with "CHANGES" in METHODS.
+    # Needs the triggers from `piccolo home install_change_triggers`.
+    crud_changes_enabled: bool = False
+    # Events buffered per subscriber, one falling further behind is dropped
+    # and has to reconnect from its last event id
+    crud_changes_queue_size: int = 1000
+    crud_changes_max_subscribers: int = 1000
+    crud_changes_heartbeat: float = 15.0
+    # Seconds of changes kept for clients resuming from an event id, and the
+    # most replayed on resume before the client is told to reload instead
+    crud_changes_retention: float = 3600.0
+    crud_changes_replay_limit: int = 10000
+
+    password_hash_workers: int = 4
+    # Hashes allowed to wait for a worker before more are shed with a 503
+    password_hash_max_queue: int = 32
+    # Rehashing outdated passwords happens after login, in the background
+    password_rehash_queue_size: int = 1000
+    login_flush_interval: float = 5.0
+
+    # Login attempts, as token buckets: a sustained rate per minute plus
+    # a burst, per client IP and per email
+    login_rate_limit_ip_per_minute: float = 30.0
+    login_rate_limit_ip_burst: int = 10
+    login_rate_limit_email_per_minute: float = 5.0
+    login_rate_limit_email_burst: int = 5
+    # "module:Class" of a RateLimitBackend shared across workers, the
+    # default keeps buckets in process memory
+    rate_limit_backend: t.Optional[str] = None
+    rate_limit_max_keys: int = 100000
+
+    session_cache_ttl: float = 30.0
+    session_cache_negative_ttl: float = 5.0
+    session_cache_max_size: int = 10000
+    session_expiry_flush_interval: float = 5.0
+    # Seconds between runs of the expired session reaper, 0 disables it
+    session_reaper_interval: float = 60.0
+    session_reaper_batch_size: int = 1000
+    session_reaper_batch_pause: float = 0.1
+    # Set when the sessions table was created partitioned, see
+    # `piccolo home create_partitioned_sessions`
+    session_partitioning: bool = False
+    session_partitions_ahead: int = 2
+    # "database" keeps sessions in the sessions table, "signed" issues HMAC
+    # signed tokens that are verified without touching the database
+    session_backend: t.Literal["database", "signed"] = "database"
+    # Signing keys by id.  New tokens are signed with session_signing_key_id
+    # and every key listed verifies, so keys rotate by adding one, switching
+    # to it, and removing the old one once its tokens have expired.  Keys
+    # need at least 32 bytes, e.g. from `python -c "import secrets;
+    # print(secrets.token_urlsafe(32))"`.
+    session_signing_keys: t.Dict[str, str] = {}
+    session_signing_key_id: str = ""
+    # Seconds between reloads of revoked signed tokens from the database
+    session_revocation_sync_interval: float = 10.0
+
+    # Seconds a user's resolved scopes are cached.  Role and membership
+    # changes clear the cache of the worker making them, so this bounds how
+    # long other workers keep stale scopes.
+    permission_cache_ttl: float = 60.0
+    permission_cache_max_size: int = 10000
+
+    # Background jobs, kept in the tasks table.  Workers run from
+    # `python worker.py`, or inside the API process with job_worker_in_app.
+    # job_modules are imported to register handlers, and a worker only
+    # claims jobs it has a handler for.
+    job_worker_in_app: bool = False
+    job_modules: t.List[str] = []
+    # Jobs claimed per poll, and how many of them run at once
+    job_batch_size: int = 10
+    job_concurrency: int = 10
+    # Seconds between polls while the queue is empty
+    job_poll_interval: float = 1.0
+    # Seconds a claimed job may run before it's assumed lost and requeued
+    job_lease_seconds: float = 300.0
+    job_max_attempts: int = 5
+    # Retry delays double from job_backoff_base seconds up to job_backoff_max
+    job_backoff_base: float = 5.0
+    job_backoff_max: float = 3600.0
+    # Seconds between requeuing expired leases and refreshing queue depth
+    job_stats_interval: float = 15.0
+    # Port the standalone worker serves metrics on, 0 disables it
+    job_worker_metrics_port: int = 9101
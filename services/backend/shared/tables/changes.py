@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import typing as t
+
+from piccolo.columns import BigSerial, Text, Timestamp, Varchar
+from piccolo.table import Table
+
+from home.settings import settings
+from shared.lib.change_feed import CHANNEL, ChangeEvent, ChangeFeed
+from shared.lib.metrics import registry
+
+
+class Change(Table, tablename="changes"):
+    """
+    A log of writes to watched tables, appended to by triggers, so change
+    feed clients can resume from the last event they saw.
+    """
+
+    id = BigSerial(primary_key=True)
+    table_name = Varchar(length=63, null=False)
+    op = Varchar(length=6, null=False)
+    pk = Text(null=False)
+    created_at = Timestamp(null=False, index=True)
+
+    @classmethod
+    async def install_function(cls):
+        """
+        Creates the trigger function, the watched table's primary key column
+        is its argument.
+        """
+        await cls.raw(
+            "CREATE OR REPLACE FUNCTION log_change() RETURNS trigger AS $$\n"
+            "DECLARE\n"
+            "    row_pk text;\n"
+            "    change_id bigint;\n"
+            "BEGIN\n"
+            "    IF TG_OP = 'DELETE' THEN\n"
+            "        row_pk := to_jsonb(OLD) ->> TG_ARGV[0];\n"
+            "    ELSE\n"
+            "        row_pk := to_jsonb(NEW) ->> TG_ARGV[0];\n"
+            "    END IF;\n"
+            f"    INSERT INTO {cls._meta.tablename} "
+            "(table_name, op, pk, created_at)\n"
+            "    VALUES (TG_TABLE_NAME, TG_OP, row_pk, now())\n"
+            "    RETURNING id INTO change_id;\n"
+            f"    PERFORM pg_notify('{CHANNEL}', json_build_object(\n"
+            "        'id', change_id, 'table', TG_TABLE_NAME,\n"
+            "        'op', TG_OP, 'pk', row_pk\n"
+            "    )::text);\n"
+            "    RETURN NULL;\n"
+            "END;\n"
+            "$$ LANGUAGE plpgsql"
+        ).run()
+
+    @classmethod
+    async def watch(cls, table: t.Type[Table], ignore: t.Sequence[str] = ()):
+        """
+        Adds the change triggers to a table, after ``install_function``.
+        Updates only changing the ``ignore`` columns aren't logged.
+        """
+        tablename = table._meta.tablename
+        pk_name = table._meta.primary_key._meta.db_column_name
+        await cls.raw(
+            f"CREATE OR REPLACE TRIGGER {tablename}_log_change "
+            f"AFTER INSERT OR DELETE ON {tablename} "
+            f"FOR EACH ROW EXECUTE FUNCTION log_change('{pk_name}')"
+        ).run()
+
+        when = ""
+        if ignore:
+            # OLD and NEW can only be compared in an UPDATE trigger
+            names = ", ".join(
+                f"'{table._meta.get_column_by_name(name)._meta.db_column_name}'"
+                for name in ignore
+            )
+            when = (
+                f"WHEN ((to_jsonb(OLD) - ARRAY[{names}]) IS DISTINCT FROM "
+                f"(to_jsonb(NEW) - ARRAY[{names}])) "
+            )
+        await cls.raw(
+            f"CREATE OR REPLACE TRIGGER {tablename}_log_update "
+            f"AFTER UPDATE ON {tablename} FOR EACH ROW {when}"
+            f"EXECUTE FUNCTION log_change('{pk_name}')"
+        ).run()
+
+    @classmethod
+    async def since(
+        cls, tablename: str, after: int, limit: int
+    ) -> t.Optional[t.List[ChangeEvent]]:
+        """
+        The table's changes after the given id, or None if some of them
+        have been trimmed from the log or there are more than ``limit``.
+        """
+        oldest = await cls.select(cls.id).order_by(cls.id).first()
+        if oldest is None:
+            # Everything has been trimmed, so only the sequence knows whether
+            # there were changes after it
+            if await cls.last_id() > after:
+                return None
+            return []
+        if oldest["id"] > after + 1:
+            return None
+
+        rows = (
+            await cls.select(cls.id, cls.op, cls.pk)
+            .where((cls.id > after) & (cls.table_name == tablename))
+            .order_by(cls.id)
+            .limit(limit + 1)
+        )
+        if len(rows) > limit:
+            return None
+
+        return [ChangeEvent(row["id"], tablename, row["op"], row["pk"]) for row in rows]
+
+    @classmethod
+    async def last_id(cls) -> int:
+        """
+        The highest id handed out, including to changes since trimmed.
+        """
+        tablename = cls._meta.tablename
+        rows = await cls.raw(
+            "SELECT COALESCE(pg_sequence_last_value("
+            f"pg_get_serial_sequence('{tablename}', 'id')::regclass), 0) AS id"
+        ).run()
+        return rows[0]["id"]
+
+    @classmethod
+    async def trim(cls, retention: float) -> int:
+        """
+        Deletes changes older than ``retention`` seconds, returning how many.
+        """
+        rows = await cls.raw(
+            f"WITH deleted AS (DELETE FROM {cls._meta.tablename} "
+            "WHERE created_at < now() - {} * interval '1 second' RETURNING 1) "
+            "SELECT count(*) AS count FROM deleted",
+            retention,
+        ).run()
+        return rows[0]["count"]
+
+
+change_feed = ChangeFeed(
+    queue_size=settings.crud_changes_queue_size,
+    max_subscribers=settings.crud_changes_max_subscribers,
+    retention=settings.crud_changes_retention,
+    trim=lambda retention: Change.trim(retention),
+)
+
+registry.stats(
+    "change_feed",
+    "Change feed: listen connection up and subscribers.",
+    lambda: change_feed.stats(),
+    counters=("events", "dropped"),
+    counter_documentation="Change feed: events received and slow subscribers dropped.",
+)
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import typing as t
+
+from piccolo.columns import ForeignKey, Varchar
+from piccolo.columns.column_types import Timestamptz
+from piccolo.columns.defaults.timestamptz import TimestamptzNow
+from piccolo.table import Table
+
+from shared.tables.roles import Role, scope_resolver
+
+
+class RoleScope(Table, tablename="role_scopes"):
+    """
+    A scope, like ``tasks:write``, granted by a role.
+    """
+
+    role_id = ForeignKey(Role, null=False, index=True)
+    scope = Varchar(length=255, null=False)
+    created_at = Timestamptz(default=TimestamptzNow)
+
+    @classmethod
+    async def grant(cls, role_id: t.Any, scope: str):
+        await cls.insert(cls(role_id=role_id, scope=scope)).run()
+        scope_resolver.invalidate()
+
+    @classmethod
+    async def revoke(cls, role_id: t.Any, scope: str):
+        await cls.delete().where((cls.role_id == role_id) & (cls.scope == scope)).run()
+        scope_resolver.invalidate()
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import typing as t
+
+from piccolo.columns.column_types import UUID, Text, Timestamptz
+from piccolo.columns.defaults.timestamptz import TimestamptzNow
+from piccolo.columns.defaults.uuid import UUID4
+from piccolo.table import Table
+
+from home.settings import settings
+from shared.lib.metrics import registry
+from shared.lib.permissions import ScopeResolver
+
+
+class Role(Table, tablename="roles"):
+    """
+    A named set of scopes, granted to users through their groups.
+    """
+
+    id = UUID(primary_key=True, default=UUID4)
+    name = Text(null=False, unique=True)
+    created_at = Timestamptz(default=TimestamptzNow)
+    updated_at = Timestamptz(default=TimestamptzNow)
+
+    @classmethod
+    async def scopes_for_user(cls, user_id: t.Any) -> t.List[str]:
+        """
+        The scopes of every role of every group an active user belongs to,
+        in one query.
+        """
+        rows = await cls.raw(
+            "SELECT DISTINCT rs.scope FROM users u "
+            "JOIN user_group_members m ON m.user_id = u.id "
+            "JOIN user_group_roles gr ON gr.user_group_id = m.user_group_id "
+            "JOIN role_scopes rs ON rs.role_id = gr.role_id "
+            "WHERE u.id = {} AND u.active",
+            user_id,
+        ).run()
+        return [row["scope"] for row in rows]
+
+
+scope_resolver = ScopeResolver(
+    ttl=settings.permission_cache_ttl,
+    max_size=settings.permission_cache_max_size,
+    load=lambda user_id: Role.scopes_for_user(user_id),
+)
+
+registry.stats(
+    "permission_cache",
+    "Resolved user scopes cache: size and known scopes.",
+    lambda: scope_resolver.stats(),
+    counters=("hits", "misses"),
+    counter_documentation="Resolved user scopes cache lookups: hits and misses.",
+)
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-import secrets
+import re
+import time
 import typing as t
-from datetime import datetime, timedelta
+import uuid
+from datetime import date, datetime, timedelta
 
-from piccolo.columns import Integer, Serial, Timestamp, Varchar
+from piccolo.columns import ForeignKey, Integer, Serial, Timestamp, Varchar
 from piccolo.columns.defaults.timestamp import TimestampOffset
 from piccolo.columns.column_types import UUID, Text, Timestamptz
 from piccolo.columns.defaults.timestamptz import TimestamptzNow
@@ -13,29 +15,40 @@ from piccolo.columns.defaults.uuid import UUID4
 from piccolo.table import Table
 from piccolo.utils.sync import run_sync
 
+from home.settings import settings
+from shared.lib.metrics import registry
+from shared.lib.replicas import replica_router
+from shared.lib.session_cache import MISSING, CachedSession, SessionCache
+from shared.lib.session_reaper import SessionReaper
+from shared.lib.signed_sessions import RevocationList, TokenSigner
 from shared.tables.users import User
 
 
 class Session(Table, tablename="sessions"):
     """
     Use this table, or inherit from it, to create a session store.
+
+    With ``session_backend = "signed"`` sessions aren't stored at all: tokens
+    are signed and carry the user id and expiry, and only revoked tokens
+    are written, to ``RevokedSession``.  Signed tokens can't be extended, a
+    client gets a new one by logging in again.
     """
 
-    id = UUID(default=UUID4)
+    id = UUID(primary_key=True, default=UUID4)
 
     #: Stores the user ID.
     user_id: UUID = ForeignKey(User, null=False)
 
     #: Stores the expiry date for this session.
     expiry_date: Timestamp = Timestamp(
-        default=TimestampOffset(hours=1), null=False
+        default=TimestampOffset(hours=1), null=False, index=True
     )
 
     #: We set a hard limit on the expiry date - it can keep on getting extended
     #: up until this value, after which it's best to invalidate it, and either
     #: require login again, or just create a new session token.
     max_expiry_date: Timestamp = Timestamp(
-        default=TimestampOffset(days=7), null=False
+        default=TimestampOffset(days=7), null=False, index=True
     )
     created_at = Timestamptz(default=TimestamptzNow)
     updated_at = Timestamptz(default=TimestamptzNow)
@@ -48,14 +61,14 @@ class Session(Table, tablename="sessions"):
         max_expiry_date: t.Optional[datetime] = None,
     ) -> SessionsBase:
         """
-        Creates a session in the database.
+        Creates a session in the database, or signs one.
         """
-        while True:
-            token = secrets.token_urlsafe(nbytes=32)
-            if not await cls.exists().where(cls.token == token).run():
-                break
+        if token_signer is not None:
+            return cls._create_signed_session(user_id, expiry_date, max_expiry_date)
 
-        session = cls(id=token, user_id=user_id)
+        # The token is the id, a random UUID, so there's no need to check
+        # it's unused before inserting
+        session = cls(user_id=user_id)
         if expiry_date:
             session.expiry_date = expiry_date
         if max_expiry_date:
@@ -77,30 +90,351 @@ class Session(Table, tablename="sessions"):
             If set, the ``expiry_date`` will be increased by the given amount
             if it's close to expiring. If it has already expired, nothing
             happens. The ``max_expiry_date`` remains the same, so there's a
-            hard limit on how long a session can be used for.
+            hard limit on how long a session can be used for.  Ignored for
+            signed tokens.
         """
-        session = await cls.objects().where(cls.id == token).first().run()
+        if token_signer is not None:
+            return cls._signed_user_id(token)
+
+        session = session_cache.get(token)
+        if session is MISSING:
+            query = (
+                cls.select(cls.user_id, cls.expiry_date, cls.max_expiry_date)
+                .where(cls.id == token)
+                .first()
+            )
+            node = replica_router.read_node()
+            row = await query.run(node=node)
+            if not row and node is not None:
+                # A brand new session may not have reached the replica yet
+                row = await query.run()
+            session = CachedSession(**row) if row else None
+            session_cache.put(token, session)
 
         if not session:
             return None
 
         now = datetime.now()
         if (session.expiry_date > now) and (session.max_expiry_date > now):
-            if increase_expiry and (
-                t.cast(datetime, session.expiry_date) - now < increase_expiry
-            ):
-                session.expiry_date = (
-                    t.cast(datetime, session.expiry_date) + increase_expiry
+            if increase_expiry and (session.expiry_date - now < increase_expiry):
+                # Written back in batches by the session cache
+                session_cache.extend(
+                    token,
+                    session._replace(expiry_date=session.expiry_date + increase_expiry),
                 )
-                await session.save().run()
 
             return t.cast(t.Optional[int], session.user_id)
         else:
             return None
 
+    @classmethod
+    async def flush_expiry_extensions(cls, extensions: t.Dict[str, datetime]):
+        """
+        Writes a batch of extended expiry dates in a single UPDATE.
+        """
+        await cls.raw(
+            f"UPDATE {cls._meta.tablename} AS s "
+            "SET expiry_date = v.expiry_date, updated_at = now() "
+            "FROM unnest({}::uuid[], {}::timestamp[]) AS v(id, expiry_date) "
+            "WHERE s.id = v.id",
+            list(extensions.keys()),
+            list(extensions.values()),
+        ).run()
+
     @classmethod
     async def remove_session(cls, token: str):
         """
-        Deletes a matching session from the database.
+        Deletes a matching session from the database, or revokes it.
         """
+        if token_signer is not None:
+            payload = token_signer.verify(token)
+            if payload is not None and payload.expires_at > time.time():
+                await revocation_list.revoke(payload)
+            return
+
+        session_cache.invalidate(token)
         await cls.delete().where(cls.id == token).run()
+
+    ###########################################################################
+    # Signed tokens
+
+    @classmethod
+    def _create_signed_session(
+        cls,
+        user_id: UUID,
+        expiry_date: t.Optional[datetime],
+        max_expiry_date: t.Optional[datetime],
+    ) -> Session:
+        # A signed token can't be extended, so max_expiry_date only matters
+        # when it comes before expiry_date
+        expires = min(
+            expiry_date or datetime.now() + timedelta(hours=1),
+            max_expiry_date or datetime.now() + timedelta(days=7),
+        )
+        token, _ = token_signer.sign(user_id, expires.timestamp())
+        session = cls(user_id=user_id, expiry_date=expires, max_expiry_date=expires)
+        # Assigned afterwards, the constructor would take it for a UUID
+        session.id = token
+        return session
+
+    @classmethod
+    def _signed_user_id(cls, token: str) -> t.Optional[uuid.UUID]:
+        payload = token_signer.verify(token)
+        if (
+            payload is None
+            or payload.expires_at <= time.time()
+            or revocation_list.is_revoked(payload.token_id)
+        ):
+            return None
+        return uuid.UUID(payload.user_id)
+
+    ###########################################################################
+    # Reaping
+
+    @classmethod
+    async def reap_expired(cls, batch_size: int) -> int:
+        """
+        Deletes up to ``batch_size`` expired sessions, returning how many.
+        """
+        now = datetime.now()
+        rows = await cls.raw(
+            f"WITH deleted AS (DELETE FROM {cls._meta.tablename} WHERE id IN ("
+            f"SELECT id FROM {cls._meta.tablename} "
+            "WHERE expiry_date < {} OR max_expiry_date < {} "
+            "LIMIT {} FOR UPDATE SKIP LOCKED"
+            ") RETURNING 1) SELECT count(*) AS count FROM deleted",
+            now,
+            now,
+            batch_size,
+        ).run()
+        return rows[0]["count"]
+
+    @classmethod
+    async def count_expired(cls, limit: int = 100000) -> int:
+        """
+        Counts expired sessions waiting to be reaped, up to ``limit``.
+        """
+        now = datetime.now()
+        rows = await cls.raw(
+            "SELECT count(*) AS count FROM ("
+            f"SELECT 1 FROM {cls._meta.tablename} "
+            "WHERE expiry_date < {} OR max_expiry_date < {} LIMIT {}"
+            ") AS expired",
+            now,
+            now,
+            limit,
+        ).run()
+        return rows[0]["count"]
+
+    ###########################################################################
+    # Partitioning
+    #
+    # Optionally the table is partitioned by month of max_expiry_date. Every
+    # session in a partition whose month has passed is past its hard expiry,
+    # so the whole partition can be dropped instead of deleting its rows.
+
+    @classmethod
+    def _partition_name(cls, month: date) -> str:
+        return f"{cls._meta.tablename}_p{month.year:04d}_{month.month:02d}"
+
+    @staticmethod
+    def _next_month(month: date) -> date:
+        return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+    @classmethod
+    async def create_partitioned_table(cls):
+        """
+        Creates the table partitioned by month of ``max_expiry_date``. Only
+        for new databases, an existing table has to be migrated by hand.
+        """
+        # A declared id replaces the implicit serial primary key
+        columns = {column._meta.name: column for column in cls._meta.columns}
+        definitions = ", ".join(
+            column.ddl.replace(" PRIMARY KEY", "") for column in columns.values()
+        )
+        tablename = cls._meta.tablename
+        await cls.raw(
+            f"CREATE TABLE IF NOT EXISTS {tablename} ({definitions}, "
+            "PRIMARY KEY (id, max_expiry_date)) "
+            "PARTITION BY RANGE (max_expiry_date)"
+        ).run()
+        for column in ("expiry_date", "max_expiry_date"):
+            await cls.raw(
+                f"CREATE INDEX IF NOT EXISTS {tablename}_{column} "
+                f"ON {tablename} ({column})"
+            ).run()
+        await cls.ensure_partitions(settings.session_partitions_ahead)
+
+    @classmethod
+    async def ensure_partitions(cls, months_ahead: int):
+        """
+        Creates the DEFAULT partition, and the partitions for this month and
+        the next ``months_ahead``.  Sessions for any other month go to the
+        DEFAULT partition rather than failing to insert, and are moved out
+        once their month's partition is created.
+        """
+        tablename = cls._meta.tablename
+        await cls.raw(
+            f"CREATE TABLE IF NOT EXISTS {tablename}_default "
+            f"PARTITION OF {tablename} DEFAULT"
+        ).run()
+
+        month = date.today().replace(day=1)
+        for _ in range(months_ahead + 1):
+            if not await cls._table_exists(cls._partition_name(month)):
+                async with cls._meta.db.transaction():
+                    await cls._create_partition(month)
+            month = cls._next_month(month)
+
+    @classmethod
+    async def _table_exists(cls, name: str) -> bool:
+        rows = await cls.raw("SELECT to_regclass({}) IS NOT NULL AS exists", name).run()
+        return rows[0]["exists"]
+
+    @classmethod
+    async def _create_partition(cls, month: date):
+        """
+        Creates a month's partition, moving its sessions out of the DEFAULT
+        partition first, as Postgres won't attach a partition whose rows are
+        in the DEFAULT one.  Must be called inside a transaction.
+        """
+        tablename = cls._meta.tablename
+        partition = cls._partition_name(month)
+        next_month = cls._next_month(month)
+
+        # Workers maintaining partitions at the same time take turns
+        await cls.raw("SELECT pg_advisory_xact_lock(hashtext({}))", tablename).run()
+        if await cls._table_exists(partition):
+            return
+
+        await cls.raw(
+            f"CREATE TABLE {partition} (LIKE {tablename} INCLUDING DEFAULTS)"
+        ).run()
+        await cls.raw(
+            f"WITH moved AS (DELETE FROM {tablename}_default "
+            "WHERE max_expiry_date >= {} AND max_expiry_date < {} RETURNING *) "
+            f"INSERT INTO {partition} SELECT * FROM moved",
+            datetime(month.year, month.month, 1),
+            datetime(next_month.year, next_month.month, 1),
+        ).run()
+        await cls.raw(
+            f"ALTER TABLE {tablename} ATTACH PARTITION {partition} "
+            f"FOR VALUES FROM ('{month.isoformat()}') "
+            f"TO ('{next_month.isoformat()}')"
+        ).run()
+
+    @classmethod
+    async def drop_expired_partitions(cls) -> int:
+        """
+        Drops partitions for months that have passed, returning how many.
+        """
+        rows = await cls.raw(
+            "SELECT c.relname AS name FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass({})",
+            cls._meta.tablename,
+        ).run()
+
+        pattern = re.compile(
+            rf"^{re.escape(cls._meta.tablename)}_p(\d{{4}})_(\d{{2}})$"
+        )
+        this_month = date.today().replace(day=1)
+        dropped = 0
+        for row in rows:
+            match = pattern.match(row["name"])
+            if match and date(int(match[1]), int(match[2]), 1) < this_month:
+                await cls.raw(f"DROP TABLE IF EXISTS {row['name']}").run()
+                dropped += 1
+        return dropped
+
+    @classmethod
+    async def maintain_partitions(cls) -> int:
+        await cls.ensure_partitions(settings.session_partitions_ahead)
+        return await cls.drop_expired_partitions()
+
+
+class RevokedSession(Table, tablename="revoked_sessions"):
+    """
+    Signed session tokens revoked before their expiry.
+    """
+
+    token_id = Varchar(length=32, primary_key=True)
+    expires_at = Timestamp(null=False, index=True)
+
+    @classmethod
+    async def store(cls, token_id: str, expires_at: float):
+        await cls.insert(
+            cls(token_id=token_id, expires_at=datetime.fromtimestamp(expires_at))
+        ).on_conflict(action="DO NOTHING").run()
+
+    @classmethod
+    async def load(cls) -> t.Dict[str, float]:
+        """
+        Purges revocations of tokens which have expired anyway, and returns
+        the rest.
+        """
+        now = datetime.now()
+        await cls.delete().where(cls.expires_at <= now).run()
+        rows = await cls.select(cls.token_id, cls.expires_at).where(
+            cls.expires_at > now
+        )
+        return {row["token_id"]: row["expires_at"].timestamp() for row in rows}
+
+
+token_signer = (
+    TokenSigner(settings.session_signing_keys, settings.session_signing_key_id)
+    if settings.session_backend == "signed"
+    else None
+)
+
+revocation_list = RevocationList(
+    sync_interval=settings.session_revocation_sync_interval,
+    store=lambda token_id, expires_at: RevokedSession.store(token_id, expires_at),
+    load=lambda: RevokedSession.load(),
+)
+
+session_cache = SessionCache(
+    ttl=settings.session_cache_ttl,
+    negative_ttl=settings.session_cache_negative_ttl,
+    max_size=settings.session_cache_max_size,
+    flush_interval=settings.session_expiry_flush_interval,
+    flush=lambda extensions: Session.flush_expiry_extensions(extensions),
+)
+
+session_reaper = SessionReaper(
+    interval=settings.session_reaper_interval,
+    batch_size=settings.session_reaper_batch_size,
+    batch_pause=settings.session_reaper_batch_pause,
+    reap=lambda batch_size: Session.reap_expired(batch_size),
+    count_backlog=lambda: Session.count_expired(),
+    maintain_partitions=(
+        (lambda: Session.maintain_partitions())
+        if settings.session_partitioning
+        else None
+    ),
+)
+
+registry.stats(
+    "session_reaper",
+    "Expired session reaper: backlog of expired sessions and the duration of "
+    "the last run.",
+    lambda: session_reaper.stats(),
+    counters=("reaped", "partitions_dropped"),
+    counter_documentation="Expired session reaper: sessions reaped and "
+    "partitions dropped.",
+)
+
+registry.callback(
+    "session_revocations",
+    "Signed session tokens revoked and not yet expired.",
+    ("stat",),
+    lambda: {(key,): value for key, value in revocation_list.stats().items()},
+)
+
+registry.stats(
+    "session_cache",
+    "Session token cache: size and pending expiry extensions.",
+    lambda: session_cache.stats(),
+    counters=("hits", "misses"),
+    counter_documentation="Session token cache lookups: hits and misses.",
+)
@@ -1,11 +1,197 @@
+import datetime
+import importlib
+import json
+import typing as t
+
 from piccolo.table import Table
-from piccolo.columns import Varchar, Boolean
+from piccolo.columns import Boolean, Integer, JSONB, Text, Timestamptz, Varchar
+from piccolo.columns.defaults.timestamptz import TimestamptzNow
+
+from home.settings import settings
+from shared.lib.db import sql_type
+from shared.lib.jobs import Job, JobQueue
+from shared.lib.metrics import registry
 
 
 class Task(Table):
     """
-    An example table.
+    An example table, which is also the background job queue: ``name`` is
+    the job's handler, see ``shared.lib.jobs``.
     """
 
-    name = Varchar()
+    name = Varchar(index=True)
     completed = Boolean(default=False)
+    payload = JSONB(default={})
+    #: queued, running, done or failed
+    status = Varchar(length=16, default="queued")
+    #: Higher runs first
+    priority = Integer(default=0)
+    attempts = Integer(default=0)
+    max_attempts = Integer(default=settings.job_max_attempts)
+    run_at = Timestamptz(default=TimestamptzNow)
+    lease_expires_at = Timestamptz(null=True, default=None)
+    last_error = Text(null=True, default=None)
+
+    @classmethod
+    async def enqueue(
+        cls,
+        name: str,
+        payload: t.Any = None,
+        run_at: t.Optional[datetime.datetime] = None,
+        priority: int = 0,
+        max_attempts: t.Optional[int] = None,
+    ) -> t.Any:
+        """
+        Queues a job, returning its id.
+        """
+        task = cls(name=name, payload=payload or {}, priority=priority)
+        if run_at is not None:
+            task.run_at = run_at
+        if max_attempts is not None:
+            task.max_attempts = max_attempts
+        rows = await cls.insert(task).returning(cls._meta.primary_key)
+        return rows[0][cls._meta.primary_key._meta.name]
+
+    @classmethod
+    async def create_job_indexes(cls):
+        """
+        Partial indexes covering only the jobs workers look for.
+        """
+        tablename = cls._meta.tablename
+        await cls.raw(
+            f"CREATE INDEX IF NOT EXISTS {tablename}_due ON {tablename} "
+            "(priority DESC, run_at) WHERE status = 'queued'"
+        ).run()
+        await cls.raw(
+            f"CREATE INDEX IF NOT EXISTS {tablename}_leased ON {tablename} "
+            "(lease_expires_at) WHERE status = 'running'"
+        ).run()
+
+    ###########################################################################
+    # JobStore
+
+    @classmethod
+    async def dequeue(
+        cls, names: t.List[str], batch_size: int, lease: float
+    ) -> t.List[Job]:
+        """
+        Claims up to ``batch_size`` due jobs which have a handler here.
+        """
+        tablename = cls._meta.tablename
+        rows = await cls.raw(
+            f"UPDATE {tablename} AS t SET status = 'running', "
+            "attempts = t.attempts + 1, "
+            "lease_expires_at = now() + {} * interval '1 second' "
+            f"FROM (SELECT id FROM {tablename} "
+            "WHERE status = 'queued' AND run_at <= now() "
+            "AND name = ANY({}::varchar[]) "
+            "ORDER BY priority DESC, run_at LIMIT {} "
+            "FOR UPDATE SKIP LOCKED) AS due "
+            "WHERE t.id = due.id "
+            "RETURNING t.id, t.name, t.payload, t.attempts, t.max_attempts, "
+            "t.run_at",
+            lease,
+            names,
+            batch_size,
+        ).run()
+        return [
+            Job(
+                row["id"],
+                row["name"],
+                json.loads(row["payload"]) if row["payload"] else {},
+                row["attempts"],
+                row["max_attempts"],
+                row["run_at"],
+            )
+            for row in rows
+        ]
+
+    @classmethod
+    async def complete(cls, ids: t.List[t.Any]):
+        await cls.raw(
+            f"UPDATE {cls._meta.tablename} SET status = 'done', "
+            "completed = true, lease_expires_at = NULL "
+            f"WHERE id = ANY({{}}::{sql_type(cls._meta.primary_key)}[])",
+            ids,
+        ).run()
+
+    @classmethod
+    async def retry(cls, job_id: t.Any, delay: float, error: str):
+        await cls.raw(
+            f"UPDATE {cls._meta.tablename} SET status = 'queued', "
+            "run_at = now() + {} * interval '1 second', "
+            "lease_expires_at = NULL, last_error = {} WHERE id = {}",
+            delay,
+            error,
+            job_id,
+        ).run()
+
+    @classmethod
+    async def fail(cls, job_id: t.Any, error: str):
+        await cls.raw(
+            f"UPDATE {cls._meta.tablename} SET status = 'failed', "
+            "lease_expires_at = NULL, last_error = {} WHERE id = {}",
+            error,
+            job_id,
+        ).run()
+
+    @classmethod
+    async def requeue_expired(cls) -> int:
+        """
+        Queues jobs again whose worker lost its lease, or fails them if they
+        are out of attempts, returning how many.
+        """
+        rows = await cls.raw(
+            f"WITH expired AS (UPDATE {cls._meta.tablename} SET "
+            "status = CASE WHEN attempts >= max_attempts "
+            "THEN 'failed' ELSE 'queued' END, "
+            "lease_expires_at = NULL, last_error = 'Lease expired' "
+            "WHERE status = 'running' AND lease_expires_at < now() "
+            "RETURNING 1) SELECT count(*) AS count FROM expired"
+        ).run()
+        return rows[0]["count"]
+
+    @classmethod
+    async def queue_stats(cls, names: t.List[str]) -> t.Tuple[int, float]:
+        """
+        The number of due jobs which have a handler here, and how many
+        seconds the oldest has been waiting.
+        """
+        rows = await cls.raw(
+            "SELECT count(*) AS due, "
+            "COALESCE(EXTRACT(EPOCH FROM now() - min(run_at)), 0) AS oldest "
+            f"FROM {cls._meta.tablename} "
+            "WHERE status = 'queued' AND run_at <= now() "
+            "AND name = ANY({}::varchar[])",
+            names,
+        ).run()
+        return rows[0]["due"], float(rows[0]["oldest"])
+
+
+job_queue = JobQueue(
+    store=Task,
+    batch_size=settings.job_batch_size,
+    concurrency=settings.job_concurrency,
+    poll_interval=settings.job_poll_interval,
+    lease=settings.job_lease_seconds,
+    backoff_base=settings.job_backoff_base,
+    backoff_max=settings.job_backoff_max,
+    stats_interval=settings.job_stats_interval,
+)
+
+
+def load_job_modules() -> None:
+    """
+    Import the modules in ``job_modules``, registering their handlers
+    """
+    for module in settings.job_modules:
+        importlib.import_module(module)
+
+
+registry.callback(
+    "job_queue",
+    "Background jobs: due jobs waiting, seconds the oldest has waited, jobs "
+    "running and handlers registered in this process.",
+    ("stat",),
+    lambda: {(key,): value for key, value in job_queue.stats().items()},
+)
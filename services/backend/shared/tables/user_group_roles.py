@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import typing as t
+
+from piccolo.columns import ForeignKey
+from piccolo.columns.column_types import Timestamptz
+from piccolo.columns.defaults.timestamptz import TimestamptzNow
+from piccolo.table import Table
+
+from shared.tables.roles import Role, scope_resolver
+from shared.tables.user_groups import UserGroup
+
+
+class UserGroupRole(Table, tablename="user_group_roles"):
+    """
+    A role held by every member of a group.
+    """
+
+    user_group_id = ForeignKey(UserGroup, null=False, index=True)
+    role_id = ForeignKey(Role, null=False, index=True)
+    created_at = Timestamptz(default=TimestamptzNow)
+
+    @classmethod
+    async def assign(cls, user_group_id: t.Any, role_id: t.Any):
+        await cls.insert(cls(user_group_id=user_group_id, role_id=role_id)).run()
+        scope_resolver.invalidate()
+
+    @classmethod
+    async def unassign(cls, user_group_id: t.Any, role_id: t.Any):
+        await cls.delete().where(
+            (cls.user_group_id == user_group_id) & (cls.role_id == role_id)
+        ).run()
+        scope_resolver.invalidate()
@@ -4,16 +4,40 @@ import secrets
 import typing as t
 from datetime import datetime, timedelta
 
-from piccolo.columns import Integer, Serial, Timestamp, Varchar
+from piccolo.columns import ForeignKey, Integer, Serial, Timestamp, Varchar
 from piccolo.columns.column_types import UUID, Text, Timestamptz
 from piccolo.columns.defaults.timestamptz import TimestamptzNow
 from piccolo.columns.defaults.uuid import UUID4
 from piccolo.table import Table
 
+from shared.tables.roles import scope_resolver
+from shared.tables.users import User
+
 
 class UserGroup(Table, tablename="user_groups"):
-    id = UUID(default=UUID4)
+    id = UUID(primary_key=True, default=UUID4)
     name = Text(null=False)
     created_at = Timestamptz(default=TimestamptzNow)
     updated_at = Timestamptz(default=TimestamptzNow)
 
+
+class UserGroupMember(Table, tablename="user_group_members"):
+    """
+    Membership of a user in a group.
+    """
+
+    user_id = ForeignKey(User, null=False, index=True)
+    user_group_id = ForeignKey(UserGroup, null=False, index=True)
+    created_at = Timestamptz(default=TimestamptzNow)
+
+    @classmethod
+    async def add(cls, user_id: t.Any, user_group_id: t.Any):
+        await cls.insert(cls(user_id=user_id, user_group_id=user_group_id)).run()
+        scope_resolver.invalidate(user_id)
+
+    @classmethod
+    async def remove(cls, user_id: t.Any, user_group_id: t.Any):
+        await cls.delete().where(
+            (cls.user_id == user_id) & (cls.user_group_id == user_group_id)
+        ).run()
+        scope_resolver.invalidate(user_id)
@@ -16,6 +16,13 @@ from piccolo.columns.defaults.timestamptz import TimestamptzNow
 from piccolo.columns.defaults.uuid import UUID4
 from piccolo.table import Table
 
+from home.settings import settings
+from shared.lib.db import sql_type
+from shared.lib.hashing import hashing_pool
+from shared.lib.login_tasks import LoginTasks
+from shared.lib.metrics import registry
+from shared.lib.rate_limit import LOGIN_BY_EMAIL, LOGIN_BY_IP, rate_limiter
+
 logger = logging.getLogger(__name__)
 
 
@@ -24,7 +31,7 @@ class User(Table, tablename="users"):
     Provides a basic user, with authentication support.
     """
 
-    id = UUID(default=UUID4)
+    id = UUID(primary_key=True, default=UUID4)
     active = Boolean(default=True)
     email = Varchar(length=255, unique=True)
     password = Secret(length=255)
@@ -85,9 +92,7 @@ class User(Table, tablename="users"):
             )
 
         if password.startswith("pbkdf2_sha256"):
-            logger.warning(
-                "Tried to create a user with an already hashed password."
-            )
+            logger.warning("Tried to create a user with an already hashed password.")
             raise ValueError("Do not pass a hashed password.")
 
     ###########################################################################
@@ -100,7 +105,7 @@ class User(Table, tablename="users"):
         """
         cls._validate_password(password=password)
 
-        password = cls.hash_password(password)
+        password = await cls.hash_password_async(password)
         await cls.update({cls.password: password}).where(cls.id == user_id).run()
 
     ###########################################################################
@@ -135,6 +140,16 @@ class User(Table, tablename="users"):
         ).hex()
         return f"pbkdf2_sha256${iterations}${salt}${hashed}"
 
+    @classmethod
+    async def hash_password_async(
+        cls, password: str, salt: str = "", iterations: t.Optional[int] = None
+    ) -> str:
+        """
+        Same as :meth:`hash_password`, but runs on the hashing pool so the
+        event loop is not blocked.
+        """
+        return await hashing_pool.run(cls.hash_password, password, salt, iterations)
+
     def __setattr__(self, name: str, value: t.Any):
         """
         Make sure that if the password is set, it's stored in a hashed form.
@@ -154,11 +169,20 @@ class User(Table, tablename="users"):
     ###########################################################################
 
     @classmethod
-    async def login(cls, email: str, password: str) -> t.Optional[int]:
+    async def login(cls, email: str, password: str, ip: str) -> t.Optional[int]:
         """
         Make sure the user exists and the password is valid. If so, the
-        ``last_login`` value is updated in the database.
-
+        ``last_login`` value is queued to be written to the database, and a
+        password hashed with an outdated iteration count is queued to be
+        rehashed.
+
+        :param ip:
+            The client's address, e.g. ``request.client.host``.  Attempts are
+            rate limited per address as well as per email.
+        :raises TooManyRequestsException:
+            If either rate limit has been hit.
+        :raises ServiceUnavailableException:
+            If too many hashes are already queued.
         :returns:
             The id of the user if a match is found, otherwise ``None``.
 
@@ -171,8 +195,12 @@ class User(Table, tablename="users"):
             logger.warning("Excessively long password provided.")
             return None
 
+        # Before any hashing, which is what these protect
+        await rate_limiter.check(LOGIN_BY_IP, ip)
+        await rate_limiter.check(LOGIN_BY_EMAIL, email.lower())
+
         response = (
-            await cls.select(cls._meta.primary_key, cls.password)
+            await cls.select(cls._meta.primary_key, cls.password, cls.active)
             .where(cls.email == email)
             .first()
             .run()
@@ -182,7 +210,7 @@ class User(Table, tablename="users"):
             # here to mitigate the ability to enumerate
             # users via response timings
             # TODO: could alos just SLEEP
-            cls.hash_password(password)
+            await cls.hash_password_async(password)
             return None
 
         if not response["active"]:
@@ -196,16 +224,14 @@ class User(Table, tablename="users"):
         )
         iterations = int(iterations_)
 
-        if cls.hash_password(password, salt, iterations) == stored_password:
+        if await cls.hash_password_async(password, salt, iterations) == stored_password:
             # If the password was hashed in an earlier Piccolo version, update
             # it so it's hashed with the currently recommended number of
             # iterations:
             if iterations != cls._pbkdf2_iteration_count:
-                await cls.update_password(response["id"], password)
+                login_tasks.schedule_rehash(response["id"], password)
 
-            await cls.update({cls.last_login: datetime.datetime.now()}).where(
-                cls.email == email
-            )
+            login_tasks.record_login(response["id"], datetime.datetime.now())
             return response["id"]
         else:
             return None
@@ -213,9 +239,7 @@ class User(Table, tablename="users"):
     ###########################################################################
 
     @classmethod
-    async def create_user(
-        cls, email: str, password: str, **extra_params
-    ) -> User:
+    async def create_user(cls, email: str, password: str, **extra_params) -> User:
         """
         Creates a new user, and saves it in the database. It is recommended to
         use this rather than instantiating and saving ``User`` directly, as
@@ -232,6 +256,41 @@ class User(Table, tablename="users"):
 
         cls._validate_password(password=password)
 
+        # Hash up front so __init__ doesn't do it on the event loop
+        password = await cls.hash_password_async(password)
         user = cls(email=email, password=password, **extra_params)
         await user.save()
-        return user
\ No newline at end of file
+        return user
+
+    @classmethod
+    async def flush_last_logins(cls, logins: t.Dict[t.Any, datetime.datetime]):
+        """
+        Writes a batch of ``last_login`` values in a single UPDATE.
+        """
+        primary_key = cls._meta.primary_key
+        await cls.raw(
+            f"UPDATE {cls._meta.tablename} AS u "
+            "SET last_login = v.last_login "
+            f"FROM unnest({{}}::{sql_type(primary_key)}[], {{}}::timestamp[]) "
+            "AS v(id, last_login) "
+            f'WHERE u."{primary_key._meta.db_column_name}" = v.id',
+            list(logins.keys()),
+            list(logins.values()),
+        ).run()
+
+
+login_tasks = LoginTasks(
+    flush_interval=settings.login_flush_interval,
+    max_rehash_queue=settings.password_rehash_queue_size,
+    flush=lambda logins: User.flush_last_logins(logins),
+    rehash=lambda user_id, password: User.update_password(user_id, password),
+)
+
+registry.stats(
+    "login_tasks",
+    "Deferred login work: pending last_login updates and queued rehashes.",
+    lambda: login_tasks.stats(),
+    counters=("rehashed", "rehash_dropped"),
+    counter_documentation="Passwords rehashed after login, and rehashes "
+    "dropped with the queue full.",
+)